@@ -1,6 +1,6 @@
-import lxml.etree as ET
 import wx
 
+from document import Document
 from edit_dialog import EditDialog
 from pubsub import pub
 
@@ -19,18 +19,16 @@ class NodeDialog(EditDialog):
         tells the UI to update to display the new element
         before destroying the dialog
         """
-        element = ET.SubElement(
-            self.xml_obj, self.value_one.GetValue())
-        element.text = self.value_two.GetValue()
+        edit = self.document.add_node(self.xml_obj, self.value_one.GetValue(),
+                                      self.value_two.GetValue())
         pub.sendMessage('tree_update_{}'.format(self.page_id),
-                        xml_obj=element)
-        pub.sendMessage('on_change_{}'.format(self.page_id),
-                        event=None)
+                        xml_obj=edit.element)
         self.Close()
 
 if __name__ == '__main__':
     app = wx.App(False)
-    dlg = NodeDialog('', title='Test',
+    dlg = NodeDialog('', page_id=None, document=Document(),
+                     title='Test',
                      label_one='Element',
                      label_two='Value')
     dlg.Destroy()
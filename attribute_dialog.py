@@ -21,11 +21,9 @@ class AttributeDialog(EditDialog):
         attr = self.value_one.GetValue()
         value = self.value_two.GetValue()
         if attr:
-            self.xml_obj.attrib[attr] = value
+            self.document.set_attribute(self.xml_obj, attr, value)
             pub.sendMessage('ui_updater_{}'.format(self.page_id),
                             xml_obj=self.xml_obj)
-            pub.sendMessage('on_change_{}'.format(self.page_id),
-                            event=None)
         else:
             # TODO - Show a dialog telling the user that there is no attr to save
             raise NotImplemented
@@ -0,0 +1,122 @@
+import settings
+import threading
+import time
+
+
+class AutoSaveScheduler():
+    """
+    Coalesces bursts of change notifications into a single save
+
+    The save function is called on a background thread once no new
+    change has been reported for the quiet period, or once the oldest
+    pending change has waited for the maximum interval. Changes that
+    arrive while a save is running are picked up by the next save.
+    """
+
+    def __init__(self, save_func, on_saved=None,
+                 quiet_period=None, max_interval=None):
+        """
+        @param save_func: Callable that does the actual save. Its
+                          return value is passed on to on_saved
+        @param on_saved: Optional callable that is called from the
+                         worker thread with (result, elapsed_seconds)
+        @param quiet_period: Seconds to wait after the last change
+        @param max_interval: Maximum seconds to wait after the first change
+        """
+        self.save_func = save_func
+        self.on_saved = on_saved
+        if quiet_period is None:
+            quiet_period = settings.AUTOSAVE_QUIET_PERIOD
+        if max_interval is None:
+            max_interval = settings.AUTOSAVE_MAX_INTERVAL
+        self.quiet_period = quiet_period
+        self.max_interval = max_interval
+
+        self._condition = threading.Condition()
+        self._first_change = None
+        self._last_change = None
+        self._stopped = False
+        self._thread = None
+
+    @property
+    def pending(self):
+        """
+        True if there are changes that have not been saved yet
+        """
+        with self._condition:
+            return self._first_change is not None
+
+    def notify(self):
+        """
+        Report a change. This is cheap and can be called for every
+        keystroke
+        """
+        with self._condition:
+            if self._stopped:
+                return
+            now = time.monotonic()
+            if self._first_change is None:
+                self._first_change = now
+            self._last_change = now
+
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='autosave', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def stop(self, timeout=None):
+        """
+        Stop the scheduler, dropping any pending change and waiting for
+        a save that is already running to finish
+        """
+        with self._condition:
+            self._stopped = True
+            self._first_change = None
+            self._condition.notify()
+            thread = self._thread
+
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+
+    def _wait_for_deadline(self):
+        """
+        Block until a save is due. Returns False if the scheduler was
+        stopped in the meantime
+
+        Must be called with the condition held
+        """
+        while not self._stopped:
+            if self._first_change is None:
+                self._condition.wait()
+                continue
+
+            deadline = min(self._last_change + self.quiet_period,
+                           self._first_change + self.max_interval)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return True
+            self._condition.wait(remaining)
+        return False
+
+    def _run(self):
+        """
+        The worker loop that performs the saves
+        """
+        while True:
+            with self._condition:
+                if not self._wait_for_deadline():
+                    return
+                self._first_change = None
+                self._last_change = None
+
+            start = time.monotonic()
+            try:
+                result = self.save_func()
+            except Exception as e:
+                print('Autosave failed: {}'.format(e))
+                continue
+            elapsed = time.monotonic() - start
+
+            if self.on_saved:
+                self.on_saved(result, elapsed)
@@ -0,0 +1,282 @@
+"""
+Apply edits to many XML files from the command line
+
+The edits are the same operations the editor uses, from the edits
+module, addressed by XPath instead of by the tree selection. Every
+element an XPath matches is edited. The files are parsed, edited and
+written in a pool of worker processes, one per core by default, and
+written atomically with xml_io. This module does not import wx, so it
+runs on machines without a display
+
+Find and replace works the same way: --replace-text and
+--replace-attr substitute a regular expression in the text or an
+attribute value of the matches, and --rename-attr renames an
+attribute. With --dry-run nothing is written and the number of
+matches that would change is shown for every file
+
+Example:
+    python batch.py --set-attr //book lang en --remove //book/price \\
+        --pattern "*.xml" data/
+    python batch.py --rename-attr "//*" colour color --dry-run data/
+"""
+
+import argparse
+import edits
+import fnmatch
+import multiprocessing
+import os
+import re
+import settings
+import sys
+import time
+import xml_io
+
+from functools import partial
+
+
+class AddOperation(argparse.Action):
+    """
+    Collects the edit options in the order they were given
+    """
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        operations = getattr(namespace, self.dest, None) or []
+        operations.append((self.const, values[0], tuple(values[1:])))
+        setattr(namespace, self.dest, operations)
+
+
+def apply_operation(tree, operation, namespaces=None):
+    """
+    Applies an operation to every element its XPath matches and
+    returns the list of Edit records
+
+    @param tree: The lxml ElementTree to change
+    @param operation: A tuple of (operation name, XPath, arguments)
+    @param namespaces: Optional dict of the prefixes used in the XPath
+    """
+    op, path, args = operation
+    elements = [item for item in tree.xpath(path, namespaces=namespaces)
+                if hasattr(item, 'tag')]
+
+    records = []
+    for element in elements:
+        if op == 'set_text':
+            records.append(edits.set_text(element, *args))
+        elif op == 'set_attribute':
+            records.append(edits.set_attribute(element, *args))
+        elif op == 'delete_attribute':
+            if args[0] in element.attrib:
+                records.append(edits.delete_attribute(element, *args))
+        elif op == 'rename_attribute':
+            old_name, new_name = args
+            value = element.get(old_name)
+            if value is not None and old_name != new_name:
+                records.append(edits.rename_attribute(
+                    element, old_name, new_name, value))
+        elif op == 'replace_text':
+            pattern, replacement = args
+            if element.text is not None:
+                text = re.sub(pattern, replacement, element.text)
+                if text != element.text:
+                    records.append(edits.set_text(element, text))
+        elif op == 'replace_attribute':
+            name, pattern, replacement = args
+            value = element.get(name)
+            if value is not None:
+                new_value = re.sub(pattern, replacement, value)
+                if new_value != value:
+                    records.append(edits.set_attribute(element, name,
+                                                       new_value))
+        elif op == 'add_node':
+            records.append(edits.add_node(element, *args))
+        elif op == 'remove_node':
+            if element.getparent() is None:
+                raise ValueError('Cannot remove the root element')
+            records.append(edits.remove_node(element))
+        else:
+            raise ValueError('Unknown edit operation: {}'.format(op))
+    return records
+
+
+def process_file(xml_path, operations, namespaces=None, dry_run=False):
+    """
+    Parses a file, applies the operations and writes it back if
+    anything changed. Runs in a worker process
+
+    Returns a tuple of (path, number of edits, seconds, error message)
+    where the error message is None on success
+    """
+    start = time.perf_counter()
+    try:
+        tree = xml_io.parse_xml(xml_path)
+        count = 0
+        for operation in operations:
+            count += len(apply_operation(tree, operation, namespaces))
+        if count and not dry_run:
+            xml_io.write_file(xml_io.serialize_xml(tree), xml_path)
+    except Exception as error:
+        message = '{}: {}'.format(type(error).__name__, error)
+        return xml_path, 0, time.perf_counter() - start, message
+    return xml_path, count, time.perf_counter() - start, None
+
+
+def process_files(files, operations, namespaces=None, dry_run=False,
+                  jobs=None, context=None):
+    """
+    Runs process_file on every file in a pool of worker processes and
+    yields its results in the order the files are done
+
+    @param jobs: Number of worker processes (default: one per core),
+                 1 to process the files in this process
+    @param context: The multiprocessing context to start the pool with
+    """
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    worker = partial(process_file, operations=operations,
+                     namespaces=namespaces, dry_run=dry_run)
+    if jobs <= 1:
+        yield from map(worker, files)
+        return
+
+    pool = (context or multiprocessing).Pool(jobs)
+    try:
+        yield from pool.imap_unordered(
+            worker, files, chunksize=settings.BATCH_FILES_PER_TASK)
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def iter_files(paths, pattern):
+    """
+    Yields the given files and the files in the given directories,
+    recursively, whose names match the pattern
+    """
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for directory, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for filename in sorted(fnmatch.filter(filenames, pattern)):
+                yield os.path.join(directory, filename)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description='Apply edits to XML files. The edits are applied in '
+                    'the order they are given, to every element the '
+                    'XPath matches')
+    parser.add_argument('paths', nargs='+', metavar='PATH',
+                        help='XML files or directories to search for them')
+    parser.add_argument('--set-text', nargs=2, metavar=('XPATH', 'TEXT'),
+                        dest='operations', const='set_text',
+                        action=AddOperation)
+    parser.add_argument('--set-attr', nargs=3,
+                        metavar=('XPATH', 'NAME', 'VALUE'),
+                        dest='operations', const='set_attribute',
+                        action=AddOperation)
+    parser.add_argument('--delete-attr', nargs=2, metavar=('XPATH', 'NAME'),
+                        dest='operations', const='delete_attribute',
+                        action=AddOperation)
+    parser.add_argument('--add-node', nargs=2, metavar=('XPATH', 'TAG'),
+                        dest='operations', const='add_node',
+                        action=AddOperation,
+                        help='Append an empty element to the matches')
+    parser.add_argument('--add-text-node', nargs=3,
+                        metavar=('XPATH', 'TAG', 'TEXT'),
+                        dest='operations', const='add_node',
+                        action=AddOperation,
+                        help='Append an element with text to the matches')
+    parser.add_argument('--remove', nargs=1, metavar='XPATH',
+                        dest='operations', const='remove_node',
+                        action=AddOperation)
+    parser.add_argument('--rename-attr', nargs=3,
+                        metavar=('XPATH', 'NAME', 'NEW_NAME'),
+                        dest='operations', const='rename_attribute',
+                        action=AddOperation)
+    parser.add_argument('--replace-text', nargs=3,
+                        metavar=('XPATH', 'REGEX', 'REPLACEMENT'),
+                        dest='operations', const='replace_text',
+                        action=AddOperation,
+                        help='Replace a regular expression in the text of '
+                             'the matches, REPLACEMENT can refer to groups '
+                             'as \\1')
+    parser.add_argument('--replace-attr', nargs=4,
+                        metavar=('XPATH', 'NAME', 'REGEX', 'REPLACEMENT'),
+                        dest='operations', const='replace_attribute',
+                        action=AddOperation,
+                        help='Replace a regular expression in an attribute '
+                             'value of the matches')
+    parser.add_argument('--namespace', action='append', default=[],
+                        metavar='PREFIX=URI',
+                        help='Namespace prefix used in the XPaths')
+    parser.add_argument('--pattern', default='*.xml',
+                        help='File names to edit in directories '
+                             '(default: %(default)s)')
+    parser.add_argument('-j', '--jobs', type=int,
+                        default=os.cpu_count() or 1,
+                        help='Number of worker processes '
+                             '(default: %(default)s)')
+    parser.add_argument('-n', '--dry-run', action='store_true',
+                        help='Apply the edits without writing the files')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='Only report failures and the summary')
+
+    args = parser.parse_args(argv)
+    if not args.operations:
+        parser.error('No edits given')
+    for op, path, op_args in args.operations:
+        pattern = {'replace_text': 0, 'replace_attribute': 1}.get(op)
+        if pattern is None:
+            continue
+        try:
+            re.compile(op_args[pattern])
+        except re.error as error:
+            parser.error('Invalid regular expression {!r}: {}'.format(
+                op_args[pattern], error))
+    namespaces = {}
+    for item in args.namespace:
+        prefix, sep, uri = item.partition('=')
+        if not sep:
+            parser.error('--namespace takes PREFIX=URI')
+        namespaces[prefix] = uri
+    args.namespaces = namespaces or None
+    return args
+
+
+def main(argv=None):
+    """
+    Runs the batch and returns the exit status: 0 if every file was
+    processed, 1 if any failed
+    """
+    args = parse_args(argv)
+    files = iter_files(args.paths, args.pattern)
+
+    start = time.perf_counter()
+    total_files = total_edits = failures = 0
+    results = process_files(files, args.operations, args.namespaces,
+                            args.dry_run, args.jobs)
+    try:
+        for xml_path, count, elapsed, error in results:
+            total_files += 1
+            if error is not None:
+                failures += 1
+                print('FAILED {}: {}'.format(xml_path, error),
+                      file=sys.stderr)
+                continue
+            total_edits += count
+            if not args.quiet:
+                print('{:8.3f}s {:7,} edits  {}'.format(
+                    elapsed, count, xml_path))
+    finally:
+        results.close()
+
+    print('{:,} files, {:,} edits, {:,} failed in {:.2f}s{}'.format(
+        total_files, total_edits, failures, time.perf_counter() - start,
+        ' (dry run)' if args.dry_run else ''))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,303 @@
+"""
+Benchmarks of the operations that get slow on large documents
+
+A synthetic document is generated with xml_generator, or an existing
+file is used, and the following are timed:
+
+    parse          parsing the file
+    edit           a single character edit, including the journal
+                   write of the autosave
+    save           serializing and writing the file
+    preview        serializing the document the way the XML viewer does
+    tree_populate  creating the tree panel for the document
+    tree_expand    expanding the element with the most children
+    select         showing that element in the editor panels
+
+The last three need wx and a display and are reported as skipped
+without them. The results are written as JSON, and can be compared
+with the results of an earlier run to find regressions
+
+Example:
+    python benchmark.py --depth 5 --fanout 10 --output new.json \\
+        --compare old.json
+"""
+
+import argparse
+import json
+import lxml.etree as ET
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import xml_generator
+import xml_io
+
+from document import open_document
+from journal import EditJournal
+
+RESULTS_VERSION = 1
+
+
+class BenchmarkContext():
+    """
+    The document and scratch files shared by the benchmarks
+    """
+
+    def __init__(self, xml_path, work_dir):
+        self.xml_path = xml_path
+        self.work_dir = work_dir
+        self.document = open_document(xml_path)
+        self.journal = EditJournal(os.path.join(work_dir, 'bench.journal'),
+                                   xml_path)
+        self.document.subscribe(self.journal.record)
+
+        # The child of the root with the most children stands in for a
+        # long list of records
+        root = self.document.root
+        self.wide = max(root.iterchildren(ET.Element), key=len, default=root)
+        self.leaf = next(self.wide.iterchildren(ET.Element), self.wide)
+
+        self.frame = None
+        self.tree_panel = None
+        self.page_id = id(self)
+
+
+def bench_parse(context):
+    xml_io.parse_xml(context.xml_path)
+
+
+def bench_edit(context):
+    leaf = context.leaf
+    text = leaf.text or ''
+    context.document.set_text(leaf, text[:-1] if text.endswith('x')
+                              else text + 'x')
+    context.journal.flush()
+
+
+def bench_save(context):
+    context.document.save(os.path.join(context.work_dir, 'saved.xml'))
+
+
+def bench_preview(context):
+    document = context.document
+    with document.lock:
+        head, tail = xml_io.document_parts(document.xml_tree)
+        declarations = xml_io.namespace_declarations(document.root)
+        for element in document.root.iterchildren():
+            xml_io.serialize_block(element, declarations)
+
+
+def gui_unavailable():
+    """
+    Returns why the wx benchmarks cannot run, or None if they can
+    """
+    try:
+        import wx
+    except ImportError:
+        return 'wx is not installed'
+    if not wx.App.IsDisplayAvailable():
+        return 'no display'
+    return None
+
+
+def setup_gui(context):
+    """
+    Create a hidden frame with the editor panels of the document
+    """
+    import wx
+    from boom_attribute_ed import AttributeEditorPanel
+    from boom_xml_editor import XmlEditorPanel
+
+    if not wx.GetApp():
+        context.app = wx.App(False)
+    context.frame = wx.Frame(None, size=(800, 600))
+    notebook = wx.Notebook(context.frame)
+    context.editor_panels = [
+        XmlEditorPanel(notebook, context.page_id, context.document),
+        AttributeEditorPanel(notebook, context.page_id, context.document)]
+    for position, panel in enumerate(context.editor_panels):
+        notebook.AddPage(panel, str(position))
+
+
+def bench_tree_populate(context):
+    from boom_tree import BoomTreePanel
+
+    if context.tree_panel:
+        context.tree_panel.Destroy()
+    context.tree_panel = BoomTreePanel(
+        context.frame, context.document.root, context.page_id,
+        context.document)
+
+
+def bench_tree_expand(context):
+    tree = context.tree_panel.tree
+    item = tree.find_child_item(tree.GetRootItem(), context.wide)
+    tree.CollapseAndReset(item)
+    tree.SetItemHasChildren(item)
+    tree.expanded[id(context.wide)] = ''
+    tree.add_elements(item, context.wide)
+    tree.Expand(item)
+
+
+def bench_select(context):
+    for panel in context.editor_panels:
+        panel.xml_obj = context.wide
+        panel.refresh()
+
+
+BENCHMARKS = [
+    ('parse', bench_parse, False),
+    ('edit', bench_edit, False),
+    ('save', bench_save, False),
+    ('preview', bench_preview, False),
+    ('tree_populate', bench_tree_populate, True),
+    ('tree_expand', bench_tree_expand, True),
+    ('select', bench_select, True),
+]
+
+
+def time_runs(func, context, repeat):
+    """
+    Returns the seconds of repeat runs of func
+    """
+    runs = []
+    for position in range(repeat):
+        start = time.perf_counter()
+        func(context)
+        runs.append(time.perf_counter() - start)
+    return runs
+
+
+def run_benchmarks(xml_path, repeat, names=None):
+    """
+    Run the benchmarks on a file and return a dict with the results,
+    keyed by benchmark name
+
+    @param xml_path: The XML file to benchmark with
+    @param repeat: Number of times every benchmark is run
+    @param names: Optional list of the benchmarks to run
+    """
+    work_dir = tempfile.mkdtemp(prefix='boomslang-bench-')
+    results = {}
+    try:
+        context = BenchmarkContext(xml_path, work_dir)
+        gui_problem = None
+        gui_ready = False
+        for name, func, needs_gui in BENCHMARKS:
+            if names and name not in names:
+                continue
+            if needs_gui and not gui_ready:
+                gui_problem = gui_unavailable()
+                if gui_problem is None:
+                    setup_gui(context)
+                    if not context.tree_panel:
+                        bench_tree_populate(context)
+                gui_ready = True
+            if needs_gui and gui_problem:
+                results[name] = {'skipped': gui_problem}
+                continue
+
+            runs = time_runs(func, context, repeat)
+            results[name] = {'median': statistics.median(runs),
+                             'min': min(runs), 'runs': runs}
+        if context.frame:
+            context.frame.Destroy()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def compare(old, new, tolerance):
+    """
+    Print the change of the median of every benchmark that is in both
+    results and return the names of the ones that got slower by more
+    than tolerance, a fraction
+    """
+    regressions = []
+    for name, result in new['results'].items():
+        before = old['results'].get(name, {})
+        if 'median' not in result or 'median' not in before:
+            continue
+        change = result['median'] / before['median'] - 1
+        flag = ''
+        if change > tolerance:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print('{:15} {:10.4f}s -> {:10.4f}s {:+7.1%}{}'.format(
+            name, before['median'], result['median'], change, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Time the editor operations on a large document')
+    xml_generator.add_arguments(parser)
+    parser.add_argument('--xml', help='Benchmark an existing file instead '
+                                      'of a generated one')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Runs per benchmark (default: %(default)s)')
+    parser.add_argument('--only', action='append',
+                        choices=[name for name, func, gui in BENCHMARKS],
+                        help='Only run this benchmark. Can be repeated')
+    parser.add_argument('--output', help='Write the results to this file')
+    parser.add_argument('--compare', metavar='RESULTS',
+                        help='Results of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Slowdown that counts as a regression '
+                             '(default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    generated = None
+    if args.xml:
+        xml_path = args.xml
+        document_info = {'path': os.path.abspath(xml_path)}
+    else:
+        generator = xml_generator.from_arguments(args)
+        fd, generated = tempfile.mkstemp(prefix='boomslang-bench-',
+                                         suffix='.xml')
+        os.close(fd)
+        xml_path = generated
+        document_info = generator.params()
+        document_info['elements'] = generator.write(xml_path)
+
+    try:
+        document_info['bytes'] = os.path.getsize(xml_path)
+        results = run_benchmarks(xml_path, args.repeat, args.only)
+    finally:
+        if generated:
+            os.remove(generated)
+
+    report = {
+        'version': RESULTS_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'lxml': ET.__version__,
+        'platform': platform.platform(),
+        'repeat': args.repeat,
+        'document': document_info,
+        'results': results,
+    }
+
+    for name, result in results.items():
+        if 'skipped' in result:
+            print('{:15} skipped: {}'.format(name, result['skipped']))
+        else:
+            print('{:15} {:10.4f}s'.format(name, result['median']))
+    if args.output:
+        with open(args.output, 'w') as fobj:
+            json.dump(report, fobj, indent=2)
+
+    if args.compare:
+        with open(args.compare) as fobj:
+            old = json.load(fobj)
+        print('Compared with {}:'.format(args.compare))
+        if compare(old, report, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
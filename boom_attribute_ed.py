@@ -1,144 +1,257 @@
+import edits
+import utils
 import wx
+import wx.grid as gridlib
 
 from attribute_dialog import AttributeDialog
-from functools import partial
-from pubsub import pub
+from virtual_grid import GridPanel, get_selected_cells, notify_table_resized
 
+ELEMENT_MODE = 0
+CHILDREN_MODE = 1
+ROW_LABEL_SIZE = 100
 
-class State():
+
+class AttributeTable(gridlib.GridTableBase):
     """
-    Class for keeping track of the state of the key portion
-    of the attribute
+    A virtual table of XML attributes
+
+    In element mode there is one row per attribute of a single element
+    with the attribute name and its value. In children mode there is
+    one row per child element and one column per attribute name that
+    is used by any of the children
     """
 
-    def __init__(self, key, val_widget):
-        self.current_key = key
-        self.previous_key = None
-        self.val_widget = val_widget
+    def __init__(self, commit):
+        """
+        @param commit: Callable that applies a list of changes, see
+                       AttributeEditorPanel.commit
+        """
+        gridlib.GridTableBase.__init__(self)
+        self.commit = commit
+        self.mode = ELEMENT_MODE
+        self.xml_obj = None
+        self.elements = []
+        self.names = []
+
+    def set_element(self, xml_obj, mode):
+        """
+        Show the attributes of xml_obj, or those of its children
+        """
+        self.xml_obj = xml_obj
+        self.mode = mode
+        if xml_obj is None:
+            self.elements = []
+            self.names = []
+        elif mode == ELEMENT_MODE:
+            self.elements = [xml_obj]
+            self.names = list(xml_obj.attrib)
+        else:
+            self.elements = [child for child in xml_obj.iterchildren()
+                             if isinstance(child.tag, str)]
+            names = {}
+            for child in self.elements:
+                for name in child.attrib:
+                    names.setdefault(name, None)
+            self.names = list(names)
+
+    def GetNumberRows(self):
+        if self.mode == ELEMENT_MODE:
+            return len(self.names)
+        return len(self.elements)
+
+    def GetNumberCols(self):
+        if self.mode == ELEMENT_MODE:
+            return 2
+        return len(self.names)
+
+    def GetColLabelValue(self, col):
+        if self.mode == ELEMENT_MODE:
+            return ('Attribute', 'Value')[col]
+        return self.names[col]
+
+    def GetRowLabelValue(self, row):
+        if self.mode == ELEMENT_MODE:
+            return ''
+        return self.elements[row].tag
+
+    def IsEmptyCell(self, row, col):
+        return False
+
+    def GetValue(self, row, col):
+        if self.mode == ELEMENT_MODE:
+            name = self.names[row]
+            if col == 0:
+                return name
+            return str(self.xml_obj.get(name, ''))
+        return str(self.elements[row].get(self.names[col], ''))
+
+    def SetValue(self, row, col, value):
+        if self.mode == ELEMENT_MODE and col == 0:
+            old_name = self.names[row]
+            if not value or value == old_name or value in self.xml_obj.attrib:
+                return
+            self.commit([(edits.rename_attribute,
+                          (self.xml_obj, old_name, value,
+                           self.xml_obj.get(old_name, '')))])
+            self.names[row] = value
+        else:
+            element, name = self.get_cell(row, col)
+            if value or name in element.attrib:
+                self.commit([(edits.set_attribute, (element, name, value))])
+
+    def get_cell(self, row, col):
+        """
+        Returns the (element, attribute name) of a value cell
+        """
+        if self.mode == ELEMENT_MODE:
+            return self.xml_obj, self.names[row]
+        return self.elements[row], self.names[col]
 
 
-class AttributeEditorPanel(wx.Panel):
+class AttributeEditorPanel(GridPanel):
     """
     A class that holds all UI elements for editing
     XML attribute elements
     """
 
-    def __init__(self, parent, page_id):
-        wx.Panel.__init__(self, parent)
-        self.page_id = page_id
-        self.xml_obj = None
-        self.widgets = []
+    def __init__(self, parent, page_id, document):
+        GridPanel.__init__(self, parent, page_id, document)
+
+        self.mode_choice = wx.RadioBox(
+            self, label='Show attributes of',
+            choices=['Selected element', 'Its children'])
+        self.mode_choice.Bind(wx.EVT_RADIOBOX, self.on_mode_change)
 
-        pub.subscribe(self.update_ui, 'ui_updater_{}'.format(self.page_id))
+        self.table = AttributeTable(self.commit)
+        self.grid = gridlib.Grid(self)
+        self.grid.SetTable(self.table, takeOwnership=True)
+        self.grid.SetRowLabelSize(0)
+        self.grid.EnableEditing(not self.read_only)
+
+        btn_sizer = wx.BoxSizer(wx.HORIZONTAL)
+        add_attr_btn = wx.Button(self, label='Add Attribute')
+        add_attr_btn.Bind(wx.EVT_BUTTON, self.on_add_attr)
+        btn_sizer.Add(add_attr_btn, 0, wx.ALL, 5)
+
+        fill_btn = wx.Button(self, label='Fill Selection...')
+        fill_btn.Bind(wx.EVT_BUTTON, self.on_fill)
+        btn_sizer.Add(fill_btn, 0, wx.ALL, 5)
+
+        delete_btn = wx.Button(self, label='Delete Selection')
+        delete_btn.Bind(wx.EVT_BUTTON, self.on_delete)
+        btn_sizer.Add(delete_btn, 0, wx.ALL, 5)
 
         self.main_sizer = wx.BoxSizer(wx.VERTICAL)
+        self.main_sizer.Add(self.mode_choice, 0, wx.ALL|wx.EXPAND, 5)
+        self.main_sizer.Add(self.grid, 1, wx.ALL|wx.EXPAND, 5)
+        self.main_sizer.Add(btn_sizer, 0, wx.CENTER)
         self.SetSizer(self.main_sizer)
 
-    def update_ui(self, xml_obj):
+    def refresh(self):
         """
-        Update the user interface to have elements for editing
-        XML attributes
-
-        Called via pubsub
+        Reload the table from the current XML object
         """
-        self.clear()
-        self.xml_obj = xml_obj
+        GridPanel.refresh(self)
+        if self.grid.IsCellEditControlEnabled():
+            # Commit the edit in progress to the previous element
+            self.grid.DisableCellEditControl()
+
+        old_rows = self.table.GetNumberRows()
+        old_cols = self.table.GetNumberCols()
+        mode = self.mode_choice.GetSelection()
+        self.table.set_element(self.xml_obj, mode)
 
-        sizer = wx.BoxSizer(wx.HORIZONTAL)
-        attr_lbl = wx.StaticText(self, label='Attribute')
-        value_lbl = wx.StaticText(self, label='Value')
-        sizer.Add(attr_lbl, 0, wx.ALL, 5)
-        sizer.Add((133,0))
-        sizer.Add(value_lbl, 0, wx.ALL, 5)
-        self.widgets.extend([attr_lbl, value_lbl])
-
-        self.main_sizer.Add(sizer)
-
-        for key in xml_obj.attrib:
-            _ = wx.BoxSizer(wx.HORIZONTAL)
-            attr_name = wx.TextCtrl(self, value=key)
-            _.Add(attr_name, 1, wx.ALL|wx.EXPAND, 5)
-            self.widgets.append(attr_name)
-
-            val = str(xml_obj.attrib[key])
-            attr_val = wx.TextCtrl(self, value=val)
-            _.Add(attr_val, 1, wx.ALL|wx.EXPAND, 5)
-
-            # keep track of the attribute text control's state
-            attr_state = State(key, attr_val)
-
-            attr_name.Bind(
-                wx.EVT_TEXT, partial(
-                    self.on_key_change, state=attr_state))
-            attr_val.Bind(
-                wx.EVT_TEXT, partial(
-                    self.on_val_change,
-                    attr=attr_name
-                ))
-
-            self.widgets.append(attr_val)
-            self.main_sizer.Add(_, 0, wx.EXPAND)
+        # Sizing to the contents would visit every row, so only the
+        # labels are measured
+        if mode == ELEMENT_MODE:
+            self.grid.SetRowLabelSize(0)
         else:
-            add_attr_btn = wx.Button(self, label='Add Attribute')
-            add_attr_btn.Bind(wx.EVT_BUTTON, self.on_add_attr)
-            self.main_sizer.Add(add_attr_btn, 0, wx.ALL|wx.CENTER, 5)
-            self.widgets.append(add_attr_btn)
+            self.grid.SetRowLabelSize(ROW_LABEL_SIZE)
+        notify_table_resized(self.grid, self.table, old_rows, old_cols)
+        for col in range(self.table.GetNumberCols()):
+            self.grid.AutoSizeColLabelSize(col)
 
-        self.Layout()
+    def commit(self, changes):
+        """
+        Apply a list of (edit function, arguments) changes as one edit
+        with a single change notification
+        """
+        self.document.apply_batch(changes)
+
+    def get_value_cells(self):
+        """
+        Returns the (element, attribute name) of the attributes whose
+        cells are selected. In element mode a selected name cell counts
+        for the value in the same row
+        """
+        cells = []
+        seen = set()
+        for row, col in sorted(get_selected_cells(self.grid)):
+            cell = self.table.get_cell(row, col)
+            if cell not in seen:
+                seen.add(cell)
+                cells.append(cell)
+        return cells
 
     def on_add_attr(self, event):
         """
         Event handler to add an attribute
         """
+        if self.read_only:
+            utils.warn_read_only()
+            return
+        if self.xml_obj is None:
+            return
         dlg = AttributeDialog(
             self.xml_obj,
             page_id=self.page_id,
+            document=self.document,
             title = 'Add Attribute',
             label_one = 'Attribute',
             label_two = 'Value'
         )
         dlg.Destroy()
 
-    def clear(self):
+    def on_fill(self, event):
         """
-        Clears the panel of widgets
+        Event handler that sets all selected attribute cells to the
+        same value in one operation
         """
-        sizers = {}
-        for widget in self.widgets:
-            sizer = widget.GetContainingSizer()
-            if sizer:
-                sizer_id = id(sizer)
-                if sizer_id not in sizers:
-                    sizers[sizer_id] = sizer
-            widget.Destroy()
+        if self.read_only:
+            utils.warn_read_only()
+            return
+        cells = self.get_value_cells()
+        if not cells:
+            return
 
-        for sizer in sizers:
-            self.main_sizer.Remove(sizers[sizer])
-
-        self.widgets = []
-        self.Layout()
+        dlg = wx.TextEntryDialog(
+            self, 'Value for the {} selected attributes:'.format(len(cells)),
+            'Fill Selection')
+        if dlg.ShowModal() == wx.ID_OK:
+            value = dlg.GetValue()
+            self.commit([(edits.set_attribute, (element, name, value))
+                         for element, name in cells])
+            self.refresh()
+        dlg.Destroy()
 
-    def on_key_change(self, event, state):
+    def on_delete(self, event):
         """
-        Event handler that is called on text change in the
-        attribute key field
+        Event handler that deletes the attributes of all selected cells
+        in one operation
         """
-        new_key = event.GetString()
-        if new_key not in self.xml_obj.attrib:
-            if state.current_key in self.xml_obj.attrib:
-                self.xml_obj.attrib.pop(state.current_key)
-            self.xml_obj.attrib[new_key] = state.val_widget.GetValue()
-            state.previous_key = state.current_key
-            state.current_key = new_key
-            pub.sendMessage('on_change_{}'.format(self.page_id),
-                            event=None)
+        if self.read_only:
+            utils.warn_read_only()
+            return
+        changes = [(edits.delete_attribute, (element, name))
+                   for element, name in self.get_value_cells()
+                   if name in element.attrib]
+        if changes:
+            self.commit(changes)
+            self.refresh()
 
-    def on_val_change(self, event, attr):
+    def on_mode_change(self, event):
         """
-        Event handler that is called on text change in the
-        attribute value field
+        Event handler that switches between showing the attributes of
+        the selected element and those of its children
         """
-        new_val = event.GetString()
-        self.xml_obj.attrib[attr.GetValue()] = new_val
-        pub.sendMessage('on_change_{}'.format(self.page_id),
-                        event=None)
+        self.refresh()
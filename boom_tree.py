@@ -1,9 +1,59 @@
+import edits
 import lxml.etree as ET
+import settings
+import utils
 import wx
+import xml_diff
 
 from add_node_dialog import NodeDialog
+from collections import deque
+from functools import partial
+from itertools import chain, islice
+from large_document import LargeNode
 from pubsub import pub
 
+# Text colours of the tree items of elements that differ from the
+# document they were compared with
+DIFF_COLOURS = {
+    xml_diff.ADDED: (0, 128, 0),
+    xml_diff.CHANGED: (0, 0, 192),
+}
+
+
+class MoreItems():
+    """
+    The data of the placeholder tree item that stands in for a range
+    of an element's children that are not in the tree. Selecting it
+    loads the next chunk of them
+    """
+
+    def __init__(self, parent, last, loaded, end=None):
+        """
+        @param parent: The element whose children are being loaded
+        @param last: The child just before the missing ones or None
+        @param loaded: The position of the first missing child
+        @param end: The position after the last missing child, or None
+                    if all the remaining children are missing
+        """
+        self.parent = parent
+        self.last = last
+        self.loaded = loaded
+        self.end = end
+        self.loading = False
+
+    @property
+    def count(self):
+        """
+        The number of children the placeholder stands in for
+        """
+        end = len(self.parent) if self.end is None else self.end
+        return end - self.loaded
+
+    @property
+    def label(self):
+        return 'Load more... ({:,} of {:,} not shown)'.format(
+            self.count, len(self.parent))
+
 
 class XmlTree(wx.TreeCtrl):
     """
@@ -14,24 +64,28 @@ class XmlTree(wx.TreeCtrl):
     def __init__(self, parent, wx_id, pos, size, style):
         wx.TreeCtrl.__init__(self, parent, wx_id, pos, size, style)
         self.expanded= {}
+        self.selection_timer = None
+        self.diff_status = {}
+        self.diff_ancestors = set()
         self.xml_root = parent.xml_root
         self.page_id = parent.page_id
         pub.subscribe(self.update_tree,
                       'tree_update_{}'.format(self.page_id))
+        pub.subscribe(self.on_restore,
+                      'tree_restore_{}'.format(self.page_id))
+        pub.subscribe(self.on_patch, 'tree_patch_{}'.format(self.page_id))
+        pub.subscribe(self.show_diff, 'show_diff_{}'.format(self.page_id))
+        pub.subscribe(self.select_element,
+                      'tree_select_{}'.format(self.page_id))
 
         root = self.AddRoot(self.xml_root.tag)
         self.expanded[id(self.xml_root)] = ''
         self.SetItemData(root, self.xml_root)
         wx.CallAfter(pub.sendMessage,
                      'ui_updater_{}'.format(self.page_id),
-                     xml_obj=self.xml_root)
+                     xml_obj=self.editable_object(self.xml_root))
 
-        if self.xml_root.getchildren():
-            for top_level_item in self.xml_root.getchildren():
-                child = self.AppendItem(root, top_level_item.tag)
-                if top_level_item.getchildren():
-                    self.SetItemHasChildren(child)
-                self.SetItemData(child, top_level_item)
+        self.add_elements(root, self.xml_root)
 
         self.Expand(root)
         self.Bind(wx.EVT_TREE_ITEM_EXPANDING, self.on_item_expanding)
@@ -40,12 +94,409 @@ class XmlTree(wx.TreeCtrl):
     def add_elements(self, item, book):
         """
         Add items to the tree control
+
+        Only the first chunk of children is added. If there are more,
+        a placeholder item is added that loads the next chunk
+        """
+        self.add_chunk(item, book, book.iterchildren(), 0)
+
+    def insert_item(self, item, previous, text):
+        """
+        Insert a new child item after previous, or append it to item
+        if previous is None. Pass 0 as previous to prepend the item
+        """
+        if previous is None:
+            return self.AppendItem(item, text)
+        return self.InsertItem(item, previous, text)
+
+    def add_placeholder(self, item, previous, more):
+        """
+        Add the 'load more' placeholder item for MoreItems data
+        """
+        more_item = self.insert_item(item, previous, more.label)
+        self.SetItemData(more_item, more)
+        self.SetItemTextColour(more_item, wx.Colour(128, 128, 128))
+        return more_item
+
+    def add_chunk(self, item, parent, children, loaded, end=None,
+                  previous=None):
+        """
+        Add the next chunk of children to the tree item and returns
+        the first item that was added
+
+        If there are children left, up to end, a placeholder for them
+        is added after the chunk
+
+        @param item: The tree item of the parent element
+        @param parent: The parent element
+        @param children: An iterator over the children that are not
+                         in the tree yet
+        @param loaded: The position of the first of those children
+        @param end: The position after the last child to add, or None
+                    to add up to the last child
+        @param previous: The item to insert the chunk after, see
+                         insert_item
         """
-        for element in book.getchildren():
-            child = self.AppendItem(item, element.tag)
+        first = None
+        element = None
+        size = settings.TREE_CHUNK_SIZE
+        if end is not None:
+            size = min(size, end - loaded)
+
+        for element in islice(children, size):
+            child = self.insert_item(item, previous, element.tag)
             self.SetItemData(child, element)
-            if element.getchildren():
+            if self.diff_status:
+                self.colour_item(child, element)
+            if len(element):
                 self.SetItemHasChildren(child)
+            if first is None:
+                first = child
+            previous = child
+            loaded += 1
+
+        more = MoreItems(parent, element, loaded, end)
+        if element is not None and more.count > 0:
+            self.add_placeholder(item, previous, more)
+        return first
+
+    def load_more(self, item, select=True):
+        """
+        Replace the placeholder item with the next chunk of children
+        """
+        more = self.GetItemData(item)
+        parent_item = self.GetItemParent(item)
+        previous = self.GetPrevSibling(item)
+        self.Delete(item)
+        if more.last is None:
+            children = more.parent.iterchildren()
+        else:
+            children = more.last.itersiblings()
+        first = self.add_chunk(parent_item, more.parent, children,
+                               more.loaded, more.end,
+                               previous if previous.IsOk() else 0)
+        if select and first is not None:
+            self.SelectItem(first)
+            self.EnsureVisible(first)
+        return first
+
+    def get_more_item(self, item):
+        """
+        Returns the 'load more' placeholder at the end of the children
+        of item or None if all of its last children are loaded
+        """
+        last_item = self.GetLastChild(item)
+        if last_item.IsOk() and isinstance(self.GetItemData(last_item),
+                                           MoreItems):
+            return last_item
+
+    def remove_item(self, item):
+        """
+        Removes the item of a deleted element and keeps the 'load more'
+        placeholders of its parent, if any, up to date
+        """
+        previous = self.GetPrevSibling(item)
+        following = self.GetNextSibling(item)
+        self.DeleteChildren(item)
+        self.Delete(item)
+
+        next_item = following
+        while next_item.IsOk():
+            more = self.GetItemData(next_item)
+            if not isinstance(more, MoreItems):
+                next_item = self.GetNextSibling(next_item)
+                continue
+
+            more.loaded -= 1
+            if more.end is not None:
+                more.end -= 1
+            if next_item == following and previous.IsOk():
+                before = self.GetItemData(previous)
+                if isinstance(before, MoreItems):
+                    # Two placeholders met, merge them into the first one
+                    before.end = more.end
+                    self.SetItemText(previous, before.label)
+                    next_item = self.GetNextSibling(following)
+                    self.Delete(following)
+                    continue
+                more.last = before
+            elif next_item == following:
+                more.last = None
+            self.SetItemText(next_item, more.label)
+            next_item = self.GetNextSibling(next_item)
+
+    def find_child_item(self, item, element):
+        """
+        Returns the child item of item that holds element, loading the
+        part of the children it is in if needed. Only a chunk of
+        children around the element is loaded, no matter its position
+        """
+        parent = self.GetItemData(item)
+        if id(parent) not in self.expanded:
+            self.Expand(item)
+        position = None
+
+        child, cookie = self.GetFirstChild(item)
+        while child.IsOk():
+            data = self.GetItemData(child)
+            if data is element:
+                return child
+
+            if isinstance(data, MoreItems):
+                if position is None:
+                    position = parent.index(element)
+                end = data.loaded + data.count
+                if data.loaded <= position < end:
+                    if position - data.loaded >= settings.TREE_CHUNK_SIZE:
+                        # Split the placeholder and load the chunk that
+                        # starts at the element
+                        previous = self.GetPrevSibling(child)
+                        self.Delete(child)
+                        gap = MoreItems(parent, data.last, data.loaded,
+                                        position)
+                        gap_item = self.add_placeholder(
+                            item, previous if previous.IsOk() else 0, gap)
+                        children = chain([element], element.itersiblings())
+                        return self.add_chunk(item, parent, children,
+                                              position, data.end, gap_item)
+                    self.load_more(child, select=False)
+                    # Start over, the chunk replaced the placeholder
+                    child, cookie = self.GetFirstChild(item)
+                    continue
+            child = self.GetNextSibling(child)
+
+    def find_item(self, element):
+        """
+        Returns the tree item of the element, expanding only its
+        ancestors and loading only the chunks of children needed
+        """
+        item = self.GetRootItem()
+        ancestors = list(element.iterancestors())
+        if not ancestors:
+            return item
+
+        ancestors.reverse()
+        for xml_obj in ancestors[1:] + [element]:
+            item = self.find_child_item(item, xml_obj)
+            if item is None:
+                return None
+        return item
+
+    def select_element(self, element):
+        """
+        Select the tree item of the element
+        """
+        item = self.find_item(element)
+        if item is not None:
+            self.SelectItem(item)
+            self.EnsureVisible(item)
+
+    def get_state(self, get_path=edits.get_path):
+        """
+        Returns the paths of the expanded elements, parents first, and
+        the path of the selected element or None
+
+        @param get_path: Returns the path of an element
+        """
+        expanded = []
+        items = deque([self.GetRootItem()])
+        while items:
+            item = items.popleft()
+            element = self.GetItemData(item)
+            if isinstance(element, MoreItems) or not self.IsExpanded(item):
+                continue
+            expanded.append(get_path(element))
+            child, cookie = self.GetFirstChild(item)
+            while child.IsOk():
+                items.append(child)
+                child = self.GetNextSibling(child)
+
+        selected = None
+        item = self.GetSelection()
+        if item.IsOk():
+            element = self.GetItemData(item)
+            if element is not None and not isinstance(element, MoreItems):
+                selected = get_path(element)
+        return expanded, selected
+
+    def restore_state(self, expanded, selected, find_element=None):
+        """
+        Expand and select the elements of a state from get_state
+
+        @param find_element: Returns the element at a path or raises
+                             KeyError. Defaults to edits.find_element
+        """
+        if find_element is None:
+            find_element = partial(edits.find_element,
+                                   self.xml_root.getroottree())
+        for path in expanded:
+            try:
+                element = find_element(path)
+            except KeyError:
+                continue
+            item = self.find_item(element)
+            if item is not None:
+                self.Expand(item)
+
+        if selected:
+            try:
+                self.select_element(find_element(selected))
+            except KeyError:
+                pass
+
+    def forget_expanded(self, item):
+        """
+        Forget the expanded items below item and return their
+        elements, parents first
+        """
+        expanded = []
+        items = deque([item])
+        while items:
+            child, cookie = self.GetFirstChild(items.popleft())
+            while child.IsOk():
+                element = self.GetItemData(child)
+                if (not isinstance(element, MoreItems) and
+                        self.expanded.pop(id(element), None) is not None):
+                    if self.IsExpanded(child):
+                        expanded.append(element)
+                    items.append(child)
+                child = self.GetNextSibling(child)
+        return expanded
+
+    def is_loaded(self, element):
+        """
+        True if the items of all ancestors of the element were added
+        """
+        return all(id(ancestor) in self.expanded
+                   for ancestor in element.iterancestors())
+
+    def reload_children(self, element):
+        """
+        Rebuild the child items of an element after its children
+        were changed. The children that are still there are expanded
+        again if they were
+        """
+        item = self.find_item(element)
+        if item is None:
+            return
+        if id(element) in self.expanded:
+            expanded = self.forget_expanded(item)
+            self.DeleteChildren(item)
+            self.add_elements(item, element)
+            for child in expanded:
+                if xml_diff.is_attached(child, self.xml_root):
+                    child_item = self.find_item(child)
+                    if child_item is not None:
+                        self.Expand(child_item)
+        self.SetItemHasChildren(item, len(element) > 0)
+
+    def on_restore(self, edit):
+        """
+        Called via pubsub after an edit was undone or redone. Updates
+        the items of the elements whose children changed and shows the
+        changed element
+        """
+        target = None
+        for child in edit.children or [edit]:
+            if child.op == 'remove_node':
+                parent = child.old['parent']
+                self.reload_children(parent)
+                target = target if target is not None else parent
+            elif child.op in ('add_node', 'paste_node', 'insert_node'):
+                self.reload_children(child.element.getparent())
+                target = target if target is not None else child.element
+            elif target is None:
+                target = child.element
+
+        if target is not None:
+            self.select_element(target)
+        self.send_selection()
+
+    def on_patch(self, edit):
+        """
+        Called via pubsub after the document was changed to match its
+        file, see xml_diff.patch. Only the loaded items of the elements
+        whose children changed are rebuilt. The selection is kept, or
+        moves to the closest ancestor that is still there
+        """
+        selected = None
+        item = self.GetSelection()
+        while item.IsOk():
+            element = self.GetItemData(item)
+            if (not isinstance(element, MoreItems) and
+                    xml_diff.is_attached(element, self.xml_root)):
+                selected = element
+                break
+            item = self.GetItemParent(item)
+
+        reloaded = set()
+        for child in edit.children:
+            if child.op == 'remove_node':
+                parent = child.old['parent']
+            elif child.op == 'insert_node':
+                parent = child.element.getparent()
+            else:
+                continue
+            if (id(parent) in reloaded or
+                    not xml_diff.is_attached(parent, self.xml_root) or
+                    not self.is_loaded(parent)):
+                continue
+            reloaded.add(id(parent))
+            self.reload_children(parent)
+
+        if selected is not None:
+            self.select_element(selected)
+        self.send_selection()
+
+    def colour_item(self, item, element):
+        """
+        Colour the item by how its element differs in the current
+        comparison. Items that contain differences further down are
+        shown in bold
+        """
+        colour = DIFF_COLOURS.get(self.diff_status.get(element))
+        self.SetItemTextColour(
+            item, wx.Colour(*colour) if colour else wx.NullColour)
+        self.SetItemBold(item, element in self.diff_ancestors)
+
+    def show_diff(self, result):
+        """
+        Colour the items that differ in an xml_diff.DiffResult, or
+        remove the colours if result is None. Called via pubsub
+
+        Only the items that are already loaded are updated, the rest
+        are coloured when they are added
+        """
+        if result is None:
+            self.diff_status = {}
+            self.diff_ancestors = set()
+        else:
+            self.diff_status = result.status
+            self.diff_ancestors = result.changed_ancestors()
+
+        items = [self.GetRootItem()]
+        while items:
+            item = items.pop()
+            element = self.GetItemData(item)
+            if isinstance(element, MoreItems):
+                continue
+            self.colour_item(item, element)
+            child, cookie = self.GetFirstChild(item)
+            while child.IsOk():
+                items.append(child)
+                child = self.GetNextSibling(child)
+
+    def editable_object(self, xml_obj):
+        """
+        Returns the lxml element that the editor panels should show
+        for the data of a tree item
+
+        In huge file mode the tree holds index nodes, which have to be
+        parsed from the file first
+        """
+        if isinstance(xml_obj, LargeNode):
+            return xml_obj.materialize()
+        return xml_obj
 
     def on_item_expanding(self, event):
         """
@@ -58,11 +509,7 @@ class XmlTree(wx.TreeCtrl):
         xml_obj = self.GetItemData(item)
 
         if id(xml_obj) not in self.expanded and xml_obj is not None:
-            for top_level_item in xml_obj.getchildren():
-                child = self.AppendItem(item, top_level_item.tag)
-                self.SetItemData(child, top_level_item)
-                if top_level_item.getchildren():
-                    self.SetItemHasChildren(child)
+            self.add_elements(item, xml_obj)
 
         self.expanded[id(xml_obj)] = ''
 
@@ -74,9 +521,34 @@ class XmlTree(wx.TreeCtrl):
         to allow editing of the XML
         """
         item = event.GetItem()
-        xml_obj = self.GetItemData(item)
+        data = self.GetItemData(item)
+        if isinstance(data, MoreItems):
+            if not data.loading:
+                data.loading = True
+                wx.CallAfter(self.load_more, item)
+            return
+
+        # Rapid selection changes, e.g. holding down an arrow key, are
+        # coalesced so only the final selection is shown in the editors
+        if self.selection_timer and self.selection_timer.IsRunning():
+            self.selection_timer.Restart()
+        else:
+            self.selection_timer = wx.CallLater(
+                settings.SELECTION_DELAY, self.send_selection)
+
+    def send_selection(self):
+        """
+        Send the selected XML object to the editor panels
+        """
+        item = self.GetSelection()
+        if not item.IsOk():
+            return
+        data = self.GetItemData(item)
+        if data is None or isinstance(data, MoreItems):
+            return
+
         pub.sendMessage('ui_updater_{}'.format(self.page_id),
-                        xml_obj=xml_obj)
+                        xml_obj=self.editable_object(data))
 
     def update_tree(self, xml_obj):
         """
@@ -84,8 +556,13 @@ class XmlTree(wx.TreeCtrl):
         """
         selection = self.GetSelection()
         selected_tree_xml_obj = self.GetItemData(selection)
+        more_item = self.get_more_item(selection)
 
-        if id(selected_tree_xml_obj) in self.expanded:
+        if more_item:
+            # Not all children are shown, the new one comes at the end
+            more = self.GetItemData(more_item)
+            self.SetItemText(more_item, more.label)
+        elif id(selected_tree_xml_obj) in self.expanded:
             child = self.AppendItem(selection, xml_obj.tag)
             if xml_obj.getchildren():
                 self.SetItemHasChildren(child)
@@ -100,11 +577,18 @@ class BoomTreePanel(wx.Panel):
     The panel class that contains the XML tree control
     """
 
-    def __init__(self, parent, xml_obj, page_id):
+    def __init__(self, parent, xml_obj, page_id, document,
+                 search_index=None):
         wx.Panel.__init__(self, parent)
         self.xml_root = xml_obj
         self.copied_data = None
         self.page_id = page_id
+        self.document = document
+        self.lock = document.lock
+        self.search_index = search_index
+        self.search_results = []
+        # Documents opened in huge file mode can only be browsed
+        self.read_only = isinstance(xml_obj, LargeNode)
 
         pub.subscribe(self.add_node,
                       'add_node_{}'.format(self.page_id))
@@ -116,9 +600,85 @@ class BoomTreePanel(wx.Panel):
             wx.TR_HAS_BUTTONS)
         self.tree.Bind(wx.EVT_CONTEXT_MENU, self.on_context_menu)
 
+        self.search_ctrl = wx.SearchCtrl(self, style=wx.TE_PROCESS_ENTER)
+        self.search_ctrl.SetDescriptiveText(
+            'Search text, tag:name, @attr=value or /xpath')
+        self.search_ctrl.ShowCancelButton(True)
+        self.search_ctrl.Bind(wx.EVT_TEXT_ENTER, self.on_search)
+        self.search_ctrl.Bind(wx.EVT_SEARCHCTRL_SEARCH_BTN, self.on_search)
+        self.search_ctrl.Bind(wx.EVT_SEARCHCTRL_CANCEL_BTN,
+                              self.on_search_cancel)
+        self.search_ctrl.Enable(search_index is not None)
+
+        self.results_lbl = wx.StaticText(self)
+        self.results = wx.ListBox(self, size=(-1, 150))
+        self.results.Bind(wx.EVT_LISTBOX, self.on_search_result)
+
         sizer = wx.BoxSizer(wx.VERTICAL)
+        sizer.Add(self.search_ctrl, 0, wx.ALL|wx.EXPAND, 2)
+        sizer.Add(self.results_lbl, 0, wx.ALL|wx.EXPAND, 2)
+        sizer.Add(self.results, 0, wx.ALL|wx.EXPAND, 2)
         sizer.Add(self.tree, 1, wx.EXPAND)
         self.SetSizer(sizer)
+        self.show_results(False)
+
+    def show_results(self, show):
+        """
+        Show or hide the search result widgets
+        """
+        self.results_lbl.Show(show)
+        self.results.Show(show)
+        self.Layout()
+
+    def on_search(self, event):
+        """
+        Event handler that runs the query in the search control and
+        lists the matching elements
+        """
+        query = self.search_ctrl.GetValue()
+        if not query.strip():
+            self.on_search_cancel(event)
+            return
+
+        try:
+            self.search_results = self.search_index.search(query)
+        except RuntimeError:
+            self.search_results = []
+            self.results_lbl.SetLabel('Still indexing, try again shortly')
+        except ET.XPathError as e:
+            self.search_results = []
+            self.results_lbl.SetLabel('Invalid XPath: {}'.format(e))
+        else:
+            msg = '{:,} matches'.format(len(self.search_results))
+            if len(self.search_results) > settings.SEARCH_MAX_RESULTS:
+                msg += ', showing the first {:,}'.format(
+                    settings.SEARCH_MAX_RESULTS)
+            self.results_lbl.SetLabel(msg)
+
+        shown = self.search_results[:settings.SEARCH_MAX_RESULTS]
+        with self.lock:
+            self.results.Set([edits.get_path(element) for element in shown])
+        self.show_results(True)
+
+    def on_search_cancel(self, event):
+        """
+        Event handler that clears the search
+        """
+        self.search_ctrl.SetValue('')
+        self.search_results = []
+        self.results.Clear()
+        self.show_results(False)
+
+    def on_search_result(self, event):
+        """
+        Event handler that selects the element of a search result in
+        the tree
+        """
+        element = self.search_results[event.GetSelection()]
+        if element.getroottree().getroot() is not self.xml_root:
+            # The element was removed after the search
+            return
+        self.tree.select_element(element)
 
     def on_context_menu(self, event):
         """
@@ -170,24 +730,32 @@ class BoomTreePanel(wx.Panel):
         """
         Paste / Append the copied XML data to the selected node
         """
+        if self.read_only:
+            utils.warn_read_only()
+            return
+
         if self.copied_data:
             node = self.tree.GetSelection()
             parent_xml_node = self.tree.GetItemData(node)
 
-            parent_xml_node.append(self.copied_data)
+            edit = self.document.paste_node(parent_xml_node,
+                                            self.copied_data)
             pub.sendMessage('tree_update_{}'.format(self.page_id),
-                            xml_obj=self.copied_data)
-            pub.sendMessage('on_change_{}'.format(self.page_id),
-                            event=None)
+                            xml_obj=edit.element)
 
     def add_node(self):
         """
         Add a sub-node to the selected item in the tree
         """
+        if self.read_only:
+            utils.warn_read_only()
+            return
+
         node = self.tree.GetSelection()
         data = self.tree.GetItemData(node)
         dlg = NodeDialog(data,
                          page_id=self.page_id,
+                         document=self.document,
                          title = 'New Node',
                          label_one = 'Element Tag',
                          label_two = 'Element Value'
@@ -198,6 +766,10 @@ class BoomTreePanel(wx.Panel):
         """
         Remove the selected node from the tree
         """
+        if self.read_only:
+            utils.warn_read_only()
+            return
+
         node = self.tree.GetSelection()
         xml_node = self.tree.GetItemData(node)
 
@@ -210,10 +782,6 @@ class BoomTreePanel(wx.Panel):
                 style=wx.YES_NO|wx.YES_DEFAULT|wx.ICON_EXCLAMATION
             )
             if dlg.ShowModal() == wx.ID_YES:
-                parent = xml_node.getparent()
-                parent.remove(xml_node)
-                self.tree.DeleteChildren(node)
-                self.tree.Delete(node)
-                pub.sendMessage('on_change_{}'.format(self.page_id),
-                                event=None)
+                self.document.remove_node(xml_node)
+                self.tree.remove_item(node)
             dlg.Destroy()
@@ -1,123 +1,132 @@
 import wx
-import wx.lib.scrolledpanel as scrolled
+import wx.grid as gridlib
 
-from functools import partial
 from pubsub import pub
+from virtual_grid import GridPanel, notify_table_resized
 
 
-class XmlEditorPanel(scrolled.ScrolledPanel):
+class LeafTable(gridlib.GridTableBase):
+    """
+    A virtual table of the tags and values of the children of an XML
+    element that have no children of their own
+
+    The grid only asks the table for the cells it displays, so the
+    number of widgets does not grow with the number of children
+    """
+
+    def __init__(self, on_value_change):
+        """
+        @param on_value_change: Callable that is called with
+                                (element, value) when a value is edited
+        """
+        gridlib.GridTableBase.__init__(self)
+        self.on_value_change = on_value_change
+        self.elements = []
+
+        self.tag_attr = gridlib.GridCellAttr()
+        self.tag_attr.SetReadOnly()
+        self.tag_attr.SetBackgroundColour(
+            wx.SystemSettings.GetColour(wx.SYS_COLOUR_BTNFACE))
+
+    def set_element(self, xml_obj):
+        """
+        Show the leaf children of xml_obj in the table
+
+        An element without any children that has a value is shown
+        on its own
+        """
+        elements = []
+        if xml_obj is not None:
+            elements = [child for child in xml_obj.iterchildren()
+                        if isinstance(child.tag, str) and not len(child)]
+            if not len(xml_obj) and xml_obj.text:
+                elements.append(xml_obj)
+        self.elements = elements
+
+    def GetNumberRows(self):
+        return len(self.elements)
+
+    def GetNumberCols(self):
+        return 2
+
+    def GetColLabelValue(self, col):
+        return ('Tags', 'Value')[col]
+
+    def IsEmptyCell(self, row, col):
+        return False
+
+    def GetValue(self, row, col):
+        element = self.elements[row]
+        if col == 0:
+            return element.tag
+        return element.text or ''
+
+    def SetValue(self, row, col, value):
+        if col == 1:
+            self.on_value_change(self.elements[row], value)
+
+    def GetAttr(self, row, col, kind):
+        if col == 0:
+            self.tag_attr.IncRef()
+            return self.tag_attr
+        return None
+
+
+class XmlEditorPanel(GridPanel):
     """
     The panel in the notebook that allows editing of XML element values
     """
 
-    def __init__(self, parent, page_id):
+    def __init__(self, parent, page_id, document):
         """Constructor"""
-        scrolled.ScrolledPanel.__init__(
-            self, parent, style=wx.SUNKEN_BORDER)
+        GridPanel.__init__(self, parent, page_id, document,
+                           style=wx.SUNKEN_BORDER)
         self.main_sizer = wx.BoxSizer(wx.VERTICAL)
-        self.page_id = page_id
-        self.widgets = []
-        self.label_spacer = None
 
-        pub.subscribe(self.update_ui, 'ui_updater_{}'.format(self.page_id))
+        self.table = LeafTable(self.on_value_change)
+        self.grid = gridlib.Grid(self)
+        self.grid.SetTable(self.table, takeOwnership=True)
+        self.grid.SetRowLabelSize(0)
+        self.grid.SetColSize(0, 100)
+        self.grid.EnableEditing(not self.read_only)
+        self.grid.Bind(wx.EVT_SIZE, self.on_grid_size)
+        self.main_sizer.Add(self.grid, 1, wx.ALL|wx.EXPAND, 5)
+
+        add_node_btn = wx.Button(self, label='Add Node')
+        add_node_btn.Bind(wx.EVT_BUTTON, self.on_add_node)
+        self.main_sizer.Add(add_node_btn, 0, wx.ALL|wx.CENTER, 5)
 
         self.SetSizer(self.main_sizer)
 
-    def update_ui(self, xml_obj):
+    def refresh(self):
         """
         Update the panel's user interface based on the data
         """
-        self.label_sizer = wx.BoxSizer(wx.HORIZONTAL)
-        self.clear()
+        GridPanel.refresh(self)
+        if self.grid.IsCellEditControlEnabled():
+            # Commit the edit in progress to the previous element
+            self.grid.DisableCellEditControl()
 
-        tag_lbl = wx.StaticText(self, label='Tags')
-        value_lbl = wx.StaticText(self, label='Value')
-        self.label_sizer.Add(tag_lbl, 0, wx.ALL, 5)
-        self.label_sizer.Add((55, 0))
-        self.label_sizer.Add(value_lbl, 0, wx.ALL, 5)
-        self.main_sizer.Add(self.label_sizer)
+        old_rows = self.table.GetNumberRows()
+        old_cols = self.table.GetNumberCols()
+        self.table.set_element(self.xml_obj)
+        notify_table_resized(self.grid, self.table, old_rows, old_cols)
 
-        self.widgets.extend([tag_lbl, value_lbl])
-
-        if xml_obj is not None:
-            lbl_size = (75, 25)
-            for child in xml_obj.getchildren():
-                if child.getchildren():
-                    continue
-                sizer = wx.BoxSizer(wx.HORIZONTAL)
-                tag_txt = wx.StaticText(self, label=child.tag, size=lbl_size)
-                sizer.Add(tag_txt, 0, wx.ALL, 5)
-                self.widgets.append(tag_txt)
-
-                text = child.text if child.text else ''
-
-                value_txt = wx.TextCtrl(self, value=text)
-                value_txt.Bind(wx.EVT_TEXT, partial(self.on_text_change, xml_obj=child))
-                sizer.Add(value_txt, 1, wx.ALL|wx.EXPAND, 5)
-                self.widgets.append(value_txt)
-
-                self.main_sizer.Add(sizer, 0, wx.EXPAND)
-            else:
-                if getattr(xml_obj, 'tag') and getattr(xml_obj, 'text'):
-                    if xml_obj.getchildren() == []:
-                        self.add_single_tag_elements(xml_obj, lbl_size)
-
-                add_node_btn = wx.Button(self, label='Add Node')
-                add_node_btn.Bind(wx.EVT_BUTTON, self.on_add_node)
-                self.main_sizer.Add(add_node_btn, 0, wx.ALL|wx.CENTER, 5)
-                self.widgets.append(add_node_btn)
-
-            self.SetAutoLayout(1)
-            self.SetupScrolling()
-
-    def add_single_tag_elements(self, xml_obj, lbl_size):
+    def on_grid_size(self, event):
         """
-        Adds the single tag elements to the panel
-
-        This function is only called when there should be just one
-        tag / value
+        Event handler that stretches the value column to the width
+        of the grid
         """
-        sizer = wx.BoxSizer(wx.HORIZONTAL)
-        tag_txt = wx.StaticText(self, label=xml_obj.tag, size=lbl_size)
-        sizer.Add(tag_txt, 0, wx.ALL, 5)
-        self.widgets.append(tag_txt)
-
-        value_txt = wx.TextCtrl(self, value=xml_obj.text)
-        value_txt.Bind(wx.EVT_TEXT, partial(
-            self.on_text_change, xml_obj=xml_obj))
-        sizer.Add(value_txt, 1, wx.ALL|wx.EXPAND, 5)
-        self.widgets.append(value_txt)
+        width = self.grid.GetClientSize()[0] - self.grid.GetColSize(0)
+        self.grid.SetColSize(1, max(width, 50))
+        event.Skip()
 
-        self.main_sizer.Add(sizer, 0, wx.EXPAND)
-
-    def clear(self):
-        """
-        Clears the widgets from the panel in preparation for an update
-        """
-        sizers = {}
-        for widget in self.widgets:
-            sizer = widget.GetContainingSizer()
-            if sizer:
-                sizer_id = id(sizer)
-                if sizer_id not in sizers:
-                    sizers[sizer_id] = sizer
-            widget.Destroy()
-
-        for sizer in sizers:
-            self.main_sizer.Remove(sizers[sizer])
-
-        self.widgets = []
-        self.Layout()
-
-    def on_text_change(self, event, xml_obj):
+    def on_value_change(self, xml_obj, value):
         """
-        An event handler that is called when the text changes in the text
-        control. This will update the passed in xml object to something
-        new
+        Called by the table when a value is edited in the grid. This
+        will update the passed in xml object to something new
         """
-        xml_obj.text = event.GetString()
-        pub.sendMessage('on_change_{}'.format(self.page_id),
-                        event=None)
+        self.document.set_text(xml_obj, value)
 
     def on_add_node(self, event):
         """
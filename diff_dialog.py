@@ -0,0 +1,111 @@
+import wx
+import xml_diff
+
+from pubsub import pub
+
+KIND_LABELS = {
+    xml_diff.ADDED: 'Added',
+    xml_diff.REMOVED: 'Removed',
+    xml_diff.CHANGED: 'Changed',
+    xml_diff.MOVED: 'Moved',
+}
+
+
+class DiffListCtrl(wx.ListCtrl):
+    """
+    A virtual list of the changes of a DiffResult. The paths are only
+    looked up for the rows that are displayed
+    """
+
+    def __init__(self, parent, result):
+        wx.ListCtrl.__init__(
+            self, parent, style=wx.LC_REPORT|wx.LC_VIRTUAL|wx.LC_SINGLE_SEL)
+        self.result = result
+        self.InsertColumn(0, 'Change', width=80)
+        self.InsertColumn(1, 'Old', width=300)
+        self.InsertColumn(2, 'New', width=300)
+        self.SetItemCount(len(result))
+
+    def OnGetItemText(self, row, col):
+        kind, old, new = self.result.changes[row]
+        if col == 0:
+            return KIND_LABELS[kind]
+        elif col == 1:
+            if kind == xml_diff.ADDED:
+                return ''
+            return old.getroottree().getpath(old)
+        if kind == xml_diff.REMOVED:
+            return ''
+        return new.getroottree().getpath(new)
+
+
+class DiffDialog(wx.Dialog):
+    """
+    A modeless list of the differences between another document and
+    the document of an editor page. The elements of the page are
+    coloured in its tree while the dialog is open
+    """
+
+    def __init__(self, parent, page, result, title):
+        """
+        @param parent: The main frame
+        @param page: The editor page whose document is the new one
+        @param result: The xml_diff.DiffResult
+        @param title: Describes what the page was compared with
+        """
+        wx.Dialog.__init__(self, parent=parent, title=title, size=(700, 400),
+                           style=wx.DEFAULT_DIALOG_STYLE | wx.RESIZE_BORDER)
+        self.page = page
+        self.result = result
+
+        if len(result):
+            msg = ('{:,} added, {:,} removed, {:,} changed, '
+                   '{:,} moved').format(
+                result.count(xml_diff.ADDED), result.count(xml_diff.REMOVED),
+                result.count(xml_diff.CHANGED), result.count(xml_diff.MOVED))
+        else:
+            msg = 'No differences'
+        summary = wx.StaticText(self, label=msg)
+
+        self.changes = DiffListCtrl(self, result)
+        self.changes.Bind(wx.EVT_LIST_ITEM_SELECTED, self.on_select)
+
+        sizer = wx.BoxSizer(wx.VERTICAL)
+        sizer.Add(summary, 0, wx.ALL, 5)
+        sizer.Add(self.changes, 1, wx.ALL|wx.EXPAND, 5)
+        self.SetSizer(sizer)
+
+        self.closed_topic = 'document_closed_{}'.format(page.page_id)
+        pub.subscribe(self.on_document_closed, self.closed_topic)
+        self.Bind(wx.EVT_CLOSE, self.on_close)
+
+        pub.sendMessage('show_diff_{}'.format(page.page_id), result=result)
+
+    def on_select(self, event):
+        """
+        Event handler that selects the element of a change in the tree.
+        For removed elements that is their parent
+        """
+        kind, old, new = self.result.changes[event.GetIndex()]
+        if new.getroottree().getroot() is not self.page.xml_root:
+            # The element was removed after the comparison
+            return
+        pub.sendMessage('tree_select_{}'.format(self.page.page_id),
+                        element=new)
+
+    def on_document_closed(self):
+        """
+        Called via pubsub when the page is closed or unloads
+        its document
+        """
+        self.Close()
+
+    def on_close(self, event):
+        """
+        Event handler that removes the colours from the tree
+        """
+        pub.unsubscribe(self.on_document_closed, self.closed_topic)
+        if not self.page.closed:
+            pub.sendMessage('show_diff_{}'.format(self.page.page_id),
+                            result=None)
+        self.Destroy()
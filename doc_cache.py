@@ -0,0 +1,198 @@
+"""
+An on-disk cache of the element index of XML files
+
+Scanning a big file for the index in large_document takes a while, so
+the index is written to the cache directory and read back the next
+time the same file is opened. The cache file holds a JSON header line
+followed by the raw index arrays, which are read back with a single
+copy each. Entries are keyed by the path of the XML file and only used
+while its size and modification time match. The least recently used
+entries are removed once the cache grows past its size limit. This
+module does not depend on wx
+"""
+
+import hashlib
+import json
+import os
+import settings
+import threading
+
+from array import array
+from large_document import LargeDocument, open_large_document
+from xml_io import LoadCancelled
+
+CACHE_VERSION = 1
+CACHE_EXTENSION = '.index'
+
+
+def cache_path(cache_dir, xml_path):
+    """
+    Returns the path of the cache file for xml_path
+    """
+    key = hashlib.sha1(os.path.abspath(xml_path).encode('utf-8'))
+    return os.path.join(cache_dir, key.hexdigest() + CACHE_EXTENSION)
+
+
+def file_key(xml_path):
+    """
+    Returns the (size, mtime_ns) that a cache entry must match
+    """
+    stat = os.stat(xml_path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def read_header(fobj):
+    return json.loads(fobj.readline().decode('utf-8'))
+
+
+def lookup(cache_dir, xml_path):
+    """
+    Returns the path of a valid cache entry for xml_path or None
+    """
+    path = cache_path(cache_dir, xml_path)
+    try:
+        with open(path, 'rb') as fobj:
+            header = read_header(fobj)
+        size, mtime_ns = file_key(xml_path)
+    except (IOError, OSError, ValueError):
+        return None
+
+    itemsizes = {name: array(typecode).itemsize
+                 for name, typecode in LargeDocument.ARRAYS}
+    if (header.get('version') != CACHE_VERSION or
+            header.get('path') != os.path.abspath(xml_path) or
+            header.get('size') != size or
+            header.get('mtime_ns') != mtime_ns or
+            header.get('itemsizes') != itemsizes):
+        return None
+    return path
+
+
+def load(path, xml_path, progress=None, cancel_event=None):
+    """
+    Returns a LargeDocument for xml_path with the index from the
+    cache file at path
+    """
+    document = LargeDocument(xml_path)
+    try:
+        with open(path, 'rb') as fobj:
+            header = read_header(fobj)
+            document.set_tags(header['tags'])
+            count = header['count']
+            for step, (name, typecode) in enumerate(LargeDocument.ARRAYS):
+                if cancel_event is not None and cancel_event.is_set():
+                    raise LoadCancelled(xml_path)
+                values = array(typecode)
+                values.fromfile(fobj, count)
+                setattr(document, name, values)
+                if progress:
+                    progress(step + 1, len(LargeDocument.ARRAYS))
+    except Exception:
+        document.close()
+        raise
+
+    # Mark the entry as recently used for the eviction
+    os.utime(path)
+    return document
+
+
+def store(cache_dir, document):
+    """
+    Write the index of a LargeDocument to the cache
+    """
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+
+    size, mtime_ns = file_key(document.xml_path)
+    header = {
+        'version': CACHE_VERSION,
+        'path': os.path.abspath(document.xml_path),
+        'size': size,
+        'mtime_ns': mtime_ns,
+        'count': len(document),
+        'tags': document.tags,
+        'itemsizes': {name: getattr(document, name).itemsize
+                      for name, typecode in LargeDocument.ARRAYS},
+    }
+    path = cache_path(cache_dir, document.xml_path)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as fobj:
+        fobj.write(json.dumps(header).encode('utf-8'))
+        fobj.write(b'\n')
+        for name, typecode in LargeDocument.ARRAYS:
+            getattr(document, name).tofile(fobj)
+    os.replace(tmp_path, path)
+
+    evict(cache_dir, settings.CACHE_MAX_SIZE)
+
+
+def evict(cache_dir, max_size):
+    """
+    Remove the least recently used entries until the cache is no
+    larger than max_size bytes
+    """
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith(CACHE_EXTENSION):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for mtime, size, path in entries)
+    for mtime, size, path in sorted(entries):
+        if total <= max_size:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+
+
+def open_document(cache_dir, xml_path, progress=None, cancel_event=None):
+    """
+    Returns an indexed LargeDocument for xml_path, from the cache if
+    possible. A fresh index is added to the cache
+    """
+    path = lookup(cache_dir, xml_path)
+    if path:
+        try:
+            return load(path, xml_path, progress, cancel_event)
+        except (IOError, OSError, ValueError, EOFError) as e:
+            print('Unable to read the cached index {}: {}'.format(path, e))
+
+    document = open_large_document(xml_path, progress, cancel_event)
+    try:
+        store(cache_dir, document)
+    except (IOError, OSError) as e:
+        print('Unable to cache the index of {}: {}'.format(xml_path, e))
+    return document
+
+
+def build_in_background(cache_dir, xml_path):
+    """
+    Index xml_path and add it to the cache on a background thread,
+    unless it is cached already
+    """
+    def build():
+        try:
+            document = open_large_document(xml_path)
+        except Exception as e:
+            print('Unable to index {}: {}'.format(xml_path, e))
+            return
+        try:
+            store(cache_dir, document)
+        except (IOError, OSError) as e:
+            print('Unable to cache the index of {}: {}'.format(xml_path, e))
+        finally:
+            document.close()
+
+    if lookup(cache_dir, xml_path):
+        return None
+    thread = threading.Thread(target=build, name='index-cache', daemon=True)
+    thread.start()
+    return thread
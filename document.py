@@ -0,0 +1,218 @@
+"""
+The model of an open XML document
+
+A Document owns the lxml tree, the lock that guards it, the undo
+history and the dirty state. All changes go through it, using the
+operations of the edits module, and every change is passed on to the
+listeners that subscribed to it. The wx panels only display the tree
+and call the Document to change it, so everything here can be used
+and profiled without a GUI. This module does not depend on wx
+"""
+
+import edits
+import threading
+import xml_io
+
+from undo import UndoHistory
+
+
+class ReadOnlyError(Exception):
+    """
+    Raised when a document without a tree, e.g. one opened in huge file
+    mode, is changed
+    """
+
+
+class Document():
+    """
+    An XML document with its edits and change notifications
+    """
+
+    def __init__(self, xml_tree=None, path=None):
+        """
+        @param xml_tree: The lxml ElementTree or None until it is loaded
+        @param path: The path of the file the document belongs to
+        """
+        self.xml_tree = xml_tree
+        self.path = path
+        # Guards the tree while it is read on a worker thread
+        self.lock = threading.RLock()
+        self.history = UndoHistory()
+        self.listeners = []
+
+        # Every change bumps the generation. The document is dirty
+        # while it differs from the generation that was last saved
+        self.generation = 0
+        self.saved_generation = 0
+
+    @property
+    def root(self):
+        if self.xml_tree is None:
+            return None
+        return self.xml_tree.getroot()
+
+    @property
+    def read_only(self):
+        """
+        True if there is no tree to change. The elements that are shown
+        in huge file mode are parsed from the file on demand, so changes
+        to them would be lost
+        """
+        return self.xml_tree is None
+
+    @property
+    def dirty(self):
+        """
+        True if the document has changes that were not saved
+        """
+        return self.generation != self.saved_generation
+
+    def set_tree(self, xml_tree, changed=False):
+        """
+        Replace the tree, e.g. once it is loaded or unloaded. The undo
+        history is cleared because it refers to the old elements
+
+        @param xml_tree: The new lxml ElementTree or None
+        @param changed: True if the tree differs from the saved file,
+                        e.g. when it was recovered from drafts
+        """
+        with self.lock:
+            self.xml_tree = xml_tree
+            self.history.clear()
+            if changed:
+                self.generation += 1
+
+    def subscribe(self, listener):
+        """
+        Call listener with the Edit record of every change. It is
+        called on the thread that made the change, with the lock held
+        """
+        self.listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def changed(self, edit, record=True):
+        """
+        Bump the generation, add the edit to the undo history and tell
+        the listeners. The caller must hold the lock
+        """
+        self.generation += 1
+        if record:
+            self.history.record(edit)
+        for listener in list(self.listeners):
+            listener(edit)
+
+    def apply(self, func, *args):
+        """
+        Change the document with an edit function from the edits module
+        and return the Edit record. Raises ReadOnlyError if there is no
+        tree
+        """
+        with self.lock:
+            self.check_writable()
+            edit = func(*args)
+            self.changed(edit)
+        return edit
+
+    def apply_batch(self, changes):
+        """
+        Apply a list of (edit function, arguments) changes as one edit
+        with a single notification. Returns the Edit record or None if
+        the list is empty
+        """
+        with self.lock:
+            self.check_writable()
+            done = [func(*args) for func, args in changes]
+            if not done:
+                return None
+            edit = done[0] if len(done) == 1 else edits.batch(done)
+            self.changed(edit)
+        return edit
+
+    def check_writable(self):
+        if self.read_only:
+            raise ReadOnlyError('{} is read-only'.format(self.path))
+
+    def set_text(self, element, text):
+        return self.apply(edits.set_text, element, text)
+
+    def set_attribute(self, element, name, value):
+        return self.apply(edits.set_attribute, element, name, value)
+
+    def rename_attribute(self, element, old_name, new_name, value):
+        return self.apply(edits.rename_attribute, element, old_name,
+                          new_name, value)
+
+    def delete_attribute(self, element, name):
+        return self.apply(edits.delete_attribute, element, name)
+
+    def add_node(self, parent, tag, text=None):
+        return self.apply(edits.add_node, parent, tag, text)
+
+    def remove_node(self, element):
+        return self.apply(edits.remove_node, element)
+
+    def paste_node(self, parent, source):
+        return self.apply(edits.paste_node, parent, source)
+
+    def undo(self):
+        """
+        Undo the newest edit. Returns the Edit record of the change or
+        None if there was nothing to undo
+        """
+        return self._restore(self.history.undo)
+
+    def redo(self):
+        """
+        Redo the newest undone edit. Returns the Edit record of the
+        change or None if there was nothing to redo
+        """
+        return self._restore(self.history.redo)
+
+    def _restore(self, step):
+        with self.lock:
+            edit = step()
+            if edit is not None:
+                self.changed(edit, record=False)
+        return edit
+
+    def serialize(self):
+        """
+        Returns the generation and the bytes of the document. Edits
+        that are made afterwards belong to a later save
+        """
+        with self.lock:
+            return self.generation, xml_io.serialize_xml(self.xml_tree)
+
+    def save(self, path=None, progress=None, cancel_event=None):
+        """
+        Write the document to path, or to its own path, atomically and
+        return the path. The lock is only held while serializing
+
+        @param progress: Optional callable that is called with
+                         (bytes_written, total_bytes)
+        @param cancel_event: Optional threading.Event that stops the
+                             write and keeps the old file
+        """
+        path = path or self.path
+        generation, data = self.serialize()
+        xml_io.write_file(data, path, progress, cancel_event)
+        self.mark_saved(generation)
+        return path
+
+    def mark_saved(self, generation):
+        """
+        Record that the document as of generation was saved
+        """
+        self.saved_generation = generation
+
+
+def open_document(xml_path, progress=None, cancel_event=None):
+    """
+    Parses an XML file and returns a Document for it. The arguments
+    are the same as for xml_io.parse_xml
+    """
+    return Document(xml_io.parse_xml(xml_path, progress, cancel_event),
+                    xml_path)
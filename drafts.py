@@ -0,0 +1,182 @@
+"""
+Housekeeping of the drafts directory
+
+Every open document has a journal in the drafts directory, see the
+journal module. A clean close deletes it, so the journals that are
+left at startup belong to sessions that crashed, or to another
+instance of the editor that is still running. Those are told apart by
+the lock of the journal. The journals of crashed sessions are offered
+for recovery, and the directory is kept within a size and age quota:
+
+- only the newest journal of every source file is kept
+- journals that cannot be replayed any more are deleted
+- journals older than DRAFTS_MAX_AGE are deleted
+- the least recently written journals are deleted while the
+  directory holds more than DRAFTS_MAX_SIZE bytes
+
+Journals that are in use by open pages or locked by a running session
+are never deleted. This module does not depend on wx
+"""
+
+import glob
+import journal
+import os
+import settings
+import time
+
+
+class Draft():
+    """
+    A journal in the drafts directory with its snapshot
+    """
+
+    def __init__(self, journal_path, header, edit_count):
+        self.journal_path = journal_path
+        self.source = header.get('source')
+        self.snapshot = header.get('snapshot')
+        self.edit_count = edit_count
+
+        self.size = 0
+        self.mtime = 0
+        for path in (journal_path, self.snapshot):
+            if path and os.path.exists(path):
+                stat = os.stat(path)
+                self.size += stat.st_size
+                self.mtime = max(self.mtime, stat.st_mtime)
+
+    @property
+    def recoverable(self):
+        """
+        False if neither the snapshot nor the source file exist, so
+        there is nothing to replay the edits onto
+        """
+        if self.snapshot:
+            return os.path.exists(self.snapshot)
+        return bool(self.source) and os.path.exists(self.source)
+
+    @property
+    def has_changes(self):
+        return bool(self.snapshot or self.edit_count)
+
+    @property
+    def locked(self):
+        """
+        True if a running session, e.g. another instance of the
+        editor, is writing the journal
+        """
+        return journal.is_locked(self.journal_path)
+
+    def delete(self):
+        journal.remove_files(self.journal_path, self.snapshot,
+                             journal.lock_path(self.journal_path))
+
+    def __repr__(self):
+        return 'Draft({!r}, {!r})'.format(self.journal_path, self.source)
+
+
+def list_drafts(drafts_location):
+    """
+    Returns the Drafts in drafts_location, newest first. Journals that
+    cannot be read are skipped
+    """
+    found = []
+    for journal_path in glob.glob(os.path.join(drafts_location,
+                                               '*.journal')):
+        try:
+            header, lines = journal.read_journal(journal_path)
+        except (IOError, ValueError):
+            continue
+        found.append(Draft(journal_path, header, len(lines)))
+    found.sort(key=lambda draft: draft.mtime, reverse=True)
+    return found
+
+
+def remove_strays(drafts_location, drafts):
+    """
+    Delete snapshots that no journal refers to, temporary files left
+    behind by a crash and the lock files of journals that are gone.
+    Must only be called while no journal in drafts_location is being
+    written
+    """
+    referenced = {os.path.abspath(draft.snapshot) for draft in drafts
+                  if draft.snapshot}
+    patterns = ('*.snapshot.xml', '*.snapshot.xml.gz', '*.journal.tmp')
+    for pattern in patterns:
+        for path in glob.glob(os.path.join(drafts_location, pattern)):
+            if os.path.abspath(path) not in referenced:
+                journal.remove_files(path)
+
+    for path in glob.glob(os.path.join(drafts_location, '*.journal.lock')):
+        journal_path = path[:-len('.lock')]
+        if (not os.path.exists(journal_path) and
+                not journal.is_locked(journal_path)):
+            journal.remove_files(path)
+
+
+def clean_up(drafts_location, in_use=(), max_size=None, max_age=None,
+             startup=False):
+    """
+    Enforce the quota of the drafts directory and return the Drafts
+    that are left, newest first
+
+    @param drafts_location: The drafts directory
+    @param in_use: Journal paths of the open pages, which are kept
+    @param max_size: Maximum number of bytes of all drafts
+    @param max_age: Maximum age of a draft in seconds
+    @param startup: True if this process writes no journal, which
+                    allows removing stray files unless another running
+                    session writes one
+    """
+    if max_size is None:
+        max_size = settings.DRAFTS_MAX_SIZE
+    if max_age is None:
+        max_age = settings.DRAFTS_MAX_AGE
+    if not os.path.isdir(drafts_location):
+        return []
+
+    in_use = {os.path.abspath(path) for path in in_use if path}
+    now = time.time()
+    kept = []
+    seen_sources = set()
+    for draft in list_drafts(drafts_location):
+        if draft.locked:
+            # Written by a running session, e.g. another instance. It
+            # does not count as the newest draft of its source
+            in_use.add(os.path.abspath(draft.journal_path))
+            kept.append(draft)
+        elif os.path.abspath(draft.journal_path) in in_use:
+            seen_sources.add(draft.source)
+            kept.append(draft)
+        elif (draft.source in seen_sources or not draft.recoverable or
+                not draft.has_changes or now - draft.mtime > max_age):
+            draft.delete()
+        else:
+            seen_sources.add(draft.source)
+            kept.append(draft)
+
+    total = sum(draft.size for draft in kept)
+    # Least recently written first
+    for draft in reversed(list(kept)):
+        if total <= max_size:
+            break
+        if os.path.abspath(draft.journal_path) in in_use:
+            continue
+        draft.delete()
+        kept.remove(draft)
+        total -= draft.size
+
+    if startup and not in_use:
+        remove_strays(drafts_location, kept)
+    return kept
+
+
+def orphaned_drafts(drafts_location, in_use=()):
+    """
+    Returns the Drafts that no open page and no other running session
+    is using after cleaning up the drafts directory at startup
+    """
+    in_use = {os.path.abspath(path) for path in in_use if path}
+    return [draft for draft in clean_up(drafts_location, in_use,
+                                        startup=not in_use)
+            if os.path.abspath(draft.journal_path) not in in_use and
+            not draft.locked]
@@ -6,10 +6,12 @@ class EditDialog(wx.Dialog):
     dialogs from
     """
 
-    def __init__(self, xml_obj, page_id, title, label_one, label_two):
+    def __init__(self, xml_obj, page_id, document, title, label_one,
+                 label_two):
         """
         @param xml_obj: The lxml XML object
         @param page_id: A unique id based on the current page being viewed
+        @param document: The document.Document of the page
         @param title: The title of the dialog
         @param label_one: The label text for the first text control
         @param label_two: The label text for the second text control
@@ -17,6 +19,7 @@ class EditDialog(wx.Dialog):
         wx.Dialog.__init__(self, None, title=title)
         self.xml_obj = xml_obj
         self.page_id = page_id
+        self.document = document
 
         flex_sizer = wx.FlexGridSizer(2, 2, gap=wx.Size(5, 5))
         btn_sizer = wx.BoxSizer(wx.HORIZONTAL)
@@ -1,14 +1,36 @@
+import doc_cache
+import edits
+import journal
 import lxml.etree as ET
 import os
+import settings
 import sys
 import time
 import utils
 import wx
+import xml_diff
+import xml_io
 
+from autosave import AutoSaveScheduler
 from boom_attribute_ed import AttributeEditorPanel
 from boom_tree import BoomTreePanel
 from boom_xml_editor import XmlEditorPanel
+from diff_dialog import DiffDialog
+from document import Document
+from file_watcher import file_signature
+from functools import partial
+from journal import EditJournal
+from large_document import LargeDocument, LargeNode, find_by_positions
 from pubsub import pub
+from search_index import SearchIndex
+from xml_io import XmlLoader
+
+PROGRESS_RANGE = 1000
+
+# What to do with the unsaved changes when the file changes on disk
+RELOAD = 'reload'
+MERGE = 'merge'
+
 
 class NewPage(wx.Panel):
     """
@@ -16,28 +38,73 @@ class NewPage(wx.Panel):
     top-level widget for the majority of the application
     """
 
-    def __init__(self, parent, xml_path, size, opened_files):
+    def __init__(self, parent, xml_path, size, opened_files, recover=None):
+        """
+        @param recover: True to recover the drafts of xml_path without
+                        asking, None to ask if there are any
+        """
         wx.Panel.__init__(self, parent)
         self.page_id = id(self)
-        self.xml_root = None
         self.size = size
         self.opened_files = opened_files
         self.current_file = xml_path
+        self.journal = None
+        # The lock of a journal that is being recovered, see
+        # journal.acquire_lock
+        self.session_lock = None
+        self.large_document = None
+        self.search_index = None
+        self.loader = None
+        self.differ = None
+        self.saver = None
+        self.reloader = None
+        self.recovering = False
+        self.closed = False
+
+        # While hibernated the document is only kept in the drafts
+        # journal. The tree state is restored when the page wakes up
+        self.hibernated = False
+        self.waking = False
+        # True while the tree is shown from a cached index and the
+        # document is still being parsed
+        self.previewing = False
+        self.tree_state = None
+        # The path of an element to select once the document is loaded
+        self.pending_element = None
+        self.last_active = time.monotonic()
         self.title = os.path.basename(xml_path)
+        self.current_directory = os.path.dirname(xml_path)
+        self.source_path = os.path.abspath(xml_path)
+
+        # The page is a view on the document, which owns the XML tree,
+        # its lock, the undo history and the dirty state
+        self.document = Document(path=xml_path)
+        self.document.subscribe(self.on_document_change)
+        self.lock = self.document.lock
+        self.shown_dirty = False
+
+        # The file as it was loaded or last saved, to tell changes by
+        # other programs from our own saves
+        self.disk_signature = file_signature(xml_path)
+        self.file_changed = False
+        self.watch_timer = None
+        # The edits since the document matched its file, which are
+        # redone on top of the file when it is changed by another
+        # program. None if they are not known, e.g. after a recovery
+        self.unsaved_edits = []
+        self.auto_saver = AutoSaveScheduler(self.write_draft,
+                                            self.on_draft_written)
 
         self.app_location = os.path.dirname(os.path.abspath( sys.argv[0] ))
 
         self.tmp_location = os.path.join(self.app_location, 'drafts')
+        self.cache_location = os.path.join(self.app_location, 'cache')
 
         pub.subscribe(self.save, 'save_{}'.format(self.page_id))
-        pub.subscribe(self.auto_save, 'on_change_{}'.format(self.page_id))
+        pub.subscribe(self.undo, 'undo_{}'.format(self.page_id))
+        pub.subscribe(self.redo, 'redo_{}'.format(self.page_id))
 
-        self.parse_xml(xml_path)
-
-        current_time = time.strftime('%Y-%m-%d.%H.%M.%S', time.localtime())
-        self.full_tmp_path = os.path.join(
-            self.tmp_location,
-            current_time + '-' + os.path.basename(xml_path))
+        self.Bind(wx.EVT_CLOSE, self.on_close)
 
         if not os.path.exists(self.tmp_location):
             try:
@@ -46,8 +113,84 @@ class NewPage(wx.Panel):
                 raise IOError('Unable to create file at {}'.format(
                     self.tmp_location))
 
-        if self.xml_root is not None:
-            self.create_editor()
+        self.full_tmp_path = journal.find_journal(self.tmp_location,
+                                                  self.source_path)
+        if self.full_tmp_path and (
+                recover or recover is None and utils.ask_to_recover(xml_path)):
+            self.recover_xml(self.full_tmp_path)
+        else:
+            if self.full_tmp_path:
+                journal.delete_journal(self.full_tmp_path)
+            self.new_draft_path()
+            self.parse_xml(xml_path)
+
+    @property
+    def xml_tree(self):
+        return self.document.xml_tree
+
+    @property
+    def xml_root(self):
+        """
+        The root element, or the root index node in huge file mode
+        """
+        if self.large_document:
+            return self.large_document.root
+        return self.document.root
+
+    @property
+    def dirty(self):
+        """
+        True if the document has changes that were not saved
+        """
+        return self.document.dirty
+
+    def update_title(self):
+        """
+        Mark the notebook tab of the page while it has unsaved changes
+        """
+        self.shown_dirty = self.dirty
+        notebook = self.GetParent()
+        index = notebook.GetPageIndex(self)
+        if index != wx.NOT_FOUND:
+            title = '*' + self.title if self.dirty else self.title
+            notebook.SetPageText(index, title)
+
+    def new_draft_path(self):
+        """
+        Sets the path of a fresh drafts journal for this page
+        """
+        current_time = time.strftime('%Y-%m-%d.%H.%M.%S', time.localtime())
+        self.full_tmp_path = os.path.join(
+            self.tmp_location,
+            current_time + '-' + self.title + '.journal')
+
+    def create_progress_panel(self):
+        """
+        Create the widgets that show the progress while the XML
+        is loading
+        """
+        self.progress_panel = wx.Panel(self)
+        sizer = wx.BoxSizer(wx.VERTICAL)
+
+        self.progress_lbl = wx.StaticText(
+            self.progress_panel, label='Loading {}'.format(self.title))
+        sizer.Add(self.progress_lbl, 0, wx.ALL|wx.CENTER, 5)
+
+        self.progress_gauge = wx.Gauge(self.progress_panel,
+                                       range=PROGRESS_RANGE)
+        sizer.Add(self.progress_gauge, 0, wx.ALL|wx.EXPAND, 5)
+
+        self.cancel_btn = wx.Button(self.progress_panel, label='Cancel')
+        self.cancel_btn.Bind(wx.EVT_BUTTON, self.on_cancel_load)
+        sizer.Add(self.cancel_btn, 0, wx.ALL|wx.CENTER, 5)
+        self.progress_panel.SetSizer(sizer)
+
+        page_sizer = wx.BoxSizer(wx.VERTICAL)
+        page_sizer.AddStretchSpacer()
+        page_sizer.Add(self.progress_panel, 0, wx.ALL|wx.EXPAND, 20)
+        page_sizer.AddStretchSpacer()
+        self.SetSizer(page_sizer)
+        self.Layout()
 
     def create_editor(self):
         """
@@ -56,14 +199,18 @@ class NewPage(wx.Panel):
         page_sizer = wx.BoxSizer(wx.VERTICAL)
 
         splitter = wx.SplitterWindow(self)
-        tree_panel = BoomTreePanel(splitter, self.xml_root, self.page_id)
+        tree_panel = BoomTreePanel(splitter, self.xml_root, self.page_id,
+                                   self.document, self.search_index)
+        self.splitter = splitter
+        self.tree_panel = tree_panel
 
         xml_editor_notebook = wx.Notebook(splitter)
-        xml_editor_panel = XmlEditorPanel(xml_editor_notebook, self.page_id)
+        xml_editor_panel = XmlEditorPanel(xml_editor_notebook, self.page_id,
+                                          self.document)
         xml_editor_notebook.AddPage(xml_editor_panel, 'Nodes')
 
         attribute_panel = AttributeEditorPanel(
-            xml_editor_notebook, self.page_id)
+            xml_editor_notebook, self.page_id, self.document)
         xml_editor_notebook.AddPage(attribute_panel, 'Attributes')
 
         splitter.SplitVertically(tree_panel, xml_editor_notebook)
@@ -73,59 +220,749 @@ class NewPage(wx.Panel):
         self.SetSizer(page_sizer)
         self.Layout()
 
-        self.Bind(wx.EVT_CLOSE, self.on_close)
+    def on_document_change(self, edit):
+        """
+        Called by the document for every change, with its lock held
+
+        The edit is queued in the drafts journal. Writing it to disk is
+        coalesced and done on a background thread by the autosave
+        scheduler. The views of the page are told via pubsub
+        """
+        if self.dirty != self.shown_dirty:
+            self.update_title()
+        self.journal.record(edit)
+        if self.unsaved_edits is not None:
+            self.unsaved_edits.append(edit.to_dict())
+        self.search_index.update(edit)
+        self.auto_saver.notify()
+        pub.sendMessage('on_change_{}'.format(self.page_id),
+                        event=None, edit=edit)
 
-    def auto_save(self, event):
+    def undo(self):
+        """
+        Undo the last edit. Called via pubsub
+        """
+        self.restore(self.document.undo())
+
+    def redo(self):
+        """
+        Redo the last undone edit. Called via pubsub
         """
-        Event handler that is called via pubsub to save the
-        current version of the XML to disk in a temporary location
+        self.restore(self.document.redo())
+
+    def restore(self, edit):
+        """
+        Show an edit that was undone or redone in the tree
+        """
+        if edit is not None:
+            pub.sendMessage('tree_restore_{}'.format(self.page_id),
+                            edit=edit)
+
+    def write_draft(self):
+        """
+        Append the queued edits to the drafts journal and write a full
+        snapshot of the XML when one is due
+
+        Called from the autosave worker thread
         """
-        self.xml_tree.write(self.full_tmp_path)
-        pub.sendMessage('on_change_status', save_path=self.full_tmp_path)
+        self.journal.flush()
+        if self.journal.snapshot_due():
+            with self.lock:
+                data = ET.tostring(self.xml_tree, encoding='UTF-8',
+                                   xml_declaration=True)
+                self.journal.discard_pending()
+            self.journal.write_snapshot(data)
+        return self.full_tmp_path
+
+    def on_draft_written(self, save_path, elapsed):
+        """
+        Called from the autosave worker thread once a draft is written.
+        Hands the status update over to the GUI thread
+        """
+        wx.CallAfter(pub.sendMessage, 'on_change_status',
+                     save_path=save_path, elapsed=elapsed)
 
     def parse_xml(self, xml_path):
         """
-        Parses the XML from the file that is passed in
+        Parses the XML from the file that is passed in on a background
+        thread. The editor is created once the parsing is done
+
+        Files above the huge file threshold are only indexed and opened
+        read-only, see large_document. Compressed files cannot be indexed
+        in place and are always parsed
         """
-        self.current_directory = os.path.dirname(xml_path)
+        self.recovering = False
+        size = os.path.getsize(xml_path)
+        if xml_io.is_compressed(xml_path):
+            self.load_xml(partial(xml_io.parse_xml, xml_path))
+        elif size >= settings.LARGE_FILE_THRESHOLD:
+            self.load_xml(partial(doc_cache.open_document,
+                                  self.cache_location, xml_path))
+        elif (size >= settings.CACHE_MIN_SIZE and
+                doc_cache.lookup(self.cache_location, xml_path)):
+            # Show the tree from the cached index right away and parse
+            # the document afterwards
+            self.previewing = True
+            self.load_xml(partial(doc_cache.open_document,
+                                  self.cache_location, xml_path))
+        else:
+            self.load_xml(partial(xml_io.parse_xml, xml_path))
+
+    def recover_xml(self, journal_path):
+        """
+        Rebuilds the XML from the drafts journal of an earlier session
+        on a background thread
+        """
+        self.recovering = True
+        # Keep other instances of the editor away from the journal
+        self.session_lock = journal.acquire_lock(journal_path)
+        self.load_xml(partial(journal.recover, journal_path))
+
+    def load_xml(self, load_func):
+        """
+        Show the progress widgets and start loading the XML
+        """
+        if not hasattr(self, 'progress_panel'):
+            self.create_progress_panel()
+        self.progress_gauge.SetValue(0)
+        self.loader = XmlLoader(load_func, self.on_load_done,
+                                self.on_load_progress)
+        self.loader.start()
+
+    def on_load_progress(self, bytes_read, total):
+        """
+        Called from the loader thread after every chunk that was parsed
+        """
+        wx.CallAfter(self.update_progress, bytes_read, total)
+
+    def on_load_done(self, xml_tree, error):
+        """
+        Called from the loader thread once it is done
+        """
+        wx.CallAfter(self.on_xml_loaded, xml_tree, error)
+
+    def update_progress(self, bytes_read, total):
+        """
+        Update the progress widgets with the number of bytes read
+        """
+        if self.closed or not self.loader:
+            return
+        if total:
+            self.progress_gauge.SetValue(
+                int(PROGRESS_RANGE * bytes_read / total))
+        msg = 'Loading {}: {:.1f} of {:.1f} MB'
+        self.progress_lbl.SetLabel(msg.format(
+            self.title, bytes_read / 1024**2, total / 1024**2))
+        self.progress_panel.Layout()
+
+    def on_xml_loaded(self, xml_tree, error):
+        """
+        Create the editor once the XML is loaded. Called on the
+        GUI thread
+        """
+        self.loader = None
+        if self.closed:
+            return
+
+        if error is not None and self.previewing and self.large_document:
+            print('Unable to open {}: {}'.format(self.current_file, error))
+            utils.warn_open_failed(self.current_file, error)
+            # Keep showing the read-only tree from the index
+            self.previewing = False
+            return
+        elif error is not None and self.waking:
+            print('Unable to reload {}: {}'.format(self.title, error))
+            utils.warn_open_failed(self.current_file, error)
+            self.progress_lbl.SetLabel(
+                'Unable to reload {}, the changes are kept in {}'.format(
+                    self.title, self.full_tmp_path))
+            self.progress_panel.Layout()
+            return
+        elif isinstance(error, xml_io.LoadCancelled):
+            pub.sendMessage('load_failed', page=self)
+            return
+        elif error is not None and self.recovering:
+            print('Unable to recover {}: {}'.format(self.full_tmp_path, error))
+            # The journal holds the only copy of the changes, so it is
+            # kept and the file is opened with a fresh draft
+            utils.warn_recover_failed(self.current_file, self.full_tmp_path,
+                                      error)
+            journal.release_lock(self.session_lock)
+            self.session_lock = None
+            self.new_draft_path()
+            self.parse_xml(self.current_file)
+            return
+        elif error is not None:
+            print('Unable to open {}: {}'.format(self.current_file, error))
+            utils.warn_open_failed(self.current_file, error)
+            pub.sendMessage('load_failed', page=self)
+            return
+
+        if hasattr(self, 'progress_panel'):
+            self.progress_panel.Destroy()
+            del self.progress_panel
+
+        tree_state = self.tree_state
+        find_element = None
+        if self.previewing and not isinstance(xml_tree, LargeDocument):
+            # The parsed document replaces the tree from the index
+            self.previewing = False
+            tree_state = self.tree_panel.tree.get_state(
+                LargeNode.position_path)
+            find_element = partial(find_by_positions, xml_tree.getroot())
+            self.destroy_editor()
+            self.large_document.close()
+            self.large_document = None
+
+        if isinstance(xml_tree, LargeDocument):
+            self.large_document = xml_tree
+            if self.previewing:
+                self.loader = XmlLoader(
+                    partial(xml_io.parse_xml, self.current_file),
+                    self.on_load_done)
+                self.loader.start()
+        else:
+            # The recovered changes were never saved
+            self.document.set_tree(xml_tree, changed=self.recovering)
+            if self.recovering:
+                self.unsaved_edits = None
+            if not self.waking:
+                self.journal = EditJournal(self.full_tmp_path,
+                                           self.source_path,
+                                           session_lock=self.session_lock)
+                self.session_lock = None
+            self.search_index = SearchIndex(self.xml_tree, self.lock)
+            self.search_index.start()
+            if (not self.recovering and not self.waking and
+                    not xml_io.is_compressed(self.current_file) and
+                    os.path.getsize(self.current_file) >=
+                    settings.CACHE_MIN_SIZE):
+                doc_cache.build_in_background(self.cache_location,
+                                              self.current_file)
+        self.create_editor()
+        self.update_title()
+
+        self.waking = False
+        self.hibernated = False
+        self.tree_state = None
+        if tree_state:
+            self.tree_panel.tree.restore_state(*tree_state,
+                                               find_element=find_element)
+        if self.pending_element and not self.previewing:
+            self.show_element(self.pending_element)
+        self.check_pending_change()
+
+    def show_element(self, path):
+        """
+        Select the element at path in the tree, once the document is
+        loaded. Huge files are not supported
+        """
+        self.pending_element = None
+        if self.large_document and not self.previewing:
+            return
+        if self.xml_tree is None or self.previewing:
+            self.pending_element = path
+            return
         try:
-            self.xml_tree = ET.parse(xml_path)
-        except IOError:
-            print('Bad file')
+            element = edits.find_element(self.xml_tree, path)
+        except KeyError:
+            print('No element at {} in {}'.format(path, self.title))
             return
-        except Exception as e:
-            print('Really bad error')
-            print(e)
+        pub.sendMessage('tree_select_{}'.format(self.page_id),
+                        element=element)
+
+    @property
+    def can_hibernate(self):
+        """
+        True if the document is loaded and nothing is working on it
+        """
+        return (self.xml_tree is not None and not self.hibernated and
+                not self.closed and not self.loader and not self.saver and
+                not self.differ and not self.reloader)
+
+    def memory_estimate(self):
+        """
+        Returns a rough estimate of the bytes the loaded document uses
+        """
+        if self.xml_tree is None:
+            return 0
+        try:
+            size = os.path.getsize(self.current_file)
+        except OSError:
+            return 0
+        return size * settings.TREE_MEMORY_FACTOR
+
+    def hibernate(self):
+        """
+        Unload the document and the editor widgets to free memory
+
+        The pending edits are flushed to the drafts journal, which
+        together with the file or the last snapshot holds the whole
+        document. The undo history is dropped because it refers to the
+        elements of the unloaded tree
+        """
+        if not self.can_hibernate:
             return
 
-        self.xml_root = self.xml_tree.getroot()
+        self.tree_state = self.tree_panel.tree.get_state()
+        # Stopping waits for a draft that is being written
+        self.auto_saver.stop()
+        self.journal.flush()
+        if (self.journal.snapshot_path is None and
+                self.journal.edits_since_snapshot):
+            # The file can change while the page sleeps, so the edits
+            # must not be replayed onto it
+            with self.lock:
+                data = ET.tostring(self.xml_tree, encoding='UTF-8',
+                                   xml_declaration=True)
+                self.journal.discard_pending()
+            self.journal.write_snapshot(data)
+        self.destroy_editor()
+
+        self.search_index.stop()
+        self.search_index = None
+        self.document.set_tree(None)
+        self.hibernated = True
+
+    def destroy_editor(self):
+        """
+        Close the dialogs bound to the document and destroy the editor
+        widgets
+        """
+        if self.tree_panel.tree.selection_timer:
+            self.tree_panel.tree.selection_timer.Stop()
+        pub.sendMessage('document_closed_{}'.format(self.page_id))
+
+        splitter = self.splitter
+        pub.unsubAll(listenerFilter=lambda listener: self.is_editor_listener(
+            splitter, listener))
+        splitter.Destroy()
+        self.splitter = None
+        self.tree_panel = None
+
+    def is_editor_listener(self, splitter, listener):
+        """
+        Returns True if the pubsub listener belongs to one of the
+        editor widgets
+        """
+        owner = getattr(listener.getCallable(), '__self__', None)
+        return isinstance(owner, wx.Window) and (
+            owner is splitter or splitter.IsDescendant(owner))
+
+    def wake(self):
+        """
+        Reload a hibernated document from the drafts journal
+        """
+        self.last_active = time.monotonic()
+        if not self.hibernated or self.waking:
+            return
+
+        self.waking = True
+        self.recovering = False
+        self.auto_saver = AutoSaveScheduler(self.write_draft,
+                                            self.on_draft_written)
+        self.load_xml(partial(journal.recover, self.full_tmp_path))
+        # The drafts hold the only copy of the changes
+        self.cancel_btn.Disable()
+
+    def on_cancel_load(self, event):
+        """
+        Event handler that is called when the Cancel button is pressed
+        while the XML is loading
+        """
+        if self.loader:
+            self.loader.cancel()
+
+    def compare_with_file(self):
+        """
+        Compare the document with the file it was opened from
+        """
+        self.compare(partial(self.diff_with_file, self.current_file),
+                     'Changes to {} since it was opened'.format(self.title))
+
+    def compare_with_page(self, other):
+        """
+        Compare the document with the document of another page
+        """
+        self.compare(partial(self.diff_with_page, other),
+                     'Differences between {} and {}'.format(other.title,
+                                                            self.title))
+
+    def compare(self, diff_func, title):
+        """
+        Run a diff function on a background thread and show the
+        differences once it is done
+        """
+        if self.previewing:
+            pub.sendMessage('save_status', message='{} is still loading'.format(
+                self.title))
+            return
+        if self.large_document:
+            utils.warn_huge_file_mode('Comparing')
+            return
+        if self.xml_root is None or self.differ:
+            return
+
+        self.differ = XmlLoader(
+            diff_func,
+            lambda result, error: wx.CallAfter(self.on_diff_done, title,
+                                               result, error))
+        self.differ.start()
+
+    def diff_with_file(self, xml_path, progress=None, cancel_event=None):
+        """
+        Parse the XML file and compare it with the document. Called on
+        the background thread
+        """
+        other = xml_io.parse_xml(xml_path, progress, cancel_event)
+        with self.lock:
+            return xml_diff.diff_trees(other.getroot(), self.xml_root,
+                                       cancel_event)
+
+    def diff_with_page(self, other, progress=None, cancel_event=None):
+        """
+        Compare the document of another page with the document. Called
+        on the background thread
+        """
+        # Always take the locks in the same order
+        first, second = sorted([self, other], key=lambda page: page.page_id)
+        with first.lock, second.lock:
+            return xml_diff.diff_trees(other.xml_root, self.xml_root,
+                                       cancel_event)
+
+    def on_diff_done(self, title, result, error):
+        """
+        Show the differences that were found. Called on the GUI thread
+        """
+        self.differ = None
+        if self.closed or isinstance(error, xml_io.LoadCancelled):
+            return
+        self.check_pending_change()
+        if error is not None:
+            print('Unable to compare {}: {}'.format(self.title, error))
+            return
+
+        dlg = DiffDialog(self.GetTopLevelParent(), self, result, title)
+        dlg.Show()
+
+    @property
+    def is_busy(self):
+        """
+        True while the document is being loaded, saved or compared, or
+        is not loaded
+        """
+        return bool(self.loader or self.saver or self.differ or
+                    self.reloader or self.hibernated or self.previewing)
+
+    def on_file_changed(self):
+        """
+        Called on the GUI thread when the file watcher of the main
+        frame saw the file change. The file is checked once it did not
+        change for WATCH_SETTLE_DELAY seconds
+        """
+        if self.closed:
+            return
+        delay = int(settings.WATCH_SETTLE_DELAY * 1000)
+        if self.watch_timer:
+            self.watch_timer.Start(delay)
+        else:
+            self.watch_timer = wx.CallLater(delay, self.check_file)
+
+    def check_pending_change(self):
+        """
+        Check a change to the file that came in while the page was busy
+        """
+        if self.file_changed and not self.is_busy:
+            self.file_changed = False
+            self.check_file()
+
+    def check_file(self):
+        """
+        Bring the document up to date with its file if another program
+        changed it. If there are unsaved changes the user is asked
+        whether to merge them, discard them or keep the document
+        """
+        self.watch_timer = None
+        if self.closed:
+            return
+        signature = file_signature(self.current_file)
+        if signature is None or signature == self.disk_signature:
+            # Deleted, or written by our own save
+            return
+        if self.is_busy:
+            self.file_changed = True
+            return
+        if self.large_document:
+            self.disk_signature = signature
+            pub.sendMessage('save_status', message=(
+                '{} was changed by another program, open it again to see '
+                'the changes').format(self.title))
+            return
+
+        mode = RELOAD
+        if self.dirty:
+            mode = utils.ask_external_change(self.title,
+                                             self.unsaved_edits is not None)
+            if mode is None:
+                # The next save overwrites the changes of the other
+                # program
+                self.disk_signature = signature
+                return
+        self.reload_file(signature, mode)
+
+    def reload_file(self, signature, mode):
+        """
+        Parse the changed file and compare it with the document on a
+        background thread
+
+        @param signature: The file_signature of the changed file
+        @param mode: RELOAD or MERGE
+        """
+        unsaved_edits = list(self.unsaved_edits) if mode == MERGE else []
+        self.reloader = XmlLoader(
+            partial(self.read_changed_file, unsaved_edits),
+            lambda result, error: wx.CallAfter(
+                self.on_reloaded, signature, mode, result, error),
+            name='xml-reloader')
+        self.reloader.start()
+
+    def read_changed_file(self, unsaved_edits, progress=None,
+                          cancel_event=None):
+        """
+        Parse the file, redo the unsaved edits on it and compare it
+        with the document. Called on the background thread
+
+        Siblings that the other program only reordered are part of the
+        diff, so they are put in the new order by xml_diff.patch
+
+        Returns the parsed tree, the DiffResult, the generation of the
+        document that was compared, the edits that were redone and the
+        number of edits that could not be redone
+        """
+        xml_tree = xml_io.parse_xml(self.current_file, progress,
+                                    cancel_event)
+        merged = []
+        conflicts = 0
+        for data in unsaved_edits:
+            try:
+                merged.append(edits.apply(xml_tree, data).to_dict())
+            except (KeyError, ValueError, ET.XPathError):
+                conflicts += 1
+        with self.lock:
+            generation = self.document.generation
+            result = xml_diff.diff_trees(self.xml_root, xml_tree.getroot(),
+                                         cancel_event)
+        return xml_tree, result, generation, merged, conflicts
+
+    def on_reloaded(self, signature, mode, result, error):
+        """
+        Change the document to match the file that was read, keeping
+        the elements and tree items that did not change. Called on the
+        GUI thread
+        """
+        self.reloader = None
+        if self.closed or isinstance(error, xml_io.LoadCancelled):
+            return
+        if error is not None:
+            # The file is checked again when it changes the next time
+            print('Unable to reload {}: {}'.format(self.current_file, error))
+            pub.sendMessage('save_status', message='Unable to reload {}'.format(
+                self.title))
+            self.check_pending_change()
+            return
+
+        xml_tree, diff, generation, merged, conflicts = result
+        if generation != self.document.generation:
+            # The document was edited while the file was compared
+            self.reload_file(signature, mode)
+            return
+
+        self.disk_signature = signature
+        # The journal must not replay onto the old file after a crash
+        self.journal.request_snapshot()
+        if diff.root_changed:
+            self.replace_document(xml_tree, changed=bool(merged))
+        elif diff:
+            edit = self.document.apply(xml_diff.patch, self.xml_root, diff)
+            pub.sendMessage('tree_patch_{}'.format(self.page_id), edit=edit)
+
+        if mode == MERGE:
+            self.unsaved_edits = merged
+        else:
+            self.document.mark_saved(self.document.generation)
+            self.unsaved_edits = []
+        self.update_title()
+        if diff:
+            pub.sendMessage('save_status', message='{} {} from disk'.format(
+                'Merged' if mode == MERGE else 'Reloaded', self.title))
+        if conflicts:
+            utils.warn_merge_conflicts(self.title, conflicts)
+        self.check_pending_change()
+
+    def replace_document(self, xml_tree, changed):
+        """
+        Show a document that has nothing in common with the current one
+        in its place. The undo history is lost
+        """
+        tree_state = self.tree_panel.tree.get_state()
+        self.destroy_editor()
+        self.search_index.stop()
+        self.document.set_tree(xml_tree, changed=changed)
+        self.search_index = SearchIndex(self.xml_tree, self.lock)
+        self.search_index.start()
+        self.auto_saver.notify()
+        self.create_editor()
+        self.tree_panel.tree.restore_state(*tree_state)
 
     def save(self, location=None):
         """
         Save the XML to disk
         """
+        if self.previewing:
+            pub.sendMessage('save_status', message='{} is still loading'.format(
+                self.title))
+            return
+        if self.large_document:
+            utils.warn_read_only()
+            return
+
+        if self.xml_tree is None and not self.hibernated:
+            return
+
         if not location:
             path = utils.save_file(self)
+            if path and '.xml' not in path:
+                path += '.xml'
         else:
             path = location
 
         if path:
-            if '.xml' not in path:
-                path += '.xml'
+            if self.saver:
+                print('{} is still being saved'.format(self.title))
+                return
+            if (os.path.abspath(path) == self.source_path and
+                    file_signature(path) not in (None, self.disk_signature)
+                    and not utils.ask_to_overwrite(self.title)):
+                return
+
+            # Only the serialization blocks edits. Edits that are made
+            # while the file is written belong to the next save. A
+            # hibernated document is rebuilt from the drafts on the
+            # saver thread
+            with self.lock:
+                if self.hibernated:
+                    generation = self.document.generation
+                    write_func = partial(self.write_hibernated, path)
+                else:
+                    generation, data = self.document.serialize()
+                    write_func = partial(xml_io.write_file, data, path)
+                journal_mark = self.journal.mark()
+            edit_count = (len(self.unsaved_edits)
+                          if self.unsaved_edits is not None else None)
 
-            # Save the xml
-            self.xml_tree.write(path)
-            self.changed = False
+            pub.sendMessage('save_status', message='Saving {}...'.format(
+                os.path.basename(path)))
+            self.saver = XmlLoader(
+                write_func,
+                lambda result, error: wx.CallAfter(
+                    self.on_saved, path, generation, edit_count,
+                    journal_mark, error),
+                self.on_save_progress, name='xml-saver')
+            self.saver.start()
+
+    def write_hibernated(self, path, progress=None, cancel_event=None):
+        """
+        Replay the drafts journal of the hibernated document and write
+        the result to path. Called on the saver thread
+        """
+        xml_tree = journal.recover(self.full_tmp_path,
+                                   cancel_event=cancel_event)
+        xml_io.write_file(xml_io.serialize_xml(xml_tree), path, progress,
+                          cancel_event)
+
+    def on_save_progress(self, bytes_written, total):
+        """
+        Called from the saver thread after every chunk that was written
+        """
+        msg = 'Saving {}: {:.0%}'.format(self.title, bytes_written / total)
+        wx.CallAfter(pub.sendMessage, 'save_status', message=msg)
+
+    def on_saved(self, path, generation, edit_count, journal_mark, error):
+        """
+        Called on the GUI thread once the file is written
+
+        @param edit_count: The number of unsaved edits that were saved
+        @param journal_mark: The EditJournal.mark of the saved edits
+        """
+        self.saver = None
+        if error is not None:
+            print('Unable to save {}: {}'.format(path, error))
+            pub.sendMessage('save_status', message='Saving failed')
+            if not self.closed:
+                utils.warn_save_failed(path, error)
+                self.check_pending_change()
+            return
+
+        self.document.mark_saved(generation)
+        if os.path.abspath(path) == self.source_path:
+            self.disk_signature = file_signature(path)
+            if not self.closed:
+                # The drafts must not replay the saved edits onto the
+                # file again
+                self.journal.rebase(journal_mark)
+            if edit_count is not None:
+                del self.unsaved_edits[:edit_count]
+            elif generation == self.document.generation:
+                # The document matches the file again
+                self.unsaved_edits = []
+        if not self.closed:
+            self.update_title()
+        msg = 'Last saved at {}'.format(time.strftime('%H:%M:%S',
+                                                      time.localtime()))
+        pub.sendMessage('save_status', message=msg)
+        if not self.closed:
+            self.check_pending_change()
+
+    def wait_for_save(self):
+        """
+        Block until a save that is in flight is written. Returns the
+        error if it failed
+        """
+        saver = self.saver
+        if saver:
+            saver.join()
+            return saver.error
+        return None
 
     def on_close(self, event):
         """
         Event handler that is called when the panel is being closed
         """
+        self.closed = True
+        pub.sendMessage('document_closed_{}'.format(self.page_id))
+        if self.loader:
+            self.loader.cancel()
+        if self.differ:
+            self.differ.cancel()
+        if self.reloader:
+            self.reloader.cancel()
+        if self.watch_timer:
+            self.watch_timer.Stop()
+        save_error = self.wait_for_save()
+        self.auto_saver.stop()
+
         if self.current_file in self.opened_files:
             self.opened_files.remove(self.current_file)
 
-        if os.path.exists(self.full_tmp_path):
-            try:
-                os.remove(self.full_tmp_path)
-            except IOError:
-                print('Unable to delete file: {}'.format(self.full_tmp_path))
+        if self.journal and save_error is not None:
+            # The changes that could not be saved can be recovered
+            self.journal.close()
+        elif self.journal:
+            self.journal.discard()
+        # A journal whose recovery did not finish is kept for later
+        journal.release_lock(self.session_lock)
+        self.session_lock = None
+        if self.large_document:
+            self.large_document.close()
+        if self.search_index:
+            self.search_index.stop()
@@ -0,0 +1,260 @@
+"""
+The edit operations that can be applied to an XML document
+
+Every function here changes an lxml element and returns an Edit
+record describing what was done. The records address elements by
+their path so they can be written to a journal and replayed onto
+another copy of the document later on. This module does not depend
+on wx
+"""
+
+import copy
+import lxml.etree as ET
+
+
+class Edit():
+    """
+    Describes a single change to an XML document
+    """
+
+    def __init__(self, op, path, element, old=None, **args):
+        """
+        @param op: The name of the operation, e.g. 'set_text'
+        @param path: The element path of the element that was changed
+        @param element: The element that was changed or created
+        @param old: A dict with the values from before the change. They
+                    are not needed to replay the edit
+        @param args: The arguments needed to replay the operation
+        """
+        self.op = op
+        self.path = path
+        self.element = element
+        self.old = old or {}
+        self.args = args
+        # The edits that make up a batch
+        self.children = []
+
+    def to_dict(self):
+        """
+        Returns a JSON serializable representation of the edit
+        """
+        data = {'op': self.op, 'path': self.path}
+        data.update(self.args)
+        return data
+
+    def __repr__(self):
+        return 'Edit({!r}, {!r}, {!r})'.format(self.op, self.path, self.args)
+
+
+def get_path(element):
+    """
+    Returns the path that addresses the element in its document
+
+    The path is an XPath that can be evaluated without a namespace
+    map. lxml writes steps with a namespace prefix, e.g. p:child, for
+    the elements of prefixed namespaces. Those steps are replaced by
+    the position of the element among its element siblings, the way
+    lxml already addresses the elements of a default namespace
+    """
+    path = element.getroottree().getpath(element)
+    if ':' not in path:
+        return path
+
+    steps = path.split('/')
+    node = element
+    for index in range(len(steps) - 1, 0, -1):
+        if ':' in steps[index] and isinstance(node.tag, str):
+            steps[index] = '*[{}]'.format(element_position(node))
+        node = node.getparent()
+    return '/'.join(steps)
+
+
+def element_position(element):
+    """
+    Returns the 1-based position of an element among the elements
+    that share its parent
+    """
+    return 1 + sum(1 for sibling in element.itersiblings(preceding=True)
+                   if isinstance(sibling.tag, str))
+
+
+def find_element(tree, path):
+    """
+    Returns the element addressed by path in the given tree. Raises
+    KeyError if there is none or the path is not a valid XPath
+    """
+    try:
+        result = tree.xpath(path)
+    except ET.XPathError as error:
+        raise KeyError('Invalid path {}: {}'.format(path, error))
+    if not result:
+        raise KeyError('No element at {}'.format(path))
+    return result[0]
+
+
+def set_text(element, text):
+    """
+    Sets the text of an element
+    """
+    old = {'text': element.text}
+    element.text = text
+    return Edit('set_text', get_path(element), element, old, text=text)
+
+
+def set_attribute(element, name, value):
+    """
+    Adds an attribute to an element or changes its value
+    """
+    old = {'value': element.get(name)}
+    element.attrib[name] = value
+    return Edit('set_attribute', get_path(element), element, old,
+                name=name, value=value)
+
+
+def rename_attribute(element, old_name, new_name, value):
+    """
+    Replaces the attribute old_name with new_name, giving it value
+    """
+    old = {'value': element.get(old_name),
+           'new_value': element.get(new_name)}
+    if old_name in element.attrib:
+        element.attrib.pop(old_name)
+    element.attrib[new_name] = value
+    return Edit('rename_attribute', get_path(element), element, old,
+                old_name=old_name, new_name=new_name, value=value)
+
+
+def delete_attribute(element, name):
+    """
+    Removes an attribute from an element
+    """
+    old = {'value': element.attrib.pop(name)}
+    return Edit('delete_attribute', get_path(element), element, old,
+                name=name)
+
+
+def add_node(parent, tag, text=None):
+    """
+    Appends a new sub-element to parent
+    """
+    element = ET.SubElement(parent, tag)
+    element.text = text
+    return Edit('add_node', get_path(parent), element, tag=tag, text=text)
+
+
+def remove_node(element):
+    """
+    Removes an element and all of its children from the document
+    """
+    path = get_path(element)
+    parent = element.getparent()
+    old = {'parent': parent, 'index': parent.index(element),
+           'tail': element.tail}
+    parent.remove(element)
+    return Edit('remove_node', path, element, old)
+
+
+def insert_node(parent, index, element):
+    """
+    Inserts a detached element, e.g. one that was removed earlier, at
+    the given position in parent
+    """
+    parent.insert(index, element)
+    xml = ET.tostring(element, encoding='unicode', with_tail=False)
+    return Edit('insert_node', get_path(parent), element,
+                index=index, xml=xml, tail=element.tail)
+
+
+def paste_node(parent, source):
+    """
+    Appends a copy of source (and its children) to parent
+    """
+    element = copy.deepcopy(source)
+    element.tail = None
+    parent.append(element)
+    xml = ET.tostring(element, encoding='unicode')
+    return Edit('paste_node', get_path(parent), element, xml=xml)
+
+
+def batch(edit_list):
+    """
+    Combines edits that were made together into a single edit
+    """
+    edit = Edit('batch', None, None,
+                edits=[child.to_dict() for child in edit_list])
+    edit.children = list(edit_list)
+    return edit
+
+
+def revert(edit):
+    """
+    Undoes an edit that was made to the document and returns the Edit
+    record of the change. Reverting that record redoes the edit
+
+    Removed elements are kept by their edit record, so a removal can
+    be undone without a copy of the document
+    """
+    element = edit.element
+    op = edit.op
+    if op == 'batch':
+        return batch([revert(child) for child in reversed(edit.children)])
+    elif op == 'set_text':
+        return set_text(element, edit.old['text'])
+    elif op in ('set_attribute', 'delete_attribute'):
+        name = edit.args['name']
+        if edit.old['value'] is None:
+            return delete_attribute(element, name)
+        return set_attribute(element, name, edit.old['value'])
+    elif op == 'rename_attribute':
+        old_name = edit.args['old_name']
+        new_name = edit.args['new_name']
+        if edit.old['value'] is None:
+            reverted = delete_attribute(element, new_name)
+        else:
+            reverted = rename_attribute(element, new_name, old_name,
+                                        edit.old['value'])
+        if edit.old['new_value'] is None:
+            return reverted
+        return batch([reverted, set_attribute(element, new_name,
+                                              edit.old['new_value'])])
+    elif op in ('add_node', 'paste_node', 'insert_node'):
+        return remove_node(element)
+    elif op == 'remove_node':
+        element.tail = edit.old['tail']
+        return insert_node(edit.old['parent'], edit.old['index'], element)
+
+    raise ValueError('Unknown edit operation: {}'.format(op))
+
+
+def apply(tree, data):
+    """
+    Replays an edit that was serialized with Edit.to_dict onto the
+    given tree and returns the new Edit record
+    """
+    op = data['op']
+    if op == 'batch':
+        return batch([apply(tree, child) for child in data['edits']])
+
+    element = find_element(tree, data['path'])
+
+    if op == 'set_text':
+        return set_text(element, data['text'])
+    elif op == 'set_attribute':
+        return set_attribute(element, data['name'], data['value'])
+    elif op == 'rename_attribute':
+        return rename_attribute(element, data['old_name'],
+                                data['new_name'], data['value'])
+    elif op == 'delete_attribute':
+        return delete_attribute(element, data['name'])
+    elif op == 'add_node':
+        return add_node(element, data['tag'], data['text'])
+    elif op == 'remove_node':
+        return remove_node(element)
+    elif op == 'paste_node':
+        return paste_node(element, ET.fromstring(data['xml']))
+    elif op == 'insert_node':
+        node = ET.fromstring(data['xml'])
+        node.tail = data['tail']
+        return insert_node(element, data['index'], node)
+
+    raise ValueError('Unknown edit operation: {}'.format(op))
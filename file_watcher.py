@@ -0,0 +1,221 @@
+"""
+Notices when open files are changed by other programs
+
+On Linux the directories of the watched files are watched with
+inotify, through ctypes, so changes are seen right away without any
+work while nothing happens. Everywhere else, or if inotify cannot be
+used, the files are polled for a new size or modification time every
+WATCH_POLL_INTERVAL seconds. Directories are watched rather than the
+files themselves, so files that are replaced by renaming a new file
+over them are still noticed.
+
+The callback is called on the watcher thread with the path of a file
+that changed. A file that is written in several steps can be reported
+more than once. This module does not depend on wx
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import settings
+import struct
+import sys
+import threading
+
+# inotify event masks, from <sys/inotify.h>
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_ATTRIB
+
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def file_signature(path):
+    """
+    Returns what tells the versions of a file apart, or None if the
+    file does not exist
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class Inotify():
+    """
+    A minimal ctypes wrapper around the inotify system calls
+    """
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                    ctypes.c_uint32]
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+    def add_watch(self, directory):
+        wd = self._add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(),
+                          'Unable to watch {}'.format(directory))
+        return wd
+
+    def rm_watch(self, wd):
+        self._rm_watch(self.fd, wd)
+
+    def read_events(self):
+        """
+        Returns the (watch descriptor, mask, name) of the events that
+        are waiting
+        """
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            events.append((wd, mask, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class FileWatcher(threading.Thread):
+    """
+    Watches a set of files on a daemon thread
+    """
+
+    def __init__(self, on_change, poll_interval=None, use_inotify=True):
+        """
+        @param on_change: Called with the path of a file that changed
+        @param poll_interval: Seconds between polls of the fallback
+        @param use_inotify: False to always poll
+        """
+        threading.Thread.__init__(self, name='file-watcher', daemon=True)
+        if poll_interval is None:
+            poll_interval = settings.WATCH_POLL_INTERVAL
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        self.stopped = threading.Event()
+        self._lock = threading.Lock()
+
+        # Watched path -> signature, for polling
+        self.paths = {}
+        # Directory -> [watch descriptor, number of watched files]
+        self.directories = {}
+        self.watch_dirs = {}
+
+        self.inotify = None
+        if use_inotify and sys.platform.startswith('linux'):
+            try:
+                self.inotify = Inotify()
+            except (OSError, AttributeError) as error:
+                print('inotify is not available, polling instead: {}'.format(
+                    error))
+
+    def watch(self, path):
+        """
+        Start reporting changes to the file at path
+        """
+        path = os.path.abspath(path)
+        with self._lock:
+            if path in self.paths:
+                return
+            self.paths[path] = file_signature(path)
+            if self.inotify is None:
+                return
+            directory = os.path.dirname(path)
+            entry = self.directories.get(directory)
+            if entry is None:
+                try:
+                    wd = self.inotify.add_watch(directory)
+                except OSError as error:
+                    print(error)
+                    return
+                entry = self.directories[directory] = [wd, 0]
+                self.watch_dirs[wd] = directory
+            entry[1] += 1
+
+    def unwatch(self, path):
+        """
+        Stop reporting changes to the file at path
+        """
+        path = os.path.abspath(path)
+        with self._lock:
+            if self.paths.pop(path, False) is False:
+                return
+            if self.inotify is None:
+                return
+            directory = os.path.dirname(path)
+            entry = self.directories.get(directory)
+            if entry is None:
+                return
+            entry[1] -= 1
+            if not entry[1]:
+                self.inotify.rm_watch(entry[0])
+                del self.directories[directory]
+                self.watch_dirs.pop(entry[0], None)
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        if self.inotify is not None:
+            self.run_inotify()
+        else:
+            self.run_polling()
+
+    def run_inotify(self):
+        try:
+            while not self.stopped.is_set():
+                # The timeout lets the thread notice that it was stopped
+                ready, _, _ = select.select([self.inotify.fd], [], [], 0.5)
+                if not ready:
+                    continue
+                changed = set()
+                with self._lock:
+                    for wd, mask, name in self.inotify.read_events():
+                        if mask & IN_Q_OVERFLOW:
+                            # Events were lost, check every file
+                            changed.update(self.paths)
+                            continue
+                        directory = self.watch_dirs.get(wd)
+                        if directory is None:
+                            continue
+                        path = os.path.join(directory, name)
+                        if path in self.paths:
+                            changed.add(path)
+                for path in changed:
+                    self.on_change(path)
+        finally:
+            self.inotify.close()
+
+    def run_polling(self):
+        while not self.stopped.wait(self.poll_interval):
+            changed = []
+            with self._lock:
+                for path, signature in self.paths.items():
+                    current = file_signature(path)
+                    if current != signature:
+                        self.paths[path] = current
+                        changed.append(path)
+            for path in changed:
+                self.on_change(path)
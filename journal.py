@@ -0,0 +1,413 @@
+"""
+An append-only journal of edits used for drafts
+
+Instead of writing the whole document on every autosave, the edits
+are appended to a journal file. A full snapshot of the document is
+only written every so often, after which the journal starts over.
+Replaying the journal onto the last snapshot (or onto the original
+file if no snapshot was taken yet) gives back the edited document.
+
+The first line of a journal is a JSON header; every other line is
+one JSON encoded edit. While a journal is written, its session holds
+an exclusive lock on a .lock file next to it, so other instances of
+the editor can tell it from a journal left behind by a crash. The
+operating system drops the lock when the process ends. This module
+does not depend on wx
+"""
+
+import edits
+import glob
+import gzip
+import json
+import os
+import settings
+import threading
+import time
+import xml_io
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+
+class EditJournal():
+    """
+    Journal of the edits made to a single open document
+    """
+
+    def __init__(self, journal_path, source_path,
+                 snapshot_every=None, snapshot_interval=None, compress=None,
+                 session_lock=None):
+        """
+        @param journal_path: Where the journal is written
+        @param source_path: The XML file the edits apply to
+        @param snapshot_every: Number of edits after which a snapshot is due
+        @param snapshot_interval: Seconds after which a snapshot is due
+                                  if there have been edits
+        @param compress: True to write the snapshots gzip compressed
+        @param session_lock: The lock of the journal if it was already
+                             taken with acquire_lock, e.g. while the
+                             journal was recovered
+        """
+        self.journal_path = journal_path
+        self.source_path = source_path
+        if snapshot_every is None:
+            snapshot_every = settings.JOURNAL_SNAPSHOT_EVERY
+        if snapshot_interval is None:
+            snapshot_interval = settings.JOURNAL_SNAPSHOT_INTERVAL
+        if compress is None:
+            compress = settings.DRAFTS_COMPRESS_SNAPSHOTS
+        self.snapshot_every = snapshot_every
+        self.snapshot_interval = snapshot_interval
+        self.compress = compress
+
+        self.snapshot_path = None
+        self.snapshot_count = 0
+        self.edits_since_snapshot = 0
+        self.last_snapshot_time = time.monotonic()
+        self.snapshot_requested = False
+        self._pending = []
+        self._lock = threading.Lock()
+        # Held while the journal file is written, which happens on the
+        # autosave thread and, for a rebase, on the GUI thread
+        self._file_lock = threading.Lock()
+        self.session_lock = session_lock or acquire_lock(journal_path)
+
+        # Edits are numbered in the order they are recorded. first_edit
+        # is the number of the first edit line in the journal file
+        self.recorded = 0
+        self.first_edit = 0
+        # The number of edits a snapshot that is being written holds
+        self._snapshot_start = None
+
+        if os.path.exists(journal_path):
+            # Resume a journal left behind by an earlier session
+            header, lines = read_journal(journal_path)
+            self.snapshot_path = header.get('snapshot')
+            self.snapshot_count = header.get('snapshot_count', 0)
+            self.edits_since_snapshot = len(lines)
+            self.recorded = len(lines)
+        else:
+            self._write_header()
+
+    def _write_header(self, lines=()):
+        """
+        (Re)starts the journal file with a header line, followed by the
+        given edit lines
+        """
+        header = {'source': self.source_path,
+                  'snapshot': self.snapshot_path,
+                  'snapshot_count': self.snapshot_count}
+        tmp_path = self.journal_path + '.tmp'
+        with open(tmp_path, 'w') as fobj:
+            fobj.write(json.dumps(header))
+            fobj.write('\n')
+            for line in lines:
+                fobj.write(line)
+                fobj.write('\n')
+        os.replace(tmp_path, self.journal_path)
+
+    def record(self, edit):
+        """
+        Queue an edit to be appended on the next flush. This is cheap
+        and safe to call from the GUI thread
+        """
+        line = json.dumps(edit.to_dict())
+        with self._lock:
+            self._pending.append(line)
+            self.recorded += 1
+
+    def mark(self):
+        """
+        Returns the number of edits recorded so far. Called while the
+        document is serialized for a save, see rebase
+        """
+        with self._lock:
+            return self.recorded
+
+    def flush(self):
+        """
+        Append the queued edits to the journal file
+        """
+        with self._file_lock:
+            with self._lock:
+                lines, self._pending = self._pending, []
+
+            if lines:
+                with open(self.journal_path, 'a') as fobj:
+                    fobj.write('\n'.join(lines))
+                    fobj.write('\n')
+                self.edits_since_snapshot += len(lines)
+
+    def rebase(self, mark):
+        """
+        Start the journal over on top of the source file, which was
+        saved with the edits before mark, see mark. Only the edits made
+        since are kept, as replaying the others onto the saved file
+        would apply them twice
+
+        Nothing is done if a snapshot taken after the save is newer
+        than the file
+        """
+        with self._file_lock:
+            with self._lock:
+                if (self._snapshot_start is not None or
+                        mark < self.first_edit):
+                    return
+                pending, self._pending = self._pending, []
+
+            _, lines = read_journal(self.journal_path)
+            lines = [line.rstrip('\n') for line in lines] + pending
+            kept = lines[mark - self.first_edit:]
+
+            old_snapshot = self.snapshot_path
+            self.snapshot_path = None
+            self._write_header(kept)
+            self.first_edit = mark
+            self.edits_since_snapshot = len(kept)
+            self.snapshot_requested = False
+            self.last_snapshot_time = time.monotonic()
+            remove_files(old_snapshot)
+
+    def snapshot_due(self):
+        """
+        Returns True if it is time to write a full snapshot
+        """
+        if self.snapshot_requested:
+            return True
+        if not self.edits_since_snapshot:
+            return False
+        if self.edits_since_snapshot >= self.snapshot_every:
+            return True
+        elapsed = time.monotonic() - self.last_snapshot_time
+        return elapsed >= self.snapshot_interval
+
+    def request_snapshot(self):
+        """
+        Make the next flush write a snapshot. Used for changes that
+        cannot be described as an edit
+        """
+        self.snapshot_requested = True
+
+    def discard_pending(self):
+        """
+        Drop the queued edits because they are part of a snapshot
+        that is about to be written
+
+        Must be called while the document cannot change, i.e. in the
+        same critical section in which the snapshot data is serialized
+        """
+        with self._lock:
+            self._pending = []
+            self._snapshot_start = self.recorded
+
+    def write_snapshot(self, data):
+        """
+        Write the serialized document as the new snapshot and start
+        the journal over. discard_pending must have been called when
+        the data was serialized
+        """
+        with self._file_lock:
+            self._write_snapshot(data)
+            with self._lock:
+                self.first_edit = self._snapshot_start
+                self._snapshot_start = None
+
+    def _write_snapshot(self, data):
+        self.snapshot_count += 1
+        old_snapshot = self.snapshot_path
+        self.snapshot_path = '{}.{}.snapshot.xml'.format(
+            self.journal_path, self.snapshot_count)
+        if self.compress:
+            self.snapshot_path += '.gz'
+            with gzip.open(self.snapshot_path, 'wb',
+                           settings.DRAFTS_COMPRESS_LEVEL) as fobj:
+                fobj.write(data)
+        else:
+            with open(self.snapshot_path, 'wb') as fobj:
+                fobj.write(data)
+
+        # The new header only points at the snapshot once it is
+        # completely on disk, so a crash in between is harmless
+        self._write_header()
+        self.edits_since_snapshot = 0
+        self.snapshot_requested = False
+        self.last_snapshot_time = time.monotonic()
+
+        if old_snapshot and os.path.exists(old_snapshot):
+            os.remove(old_snapshot)
+
+    def close(self):
+        """
+        Write the queued edits and give up the journal, keeping it on
+        disk to be recovered later
+        """
+        self.flush()
+        release_lock(self.session_lock)
+        self.session_lock = None
+
+    def discard(self):
+        """
+        Remove the journal and its snapshot from disk
+        """
+        remove_files(self.journal_path, self.snapshot_path)
+        release_lock(self.session_lock)
+        self.session_lock = None
+
+
+def lock_path(journal_path):
+    """
+    Returns the path of the lock file of a journal
+    """
+    return journal_path + '.lock'
+
+
+def _lock_file(fobj):
+    """
+    Takes an exclusive lock on an open file without waiting. Raises
+    OSError if another session holds it
+    """
+    if fcntl is not None:
+        fcntl.flock(fobj.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    else:
+        # Every session locks the first byte
+        fobj.seek(0)
+        msvcrt.locking(fobj.fileno(), msvcrt.LK_NBLCK, 1)
+
+
+def _unlock_file(fobj):
+    if fcntl is not None:
+        fcntl.flock(fobj.fileno(), fcntl.LOCK_UN)
+    else:
+        fobj.seek(0)
+        msvcrt.locking(fobj.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def acquire_lock(journal_path):
+    """
+    Marks the journal as in use by this process. Returns the open lock
+    file, which must be kept until release_lock, or None if another
+    session holds the lock
+    """
+    fobj = open(lock_path(journal_path), 'a+')
+    try:
+        _lock_file(fobj)
+    except OSError:
+        fobj.close()
+        return None
+    fobj.seek(0)
+    fobj.truncate()
+    fobj.write(str(os.getpid()))
+    fobj.flush()
+    return fobj
+
+
+def release_lock(fobj):
+    """
+    Releases a lock that was taken with acquire_lock and deletes the
+    lock file
+    """
+    if fobj is None:
+        return
+    _unlock_file(fobj)
+    fobj.close()
+    remove_files(fobj.name)
+
+
+def is_locked(journal_path):
+    """
+    True if a running session holds the lock of the journal, which
+    includes the sessions of this process
+    """
+    path = lock_path(journal_path)
+    if not os.path.exists(path):
+        return False
+    try:
+        fobj = open(path, 'r+')
+    except OSError:
+        # Removed in the meantime
+        return False
+    try:
+        _lock_file(fobj)
+    except OSError:
+        return True
+    else:
+        _unlock_file(fobj)
+        return False
+    finally:
+        fobj.close()
+
+
+def remove_files(*paths):
+    """
+    Deletes the given draft files, ignoring the ones that do not exist
+    """
+    for path in paths:
+        if path and os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError:
+                print('Unable to delete file: {}'.format(path))
+
+
+def delete_journal(journal_path):
+    """
+    Removes a journal, its snapshot and its lock file from disk
+    """
+    try:
+        header, _ = read_journal(journal_path)
+    except (IOError, ValueError):
+        header = {}
+    remove_files(journal_path, header.get('snapshot'),
+                 lock_path(journal_path))
+
+
+def read_journal(journal_path):
+    """
+    Returns the header and the edit lines of a journal. A partially
+    written last line (e.g. after a crash) is ignored
+    """
+    with open(journal_path) as fobj:
+        header = json.loads(fobj.readline())
+        lines = []
+        for line in fobj:
+            if not line.endswith('\n'):
+                break
+            lines.append(line)
+    return header, lines
+
+
+def recover(journal_path, progress=None, cancel_event=None):
+    """
+    Replays a journal onto its snapshot (or its source file) and
+    returns the resulting ElementTree
+
+    progress and cancel_event are passed on to xml_io.parse_xml
+    """
+    header, lines = read_journal(journal_path)
+    base = header.get('snapshot') or header['source']
+    xml_tree = xml_io.parse_xml(base, progress, cancel_event)
+    for line in lines:
+        edits.apply(xml_tree, json.loads(line))
+    return xml_tree
+
+
+def find_journal(drafts_location, source_path):
+    """
+    Returns the path of a journal in drafts_location that belongs to
+    source_path or None if there is none. The journals of running
+    sessions, e.g. of another instance of the editor, are skipped
+    """
+    pattern = os.path.join(drafts_location, '*.journal')
+    for journal_path in sorted(glob.glob(pattern), reverse=True):
+        if is_locked(journal_path):
+            continue
+        try:
+            header, _ = read_journal(journal_path)
+        except (IOError, ValueError):
+            continue
+        if header.get('source') == source_path:
+            return journal_path
@@ -0,0 +1,340 @@
+"""
+Browsing XML files that are too large to parse into memory
+
+The file is scanned once to build a compact index that holds the byte
+offsets, tag, parent and number of children of every element. The
+index is kept in flat arrays so it costs a few dozen bytes per element
+instead of a full lxml node. Subtrees are only parsed by lxml, from
+their byte range in the memory-mapped file, when they are needed.
+
+lxml's parsers do not report byte offsets, so the scan uses a small
+tokenizer over the memory-mapped file instead. This module does not
+depend on wx
+"""
+
+import lxml.etree as ET
+import mmap
+import re
+import settings
+
+from array import array
+from itertools import islice
+from xml_io import LoadCancelled
+
+TOKEN_RE = re.compile(
+    br'<!--.*?-->'
+    br'|<!\[CDATA\[.*?\]\]>'
+    br'|<\?.*?\?>'
+    br'|<!DOCTYPE(?:[^\[>]|\[.*?\])*>'
+    br'|</[^>]*>'
+    br'|<([^\s/>]+)(?:[^>"\']|"[^"]*"|\'[^\']*\')*>',
+    re.DOTALL)
+START_TAG_RE = re.compile(br'<[^\s/>]+(?:[^>"\']|"[^"]*"|\'[^\']*\')*>')
+XMLNS_RE = re.compile(
+    br'\sxmlns(?::[^\s=]+)?\s*=\s*(?:"[^"]*"|\'[^\']*\')')
+
+# Report progress every this many tokens
+PROGRESS_EVERY = 50000
+
+
+class LargeDocument():
+    """
+    An index over a large XML file with on-demand parsing of subtrees
+    """
+
+    # The names and type codes of the index arrays
+    ARRAYS = (('starts', 'Q'), ('ends', 'Q'), ('tag_ids', 'L'),
+              ('parents', 'q'), ('after', 'Q'), ('child_counts', 'L'))
+
+    def __init__(self, xml_path):
+        self.xml_path = xml_path
+        self.fobj = open(xml_path, 'rb')
+        self.data = mmap.mmap(self.fobj.fileno(), 0, access=mmap.ACCESS_READ)
+
+        # One entry per element, in document order
+        self.starts = array('Q')       # byte offset of the start tag
+        self.ends = array('Q')         # byte offset after the end tag
+        self.tag_ids = array('L')      # index into self.tags
+        self.parents = array('q')      # index of the parent or -1
+        self.after = array('Q')        # index of the first non-descendant
+        self.child_counts = array('L')
+
+        self.tags = []
+        self._tag_table = {}
+
+    @property
+    def root(self):
+        """
+        The root element of the document
+        """
+        return LargeNode(self, 0)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def scan(self, progress=None, cancel_event=None):
+        """
+        Builds the index. progress and cancel_event work as they do
+        for xml_io.parse_xml
+        """
+        total = len(self.data)
+        stack = []
+        count = 0
+
+        for match in TOKEN_RE.finditer(self.data):
+            count += 1
+            if count % PROGRESS_EVERY == 0:
+                if cancel_event is not None and cancel_event.is_set():
+                    raise LoadCancelled(self.xml_path)
+                if progress:
+                    progress(match.end(), total)
+
+            tag = match.group(1)
+            if tag is None:
+                if match.group().startswith(b'</'):
+                    index = stack.pop()
+                    self.ends[index] = match.end()
+                    self.after[index] = len(self.starts)
+                continue
+
+            index = len(self.starts)
+            self.starts.append(match.start())
+            self.ends.append(0)
+            self.after.append(0)
+            self.child_counts.append(0)
+            self.tag_ids.append(self._tag_id(tag))
+            if stack:
+                self.parents.append(stack[-1])
+                self.child_counts[stack[-1]] += 1
+            else:
+                self.parents.append(-1)
+
+            if match.group().endswith(b'/>'):
+                self.ends[index] = match.end()
+                self.after[index] = index + 1
+            else:
+                stack.append(index)
+
+        if stack or not self.starts:
+            raise ValueError('{} is not well-formed XML'.format(self.xml_path))
+        if progress:
+            progress(total, total)
+        return self
+
+    def set_tags(self, tags):
+        """
+        Replace the tag table, e.g. with one from a cached index
+        """
+        self.tags = list(tags)
+        self._tag_table = {tag.encode('utf-8'): tag_id
+                           for tag_id, tag in enumerate(self.tags)}
+
+    def _tag_id(self, tag):
+        """
+        Returns the id of the tag in the tag table, adding it if needed
+        """
+        tag_id = self._tag_table.get(tag)
+        if tag_id is None:
+            tag_id = self._tag_table[tag] = len(self.tags)
+            self.tags.append(tag.decode('utf-8'))
+        return tag_id
+
+    def tag(self, index):
+        """
+        Returns the tag of the element as it is written in the file
+        """
+        return self.tags[self.tag_ids[index]]
+
+    def children(self, index):
+        """
+        Yields the indexes of the element's children
+        """
+        child = index + 1
+        end = self.after[index]
+        while child < end:
+            yield child
+            child = self.after[child]
+
+    def position_path(self, index):
+        """
+        Returns the positions of the element and its ancestors among
+        their sibling elements, starting below the root
+        """
+        positions = []
+        parent = self.parents[index]
+        while parent != -1:
+            for position, child in enumerate(self.children(parent)):
+                if child == index:
+                    positions.append(position)
+                    break
+            index = parent
+            parent = self.parents[index]
+        positions.reverse()
+        return tuple(positions)
+
+    def start_tag(self, index):
+        """
+        Returns the bytes of the element's start tag
+        """
+        return START_TAG_RE.match(self.data, self.starts[index]).group()
+
+    def _namespace_declarations(self, index):
+        """
+        Returns the namespace declarations of the element's ancestors
+        so that a fragment of the file can be parsed on its own
+        """
+        declarations = []
+        parent = self.parents[index]
+        while parent != -1:
+            declarations.extend(XMLNS_RE.findall(self.start_tag(parent)))
+            parent = self.parents[parent]
+        return b''.join(reversed(declarations))
+
+    def _parse_fragment(self, index, fragment):
+        """
+        Parses a fragment of the file in the namespace context of
+        the element at index
+        """
+        declarations = self._namespace_declarations(index)
+        parser = ET.XMLParser(huge_tree=True)
+        if not declarations:
+            return ET.fromstring(fragment, parser)
+        wrapper = ET.fromstring(
+            b'<boomslang' + declarations + b'>' + fragment + b'</boomslang>',
+            parser)
+        return wrapper[0]
+
+    def element(self, index):
+        """
+        Parses and returns the complete subtree of the element
+        """
+        fragment = self.data[self.starts[index]:self.ends[index]]
+        return self._parse_fragment(index, fragment)
+
+    def shallow_element(self, index, limit=None):
+        """
+        Returns the element with its attributes and its children that
+        do not have children of their own. Deeper subtrees are left out
+
+        @param limit: The most children to look at. If there are more,
+                      a comment that says how many were left out is
+                      added after them
+        """
+        if not self.child_counts[index]:
+            return self.element(index)
+
+        start_tag = self.start_tag(index)
+        if not start_tag.endswith(b'/>'):
+            start_tag = start_tag[:-1] + b'/>'
+        element = self._parse_fragment(index, start_tag)
+
+        for child in islice(self.children(index), limit):
+            if not self.child_counts[child]:
+                element.append(self.element(child))
+        count = self.child_counts[index]
+        if limit is not None and count > limit:
+            element.append(ET.Comment(
+                ' {:,} more child elements not shown '.format(
+                    count - limit)))
+        return element
+
+    def close(self):
+        """
+        Release the memory map and the file
+        """
+        self.data.close()
+        self.fobj.close()
+
+
+class LargeNode():
+    """
+    A light-weight handle to an element of a LargeDocument
+
+    It provides the parts of the lxml element API that the tree
+    control needs
+    """
+
+    def __init__(self, document, index):
+        self.document = document
+        self.index = index
+
+    @property
+    def tag(self):
+        return self.document.tag(self.index)
+
+    def __len__(self):
+        return self.document.child_counts[self.index]
+
+    def __eq__(self, other):
+        return (isinstance(other, LargeNode) and
+                other.document is self.document and
+                other.index == self.index)
+
+    def __hash__(self):
+        return hash(self.index)
+
+    def iterchildren(self):
+        """
+        Yields the child elements
+        """
+        for index in self.document.children(self.index):
+            yield LargeNode(self.document, index)
+
+    def itersiblings(self):
+        """
+        Yields the following sibling elements
+        """
+        parent = self.document.parents[self.index]
+        if parent == -1:
+            return
+        end = self.document.after[parent]
+        index = self.document.after[self.index]
+        while index < end:
+            yield LargeNode(self.document, index)
+            index = self.document.after[index]
+
+    def getparent(self):
+        parent = self.document.parents[self.index]
+        if parent != -1:
+            return LargeNode(self.document, parent)
+
+    def position_path(self):
+        """
+        See LargeDocument.position_path
+        """
+        return self.document.position_path(self.index)
+
+    def materialize(self):
+        """
+        Returns an lxml element for this node that can be shown in the
+        editor panels
+        """
+        return self.document.shallow_element(self.index,
+                                             settings.TREE_CHUNK_SIZE)
+
+
+def find_by_positions(root, positions):
+    """
+    Returns the lxml element at a position path from position_path.
+    Comments and processing instructions are not counted, just like
+    in the index
+    """
+    element = root
+    for position in positions:
+        element = next(islice(element.iterchildren(ET.Element), position,
+                              None), None)
+        if element is None:
+            raise KeyError('No element at {}'.format(positions))
+    return element
+
+
+def open_large_document(xml_path, progress=None, cancel_event=None):
+    """
+    Opens and indexes a large XML file and returns the LargeDocument
+    """
+    document = LargeDocument(xml_path)
+    try:
+        return document.scan(progress, cancel_event)
+    except Exception:
+        document.close()
+        raise
@@ -1,4 +1,7 @@
+import drafts
 import os
+import project_index
+import settings
 import sys
 import time
 import utils
@@ -7,7 +10,13 @@ import wx.adv
 import wx.lib.agw.flatnotebook as fnb
 
 from editor_page import NewPage
+from file_watcher import FileWatcher
+from profiler_dialog import ProfilerDialog
+from project_dialog import ProjectDialog
+from replace_dialog import ReplaceDialog
 from pubsub import pub
+from pubsub_profiler import PubsubProfiler
+from xml_io import XmlLoader
 from xml_viewer import XmlViewer
 from wx.lib.wordwrap import wordwrap
 
@@ -21,7 +30,6 @@ class Boomslang(wx.Frame):
 
         self.full_tmp_path = ''
         self.full_saved_path = ''
-        self.changed = False
         self.notebook = None
         self.opened_files = []
         self.last_opened_file = None
@@ -32,8 +40,25 @@ class Boomslang(wx.Frame):
         self.recent_files_path = os.path.join(
             self.app_location, 'recent_files.txt')
 
+        # The open project folder, see project_index
+        self.project = None
+        self.project_dialog = None
+        self.project_indexer = None
+
+        self.profiler = None
+        if settings.PROFILE_PUBSUB:
+            self.profiler = PubsubProfiler()
+            self.profiler.enable()
+
         pub.subscribe(self.save, 'save')
         pub.subscribe(self.auto_save_status, 'on_change_status')
+        pub.subscribe(self.save_status, 'save_status')
+        pub.subscribe(self.on_load_failed, 'load_failed')
+
+        # Watches the files of the open pages for changes by other
+        # programs
+        self.file_watcher = FileWatcher(self.on_file_changed)
+        self.file_watcher.start()
 
         self.main_sizer = wx.BoxSizer(wx.VERTICAL)
         self.panel = wx.Panel(self)
@@ -43,12 +68,38 @@ class Boomslang(wx.Frame):
 
         self.Bind(wx.EVT_CLOSE, self.on_exit)
 
+        self.hibernate_timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.on_hibernate_timer, self.hibernate_timer)
+        self.hibernate_timer.Start(settings.HIBERNATE_CHECK_INTERVAL * 1000)
+
         self.Show()
+        wx.CallAfter(self.recover_drafts)
+
+    def recover_drafts(self):
+        """
+        Offer to recover the drafts that sessions which crashed left
+        behind. The drafts directory is cleaned up on the way
+        """
+        drafts_location = os.path.join(self.app_location, 'drafts')
+        orphans = drafts.orphaned_drafts(drafts_location)
+        if not orphans:
+            return
+        chosen = utils.choose_drafts_to_recover(orphans)
+        if chosen is None:
+            return
+        for draft in orphans:
+            if draft in chosen:
+                self.create_new_editor(draft.source, recover=True)
+            else:
+                draft.delete()
 
-    def create_new_editor(self, xml_path):
+    def create_new_editor(self, xml_path, recover=None, element_path=None):
         """
         Create the tree and xml editing widgets when the user loads
         an XML file
+
+        @param recover: Passed on to NewPage
+        @param element_path: The path of an element to select
         """
         if not self.notebook:
             self.notebook = fnb.FlatNotebook(
@@ -59,16 +110,26 @@ class Boomslang(wx.Frame):
             self.notebook.SetAGWWindowStyleFlag(style)
             self.notebook.Bind(
                 fnb.EVT_FLATNOTEBOOK_PAGE_CLOSING, self.on_page_closing)
+            self.notebook.Bind(
+                fnb.EVT_FLATNOTEBOOK_PAGE_CHANGED, self.on_page_changed)
 
         if xml_path not in self.opened_files:
             self.current_page = NewPage(self.notebook, xml_path, self.size,
-                                        self.opened_files)
+                                        self.opened_files, recover)
             self.notebook.AddPage(self.current_page,
                                   os.path.basename(xml_path),
                                   select=True)
             self.last_opened_file = xml_path
 
             self.opened_files.append(self.last_opened_file)
+            self.file_watcher.watch(xml_path)
+        else:
+            for index in range(self.notebook.GetPageCount()):
+                if self.notebook.GetPage(index).current_file == xml_path:
+                    self.notebook.SetSelection(index)
+
+        if element_path:
+            self.notebook.GetCurrentPage().show_element(element_path)
 
         self.panel.Layout()
 
@@ -79,6 +140,8 @@ class Boomslang(wx.Frame):
         """
         menu_bar = wx.MenuBar()
         file_menu = wx.Menu()
+        edit_menu = wx.Menu()
+        tools_menu = wx.Menu()
         help_menu = wx.Menu()
 
         # add menu items to the file menu
@@ -86,6 +149,10 @@ class Boomslang(wx.Frame):
             wx.ID_ANY, 'Open', '')
         self.Bind(wx.EVT_MENU, self.on_open, open_menu_item)
 
+        open_folder_menu_item = file_menu.Append(
+            wx.ID_ANY, 'Open Folder...', 'Index and search a project folder')
+        self.Bind(wx.EVT_MENU, self.on_open_folder, open_folder_menu_item)
+
         sub_menu = self.create_recent_items()
         file_menu.AppendSubMenu(sub_menu, 'Recent', 'Recent files that have been opened')
 
@@ -98,6 +165,37 @@ class Boomslang(wx.Frame):
         self.Bind(wx.EVT_MENU, self.on_exit, exit_menu_item)
         menu_bar.Append(file_menu, "&File")
 
+        # add menu items to the edit menu
+        undo_menu_item = edit_menu.Append(
+            wx.ID_ANY, 'Undo', '')
+        self.Bind(wx.EVT_MENU, self.on_undo, undo_menu_item)
+
+        redo_menu_item = edit_menu.Append(
+            wx.ID_ANY, 'Redo', '')
+        self.Bind(wx.EVT_MENU, self.on_redo, redo_menu_item)
+        menu_bar.Append(edit_menu, "&Edit")
+
+        # add menu items to the tools menu
+        compare_file_menu_item = tools_menu.Append(
+            wx.ID_ANY, 'Compare with File on Disk', '')
+        self.Bind(wx.EVT_MENU, self.on_compare_file, compare_file_menu_item)
+
+        compare_page_menu_item = tools_menu.Append(
+            wx.ID_ANY, 'Compare with Open File...', '')
+        self.Bind(wx.EVT_MENU, self.on_compare_page, compare_page_menu_item)
+
+        tools_menu.AppendSeparator()
+        replace_menu_item = tools_menu.Append(
+            wx.ID_ANY, 'Find and Replace in Files...', '')
+        self.Bind(wx.EVT_MENU, self.on_replace_in_files, replace_menu_item)
+
+        if self.profiler:
+            tools_menu.AppendSeparator()
+            profile_menu_item = tools_menu.Append(
+                wx.ID_ANY, 'Messaging Profile', '')
+            self.Bind(wx.EVT_MENU, self.on_profile, profile_menu_item)
+        menu_bar.Append(tools_menu, "&Tools")
+
         # add menu items to the help menu
         about_menu_item = help_menu.Append(
             wx.ID_ANY, 'About')
@@ -157,7 +255,11 @@ class Boomslang(wx.Frame):
                                          (wx.ACCEL_CTRL, ord('A'),
                                           add_tool.GetId() ),
                                          (wx.ACCEL_CTRL, ord('X'),
-                                          remove_node_tool.GetId())
+                                          remove_node_tool.GetId()),
+                                         (wx.ACCEL_CTRL, ord('Z'),
+                                          undo_menu_item.GetId()),
+                                         (wx.ACCEL_CTRL, ord('Y'),
+                                          redo_menu_item.GetId())
                                          ])
 
         self.SetAcceleratorTable(accel_tbl)
@@ -189,17 +291,16 @@ class Boomslang(wx.Frame):
             except:
                 pass
 
-    def auto_save_status(self, save_path):
+    def auto_save_status(self, save_path, elapsed):
         """
         This function is called via PubSub to update the frame's status
         """
-        print('Autosaving to {} @ {}'.format(save_path, time.ctime()))
-        msg = 'Autosaved at {}'.format(time.strftime('%H:%M:%S',
-                                                     time.localtime()))
+        print('Autosaved to {} @ {} in {:.3f}s'.format(
+            save_path, time.ctime(), elapsed))
+        msg = 'Autosaved at {} ({:.2f}s)'.format(
+            time.strftime('%H:%M:%S', time.localtime()), elapsed)
         self.status_bar.SetStatusText(msg)
 
-        self.changed = True
-
     def open_xml_file(self, xml_path):
         """
         Open the specified XML file and load it in the application
@@ -210,16 +311,20 @@ class Boomslang(wx.Frame):
         """
         Update the frame with save status
         """
-        if self.current_page.xml_root is None:
+        page = self.current_page
+        # A hibernated page has no tree, but its document can still be
+        # saved from the drafts
+        if page is None or page.xml_root is None and not page.hibernated:
             utils.warn_nothing_to_save()
             return
 
-        pub.sendMessage('save_{}'.format(self.current_page.page_id))
+        pub.sendMessage('save_{}'.format(page.page_id))
 
-        self.changed = False
-        msg = 'Last saved at {}'.format(time.strftime('%H:%M:%S',
-                                                      time.localtime()))
-        self.status_bar.SetStatusText(msg)
+    def save_status(self, message):
+        """
+        Show the progress of a save. Called via pubsub
+        """
+        self.status_bar.SetStatusText(message)
 
     def on_about_box(self, event):
         """
@@ -253,6 +358,70 @@ class Boomslang(wx.Frame):
         """
         pub.sendMessage('remove_node_{}'.format(self.current_page.page_id))
 
+    def on_undo(self, event):
+        """
+        Event handler that undoes the last edit of the current page
+        """
+        if self.current_page is not None:
+            pub.sendMessage('undo_{}'.format(self.current_page.page_id))
+
+    def on_redo(self, event):
+        """
+        Event handler that redoes the last undone edit of the
+        current page
+        """
+        if self.current_page is not None:
+            pub.sendMessage('redo_{}'.format(self.current_page.page_id))
+
+    def on_compare_file(self, event):
+        """
+        Event handler that compares the current page with its file
+        on disk
+        """
+        if self.current_page is not None:
+            self.current_page.compare_with_file()
+
+    def on_compare_page(self, event):
+        """
+        Event handler that compares the current page with another open
+        page that the user chooses
+        """
+        if self.current_page is None:
+            return
+        pages = [self.notebook.GetPage(index)
+                 for index in range(self.notebook.GetPageCount())]
+        # Only pages that are loaded and have the document in memory
+        pages = [page for page in pages
+                 if page is not self.current_page and
+                 page.xml_root is not None and not page.large_document]
+        if not pages:
+            return
+
+        dlg = wx.SingleChoiceDialog(
+            self, 'Compare {} with:'.format(self.current_page.title),
+            'Compare', [page.title for page in pages])
+        if dlg.ShowModal() == wx.ID_OK:
+            self.current_page.compare_with_page(pages[dlg.GetSelection()])
+        dlg.Destroy()
+
+    def on_replace_in_files(self, event):
+        """
+        Event handler that opens the find and replace dialog for the
+        project folder or the current directory
+        """
+        folder = self.current_directory
+        if self.project:
+            folder = self.project.folder
+        dlg = ReplaceDialog(self, folder)
+        dlg.Show()
+
+    def on_profile(self, event):
+        """
+        Event handler that shows the pubsub statistics
+        """
+        dlg = ProfilerDialog(self, self.profiler)
+        dlg.Show()
+
     def on_open(self, event):
         """
         Event handler that is called when you need to open an XML file
@@ -264,26 +433,170 @@ class Boomslang(wx.Frame):
             self.open_xml_file(xml_path)
             self.update_recent_files(xml_path)
 
+    def on_open_folder(self, event):
+        """
+        Event handler that opens a project folder. The folder is indexed
+        in the background, the search works with the index of the last
+        time right away
+        """
+        folder = utils.open_folder(self, self.current_directory)
+        if not folder:
+            return
+        if self.project_indexer:
+            self.project_indexer.cancel()
+            self.project_indexer.join()
+        if self.project_dialog:
+            self.project_dialog.Destroy()
+
+        cache_location = os.path.join(self.app_location, 'cache')
+        self.project = project_index.ProjectIndex(
+            folder, project_index.index_path(cache_location, folder))
+        self.project_dialog = ProjectDialog(self, self.project,
+                                            self.open_project_file)
+        self.project_dialog.Bind(wx.EVT_WINDOW_DESTROY,
+                                 self.on_project_dialog_closed)
+        self.project_dialog.Show()
+
+        project = self.project
+        self.project_indexer = XmlLoader(
+            project.update,
+            lambda result, error: wx.CallAfter(
+                self.on_project_indexed, project, result, error),
+            lambda done, total: wx.CallAfter(
+                self.on_project_progress, project, done, total),
+            name='project-indexer')
+        self.project_indexer.start()
+        self.project_dialog.refresh('Looking for changed files...')
+
+    def on_project_progress(self, project, done, total):
+        """
+        Show how far the index update got
+        """
+        if self and project is self.project and self.project_dialog:
+            self.project_dialog.refresh('Indexing {:,} of {:,} files'.format(
+                done, total))
+
+    def on_project_indexed(self, project, result, error):
+        """
+        Called on the GUI thread once the index of a project is up to date
+        """
+        if not self or project is not self.project:
+            return
+        self.project_indexer = None
+        if error is not None:
+            print('Unable to index {}: {}'.format(project.folder, error))
+            return
+        if self.project_dialog:
+            self.project_dialog.refresh()
+        indexed, removed, failed = result
+        self.status_bar.SetStatusText(
+            'Indexed {:,} changed files of {}'.format(indexed,
+                                                      project.folder))
+
+    def on_project_dialog_closed(self, event):
+        if event.GetEventObject() is self.project_dialog:
+            self.project_dialog = None
+        event.Skip()
+
+    def open_project_file(self, xml_path, element_path=None):
+        """
+        Open a file of the project, or show its page if it is open
+        """
+        self.create_new_editor(xml_path, element_path=element_path)
+        self.update_recent_files(xml_path)
+
+    def on_page_changed(self, event):
+        """
+        Event handler that is called when another page in the notebook
+        is selected
+        """
+        if self.current_page is not None:
+            self.current_page.last_active = time.monotonic()
+        self.current_page = self.notebook.GetCurrentPage()
+        if self.current_page is not None:
+            self.current_page.wake()
+        event.Skip()
+
+    def on_hibernate_timer(self, event):
+        """
+        Event handler that unloads the documents of tabs that have been
+        inactive for a while or while the open documents use more than
+        the memory budget
+        """
+        if not self.notebook:
+            return
+        pages = [self.notebook.GetPage(index)
+                 for index in range(self.notebook.GetPageCount())]
+        total = sum(page.memory_estimate() for page in pages)
+
+        inactive = [page for page in pages
+                    if page is not self.current_page and page.can_hibernate]
+        inactive.sort(key=lambda page: page.last_active)
+        now = time.monotonic()
+        for page in inactive:
+            idle = now - page.last_active
+            if (idle < settings.HIBERNATE_AFTER and
+                    total <= settings.HIBERNATE_MEMORY_BUDGET):
+                continue
+            total -= page.memory_estimate()
+            page.hibernate()
+
     def on_page_closing(self, event):
         """
         Event handler that is called when a page in the notebook is closing
         """
         page = self.notebook.GetCurrentPage()
+        if not self.ask_to_save(page):
+            event.Veto()
+            return
         page.Close()
+        self.file_watcher.unwatch(page.current_file)
         if not self.opened_files:
             wx.CallAfter(self.notebook.Destroy)
             self.notebook = None
 
+    def on_load_failed(self, page):
+        """
+        Called via pubsub when a page could not load its XML file or
+        the user cancelled loading it. Removes the page from the notebook
+        """
+        page.Close()
+        self.file_watcher.unwatch(page.current_file)
+        index = self.notebook.GetPageIndex(page)
+        if index != wx.NOT_FOUND:
+            self.notebook.DeletePage(index, notify=False)
+        if self.current_page is page:
+            self.current_page = None
+        if not self.opened_files:
+            wx.CallAfter(self.notebook.Destroy)
+            self.notebook = None
+
+    def on_file_changed(self, path):
+        """
+        Called on the watcher thread when an open file was changed
+        """
+        wx.CallAfter(self.notify_file_changed, path)
+
+    def notify_file_changed(self, path):
+        """
+        Tell the page of a file that was changed on disk
+        """
+        if not self or not self.notebook:
+            return
+        for index in range(self.notebook.GetPageCount()):
+            page = self.notebook.GetPage(index)
+            if page.source_path == path:
+                page.on_file_changed()
+
     def on_preview_xml(self, event):
         """
         Event handler called for previewing the current state of the XML
         in memory
         """
-        if self.last_opened_file:
-            previewer = XmlViewer(
-                xml_file=self.last_opened_file)
-            previewer.ShowModal()
-            previewer.Destroy()
+        if self.current_page is None or self.current_page.xml_root is None:
+            return
+        previewer = XmlViewer(self, self.current_page)
+        previewer.Show()
 
     def update_recent_files(self, xml_path):
         """
@@ -337,10 +650,43 @@ class Boomslang(wx.Frame):
         """
         self.save()
 
+    def ask_to_save(self, page):
+        """
+        Offer to save the unsaved changes of a page. Returns False if
+        the user cancelled
+        """
+        if not page.dirty:
+            return True
+        answer = utils.warn_not_saved(page.title)
+        if answer == wx.ID_YES:
+            page.save(location=page.current_file)
+        return answer != wx.ID_CANCEL
+
     def on_exit(self, event):
         """
         Event handler that closes the application
         """
+        if self.notebook:
+            for index in range(self.notebook.GetPageCount()):
+                page = self.notebook.GetPage(index)
+                if not self.ask_to_save(page):
+                    if isinstance(event, wx.CloseEvent) and event.CanVeto():
+                        event.Veto()
+                    return
+            # Closing a page waits for its save and removes its drafts,
+            # so they are not offered for recovery at the next start
+            for index in range(self.notebook.GetPageCount()):
+                self.notebook.GetPage(index).Close()
+        self.file_watcher.stop()
+        if self.project_indexer:
+            self.project_indexer.cancel()
+        if self.profiler:
+            path = os.path.join(self.app_location, settings.PROFILE_DUMP_FILE)
+            try:
+                self.profiler.dump(path)
+            except IOError as error:
+                print('Unable to write the profile to {}: {}'.format(
+                    path, error))
         self.Destroy()
 
 # ------------------------------------------------------------------------------
@@ -0,0 +1,131 @@
+import settings
+import wx
+
+TOPIC_COLUMNS = (('Topic', 200), ('Messages', 80), ('Calls', 80),
+                 ('Total ms', 90), ('Max ms', 80))
+LISTENER_COLUMNS = (('Listener', 260), ('Calls', 80), ('Total ms', 90),
+                    ('Max ms', 80))
+
+
+def add_columns(list_ctrl, columns):
+    for position, (label, width) in enumerate(columns):
+        list_ctrl.InsertColumn(position, label, width=width)
+
+
+def milliseconds(seconds):
+    return '{:.1f}'.format(seconds * 1000)
+
+
+class ProfilerDialog(wx.Dialog):
+    """
+    A modeless view of the pubsub statistics that are being recorded,
+    updated while it is open
+    """
+
+    def __init__(self, parent, profiler):
+        """
+        @param parent: The main frame
+        @param profiler: The pubsub_profiler.PubsubProfiler
+        """
+        wx.Dialog.__init__(self, parent=parent, title='Messaging Profile',
+                           size=(600, 550),
+                           style=wx.DEFAULT_DIALOG_STYLE | wx.RESIZE_BORDER)
+        self.profiler = profiler
+        self.topics = []
+        self.selected_topic = None
+
+        self.topic_list = wx.ListCtrl(
+            self, style=wx.LC_REPORT|wx.LC_SINGLE_SEL)
+        add_columns(self.topic_list, TOPIC_COLUMNS)
+        self.topic_list.Bind(wx.EVT_LIST_ITEM_SELECTED, self.on_select)
+
+        self.histogram_lbl = wx.StaticText(self, label='')
+        self.listener_list = wx.ListCtrl(self, style=wx.LC_REPORT)
+        add_columns(self.listener_list, LISTENER_COLUMNS)
+
+        reset_btn = wx.Button(self, label='Reset')
+        reset_btn.Bind(wx.EVT_BUTTON, self.on_reset)
+        save_btn = wx.Button(self, label='Save Profile...')
+        save_btn.Bind(wx.EVT_BUTTON, self.on_save)
+        btn_sizer = wx.BoxSizer(wx.HORIZONTAL)
+        btn_sizer.Add(reset_btn, 0, wx.ALL, 5)
+        btn_sizer.Add(save_btn, 0, wx.ALL, 5)
+
+        sizer = wx.BoxSizer(wx.VERTICAL)
+        sizer.Add(self.topic_list, 2, wx.ALL|wx.EXPAND, 5)
+        sizer.Add(self.histogram_lbl, 0, wx.ALL|wx.EXPAND, 5)
+        sizer.Add(self.listener_list, 1, wx.ALL|wx.EXPAND, 5)
+        sizer.Add(btn_sizer, 0, wx.CENTER)
+        self.SetSizer(sizer)
+
+        self.timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.on_timer, self.timer)
+        self.timer.Start(int(settings.PROFILE_REFRESH_INTERVAL * 1000))
+        self.Bind(wx.EVT_CLOSE, self.on_close)
+        self.update()
+
+    def update(self):
+        """
+        Show the statistics that were recorded so far
+        """
+        self.topics = self.profiler.snapshot()
+        self.topic_list.Freeze()
+        self.topic_list.DeleteAllItems()
+        for row, topic in enumerate(self.topics):
+            self.topic_list.InsertItem(row, topic['topic'])
+            self.topic_list.SetItem(row, 1, str(topic['messages']))
+            self.topic_list.SetItem(row, 2, str(topic['calls']))
+            self.topic_list.SetItem(row, 3, milliseconds(topic['total']))
+            self.topic_list.SetItem(row, 4, milliseconds(topic['max']))
+            if topic['topic'] == self.selected_topic:
+                self.topic_list.Select(row)
+        self.topic_list.Thaw()
+        self.show_topic()
+
+    def show_topic(self):
+        """
+        Show the histogram and the slowest listeners of the selected
+        topic
+        """
+        self.listener_list.DeleteAllItems()
+        topic = next((topic for topic in self.topics
+                      if topic['topic'] == self.selected_topic), None)
+        if topic is None:
+            self.histogram_lbl.SetLabel('')
+            return
+
+        self.histogram_lbl.SetLabel('  '.join(
+            '{}: {}'.format(label, count)
+            for label, count in topic['histogram'].items()))
+        for row, listener in enumerate(topic['slowest']):
+            self.listener_list.InsertItem(row, listener['listener'])
+            self.listener_list.SetItem(row, 1, str(listener['calls']))
+            self.listener_list.SetItem(row, 2,
+                                       milliseconds(listener['total']))
+            self.listener_list.SetItem(row, 3, milliseconds(listener['max']))
+
+    def on_select(self, event):
+        self.selected_topic = self.topics[event.GetIndex()]['topic']
+        self.show_topic()
+
+    def on_timer(self, event):
+        self.update()
+
+    def on_reset(self, event):
+        self.profiler.reset()
+        self.update()
+
+    def on_save(self, event):
+        """
+        Event handler that writes the statistics to a JSON file
+        """
+        with wx.FileDialog(
+                self, 'Save Profile', defaultFile='pubsub_profile.json',
+                wildcard='JSON (*.json)|*.json',
+                style=wx.FD_SAVE|wx.FD_OVERWRITE_PROMPT) as dlg:
+            if dlg.ShowModal() == wx.ID_OK:
+                self.profiler.dump(dlg.GetPath())
+
+    def on_close(self, event):
+        self.timer.Stop()
+        self.Destroy()
@@ -0,0 +1,117 @@
+import os
+import wx
+
+from profiler_dialog import add_columns
+
+RESULT_COLUMNS = (('Kind', 80), ('Name', 180), ('File', 260),
+                  ('Element / Count', 180))
+
+
+class ProjectDialog(wx.Dialog):
+    """
+    A modeless search of the index of a project folder. Searching
+    for an id, a tag or an attribute name lists the files they are in,
+    and activating a result opens the file
+    """
+
+    def __init__(self, parent, project, open_file):
+        """
+        @param parent: The main frame
+        @param project: The project_index.ProjectIndex
+        @param open_file: Called with the path of a file to open and
+                          the path of the element to select or None
+        """
+        wx.Dialog.__init__(
+            self, parent=parent,
+            title='Project: {}'.format(project.folder), size=(720, 500),
+            style=wx.DEFAULT_DIALOG_STYLE | wx.RESIZE_BORDER)
+        self.project = project
+        self.open_file = open_file
+        self.results = []
+        self.search_timer = None
+
+        self.search_ctrl = wx.SearchCtrl(self, style=wx.TE_PROCESS_ENTER)
+        self.search_ctrl.SetDescriptiveText('Id, tag or attribute name')
+        self.search_ctrl.Bind(wx.EVT_TEXT, self.on_text)
+        self.search_ctrl.Bind(wx.EVT_TEXT_ENTER, self.on_search)
+        self.search_ctrl.Bind(wx.EVT_SEARCHCTRL_SEARCH_BTN, self.on_search)
+
+        self.result_list = wx.ListCtrl(
+            self, style=wx.LC_REPORT|wx.LC_SINGLE_SEL)
+        add_columns(self.result_list, RESULT_COLUMNS)
+        self.result_list.Bind(wx.EVT_LIST_ITEM_ACTIVATED, self.on_activate)
+
+        self.status_lbl = wx.StaticText(self, label='')
+
+        sizer = wx.BoxSizer(wx.VERTICAL)
+        sizer.Add(self.search_ctrl, 0, wx.ALL|wx.EXPAND, 5)
+        sizer.Add(self.result_list, 1, wx.ALL|wx.EXPAND, 5)
+        sizer.Add(self.status_lbl, 0, wx.ALL|wx.EXPAND, 5)
+        self.SetSizer(sizer)
+
+        self.Bind(wx.EVT_CLOSE, self.on_close)
+        self.show_summary()
+
+    def show_summary(self, message=''):
+        """
+        Show the size of the index and an optional message about the
+        update that is running
+        """
+        files, elements, failed = self.project.summary()
+        text = '{:,} files, {:,} elements'.format(files, elements)
+        if failed:
+            text += ', {:,} could not be read'.format(failed)
+        if message:
+            text += ' - ' + message
+        self.status_lbl.SetLabel(text)
+
+    def on_text(self, event):
+        """
+        Search once the user stopped typing for a moment
+        """
+        if self.search_timer:
+            self.search_timer.Start(300)
+        else:
+            self.search_timer = wx.CallLater(300, self.search)
+
+    def on_search(self, event):
+        self.search()
+
+    def search(self):
+        """
+        Show the results of the search text
+        """
+        self.search_timer = None
+        if not self:
+            return
+        text = self.search_ctrl.GetValue().strip()
+        self.results = self.project.search(text) if text else []
+        self.result_list.Freeze()
+        self.result_list.DeleteAllItems()
+        for row, (kind, value, path, detail) in enumerate(self.results):
+            self.result_list.InsertItem(row, kind)
+            self.result_list.SetItem(row, 1, value)
+            self.result_list.SetItem(
+                row, 2, os.path.relpath(path, self.project.folder))
+            self.result_list.SetItem(row, 3, str(detail))
+        self.result_list.Thaw()
+
+    def refresh(self, message=''):
+        """
+        Called by the main frame while and after the index is updated
+        """
+        self.show_summary(message)
+        if not message:
+            self.search()
+
+    def on_activate(self, event):
+        """
+        Open the file of a result, at the element for ids
+        """
+        kind, value, path, detail = self.results[event.GetIndex()]
+        self.open_file(path, detail if kind == 'id' else None)
+
+    def on_close(self, event):
+        if self.search_timer:
+            self.search_timer.Stop()
+        self.Destroy()
@@ -0,0 +1,422 @@
+"""
+A persistent index of the XML files in a project folder
+
+Every XML file below the folder is parsed once, in a pool of worker
+processes, and what is needed to search the whole project is stored
+in an SQLite file: the root tag and number of elements of every file,
+its tag and attribute names with their counts and the values of its
+id attributes with the paths of their elements. The next time the
+folder is opened only the files whose size or modification time
+changed are parsed again, and files that are gone are dropped.
+
+The index answers cross-file searches and finds the file that
+defines an id without parsing anything. This module does not depend
+on wx
+
+Example:
+    python project_index.py data/ --find-id book42
+"""
+
+import argparse
+import batch
+import edits
+import hashlib
+import lxml.etree as ET
+import multiprocessing
+import os
+import settings
+import sqlite3
+import sys
+import time
+import xml_io
+
+from collections import Counter
+from xml_diff import element_id
+from xml_io import LoadCancelled
+
+# Version 2 stores element paths that need no namespace map
+INDEX_VERSION = 2
+INDEX_EXTENSION = '.project.sqlite'
+
+# Number of files stored between commits, so an update that is
+# cancelled or crashes keeps most of its work
+COMMIT_EVERY = 100
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    size INTEGER,
+    mtime_ns INTEGER,
+    root_tag TEXT,
+    elements INTEGER,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS tags (
+    file_id INTEGER NOT NULL,
+    tag TEXT NOT NULL,
+    count INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS attributes (
+    file_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    count INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS ids (
+    file_id INTEGER NOT NULL,
+    value TEXT NOT NULL,
+    tag TEXT NOT NULL,
+    path TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tags_tag ON tags (tag);
+CREATE INDEX IF NOT EXISTS tags_file ON tags (file_id);
+CREATE INDEX IF NOT EXISTS attributes_name ON attributes (name);
+CREATE INDEX IF NOT EXISTS attributes_file ON attributes (file_id);
+CREATE INDEX IF NOT EXISTS ids_value ON ids (value);
+CREATE INDEX IF NOT EXISTS ids_file ON ids (file_id);
+'''
+
+DETAIL_TABLES = ('tags', 'attributes', 'ids')
+
+
+def index_path(cache_dir, folder):
+    """
+    Returns the path of the index file of a project folder
+    """
+    key = hashlib.sha1(os.path.abspath(folder).encode('utf-8'))
+    return os.path.join(cache_dir, key.hexdigest() + INDEX_EXTENSION)
+
+
+def like_pattern(text):
+    """
+    Returns a LIKE pattern that finds text anywhere, with the LIKE
+    wildcards in it escaped
+    """
+    for char in ('\\', '%', '_'):
+        text = text.replace(char, '\\' + char)
+    return '%{}%'.format(text)
+
+
+def scan_file(xml_path):
+    """
+    Parses a file and returns what the index stores about it. Called
+    in the worker processes
+
+    Returns (path, size, mtime_ns, root tag, element count, tag
+    counts, attribute counts, ids, error). The ids are (value, tag,
+    element path) tuples. If the file cannot be read or parsed only
+    the error is filled in, so it is not parsed again until it changes
+    """
+    size = mtime_ns = None
+    try:
+        # The file can be gone since the folder was walked
+        stat = os.stat(xml_path)
+        size, mtime_ns = stat.st_size, stat.st_mtime_ns
+        xml_tree = xml_io.parse_xml(xml_path)
+    except Exception as error:
+        return (xml_path, size, mtime_ns, None, 0, {}, {}, [], str(error))
+
+    root = xml_tree.getroot()
+    tags = Counter()
+    attributes = Counter()
+    ids = []
+    for element in root.iter(tag=ET.Element):
+        tags[element.tag] += 1
+        attributes.update(element.attrib.keys())
+        value = element_id(element)
+        if value is not None:
+            ids.append((value, element.tag, edits.get_path(element)))
+    return (xml_path, size, mtime_ns, root.tag,
+            sum(tags.values()), dict(tags), dict(attributes), ids, None)
+
+
+class ProjectIndex():
+    """
+    The index of the XML files below a folder
+    """
+
+    def __init__(self, folder, index_file, pattern=None):
+        """
+        @param folder: The project folder
+        @param index_file: Where the SQLite index is kept, see
+                           index_path
+        @param pattern: File names to index (default:
+                        settings.PROJECT_PATTERN)
+        """
+        if pattern is None:
+            pattern = settings.PROJECT_PATTERN
+        self.folder = os.path.abspath(folder)
+        self.index_file = index_file
+        self.pattern = pattern
+
+    def connect(self):
+        """
+        Returns a connection to the index, creating it or starting it
+        over if it was written by another version. Every thread needs
+        its own connection
+        """
+        directory = os.path.dirname(self.index_file)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        conn = sqlite3.connect(self.index_file)
+        # Searches can read while an update writes
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(SCHEMA)
+        row = conn.execute(
+            "SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if row is None or int(row[0]) != INDEX_VERSION:
+            with conn:
+                for table in ('files',) + DETAIL_TABLES:
+                    conn.execute('DELETE FROM {}'.format(table))
+                conn.execute(
+                    "INSERT OR REPLACE INTO meta VALUES ('version', ?)",
+                    (str(INDEX_VERSION),))
+        return conn
+
+    def forget(self, conn, file_id):
+        """
+        Remove what is stored about a file
+        """
+        for table in DETAIL_TABLES:
+            conn.execute('DELETE FROM {} WHERE file_id = ?'.format(table),
+                         (file_id,))
+
+    def store(self, conn, record):
+        """
+        Store the result of scan_file
+        """
+        (path, size, mtime_ns, root_tag, elements, tags, attributes, ids,
+         error) = record
+        row = conn.execute('SELECT id FROM files WHERE path = ?',
+                           (path,)).fetchone()
+        if row is None:
+            file_id = conn.execute(
+                'INSERT INTO files (path) VALUES (?)', (path,)).lastrowid
+        else:
+            file_id = row[0]
+            self.forget(conn, file_id)
+        conn.execute(
+            'UPDATE files SET size = ?, mtime_ns = ?, root_tag = ?, '
+            'elements = ?, error = ? WHERE id = ?',
+            (size, mtime_ns, root_tag, elements, error, file_id))
+        conn.executemany('INSERT INTO tags VALUES (?, ?, ?)',
+                         [(file_id, tag, count)
+                          for tag, count in tags.items()])
+        conn.executemany('INSERT INTO attributes VALUES (?, ?, ?)',
+                         [(file_id, name, count)
+                          for name, count in attributes.items()])
+        conn.executemany('INSERT INTO ids VALUES (?, ?, ?, ?)',
+                         [(file_id,) + entry for entry in ids])
+
+    def stale_files(self, conn):
+        """
+        Returns the files that are new or changed since they were
+        indexed and the ids of the indexed files that are gone
+        """
+        known = {path: (file_id, size, mtime_ns) for
+                 file_id, path, size, mtime_ns in conn.execute(
+                     'SELECT id, path, size, mtime_ns FROM files')}
+        stale = []
+        for xml_path in batch.iter_files([self.folder], self.pattern):
+            xml_path = os.path.abspath(xml_path)
+            try:
+                stat = os.stat(xml_path)
+            except OSError:
+                continue
+            entry = known.pop(xml_path, None)
+            if entry is None or entry[1:] != (stat.st_size,
+                                               stat.st_mtime_ns):
+                stale.append(xml_path)
+        return stale, [entry[0] for entry in known.values()]
+
+    def update(self, progress=None, cancel_event=None, processes=None):
+        """
+        Index the new and changed files and forget the removed ones.
+        Returns the number of files that were indexed, removed and
+        that could not be parsed
+
+        @param progress: Called with (files done, files to do)
+        @param cancel_event: A threading.Event that stops the update
+                             with LoadCancelled. The files indexed so
+                             far are kept
+        @param processes: Number of worker processes (default: one per
+                          core)
+        """
+        if processes is None:
+            processes = os.cpu_count() or 1
+        conn = self.connect()
+        pool = None
+        indexed = failed = 0
+        try:
+            stale, removed = self.stale_files(conn)
+            with conn:
+                for file_id in removed:
+                    self.forget(conn, file_id)
+                    conn.execute('DELETE FROM files WHERE id = ?',
+                                 (file_id,))
+
+            if processes > 1 and len(stale) > 1:
+                # Forking a process that runs GUI threads is not safe
+                context = multiprocessing.get_context('spawn')
+                pool = context.Pool(min(processes, len(stale)))
+                results = pool.imap_unordered(
+                    scan_file, stale, chunksize=settings.BATCH_FILES_PER_TASK)
+            else:
+                results = map(scan_file, stale)
+
+            for record in results:
+                if cancel_event is not None and cancel_event.is_set():
+                    raise LoadCancelled(self.folder)
+                self.store(conn, record)
+                indexed += 1
+                if record[-1] is not None:
+                    failed += 1
+                if indexed % COMMIT_EVERY == 0:
+                    conn.commit()
+                if progress:
+                    progress(indexed, len(stale))
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+            conn.commit()
+            conn.close()
+        return indexed, len(removed), failed
+
+    def query(self, sql, args=()):
+        conn = self.connect()
+        try:
+            return conn.execute(sql, args).fetchall()
+        finally:
+            conn.close()
+
+    def summary(self):
+        """
+        Returns the number of indexed files, their total number of
+        elements and the number of files that could not be parsed
+        """
+        files, elements, failed = self.query(
+            'SELECT COUNT(*), TOTAL(elements), COUNT(error) FROM files')[0]
+        return files, int(elements), failed
+
+    def files(self):
+        """
+        Returns (path, root tag, element count, error) of every indexed
+        file, sorted by path
+        """
+        return self.query('SELECT path, root_tag, elements, error FROM files '
+                          'ORDER BY path')
+
+    def find_id(self, value):
+        """
+        Returns (file path, tag, element path) of the elements whose id
+        is value
+        """
+        return self.query(
+            'SELECT files.path, ids.tag, ids.path FROM ids '
+            'JOIN files ON files.id = ids.file_id WHERE ids.value = ? '
+            'ORDER BY files.path', (value,))
+
+    def vocabulary(self, table):
+        """
+        Returns (name, total count, number of files) of every tag or
+        attribute name in the project, the most common first
+
+        @param table: 'tags' or 'attributes'
+        """
+        column = {'tags': 'tag', 'attributes': 'name'}[table]
+        return self.query(
+            'SELECT {0}, SUM(count), COUNT(*) FROM {1} GROUP BY {0} '
+            'ORDER BY SUM(count) DESC'.format(column, table))
+
+    def search(self, text, limit=None):
+        """
+        Returns up to limit (kind, value, file path, detail) tuples of
+        the ids, tags and attribute names that contain text, ignoring
+        case. Ids that are exactly text come first. The detail is the
+        element path for ids and the number of occurrences in the file
+        for tags and attributes
+        """
+        if limit is None:
+            limit = settings.PROJECT_SEARCH_LIMIT
+        pattern = like_pattern(text)
+        queries = (
+            ('id', 'SELECT ids.value, files.path, ids.path FROM ids '
+                   'JOIN files ON files.id = ids.file_id '
+                   "WHERE ids.value LIKE ? ESCAPE '\\' "
+                   'ORDER BY ids.value = ? DESC, files.path LIMIT ?',
+             (pattern, text)),
+            ('tag', 'SELECT tags.tag, files.path, tags.count FROM tags '
+                    'JOIN files ON files.id = tags.file_id '
+                    "WHERE tags.tag LIKE ? ESCAPE '\\' "
+                    'ORDER BY files.path LIMIT ?', (pattern,)),
+            ('attribute', 'SELECT attributes.name, files.path, '
+                          'attributes.count FROM attributes '
+                          'JOIN files ON files.id = attributes.file_id '
+                          "WHERE attributes.name LIKE ? ESCAPE '\\' "
+                          'ORDER BY files.path LIMIT ?', (pattern,)),
+        )
+        results = []
+        for kind, sql, args in queries:
+            if len(results) >= limit:
+                break
+            rows = self.query(sql, args + (limit - len(results),))
+            results.extend((kind,) + row for row in rows)
+        return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Index the XML files of a folder and search them')
+    parser.add_argument('folder', help='The project folder')
+    parser.add_argument('--index', help='The index file (default: in the '
+                                        'cache directory)')
+    parser.add_argument('--pattern', default=settings.PROJECT_PATTERN,
+                        help='File names to index (default: %(default)s)')
+    parser.add_argument('-j', '--jobs', type=int,
+                        default=os.cpu_count() or 1,
+                        help='Number of worker processes '
+                             '(default: %(default)s)')
+    parser.add_argument('--search', metavar='TEXT',
+                        help='Show the ids, tags and attributes that '
+                             'contain TEXT')
+    parser.add_argument('--find-id', metavar='ID',
+                        help='Show the elements whose id is ID')
+    parser.add_argument('--vocabulary', choices=('tags', 'attributes'),
+                        help='Show the tag or attribute names')
+    args = parser.parse_args(argv)
+
+    index_file = args.index
+    if not index_file:
+        app_location = os.path.dirname(os.path.abspath(__file__))
+        index_file = index_path(os.path.join(app_location, 'cache'),
+                                args.folder)
+    project = ProjectIndex(args.folder, index_file, args.pattern)
+
+    start = time.perf_counter()
+    indexed, removed, failed = project.update(processes=args.jobs)
+    files, elements, errors = project.summary()
+    print('{:,} files indexed, {:,} removed, {:,} failed in {:.2f}s. '
+          '{:,} files with {:,} elements in {}'.format(
+              indexed, removed, failed, time.perf_counter() - start,
+              files, elements, index_file))
+
+    if args.find_id:
+        for path, tag, element_path in project.find_id(args.find_id):
+            print('{}  {}  <{}>'.format(path, element_path, tag))
+    if args.search:
+        for kind, value, path, detail in project.search(args.search):
+            print('{:9} {:30} {}  {}'.format(kind, value, path, detail))
+    if args.vocabulary:
+        for name, count, file_count in project.vocabulary(args.vocabulary):
+            print('{:30} {:10,} in {:,} files'.format(name, count,
+                                                      file_count))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
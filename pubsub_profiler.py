@@ -0,0 +1,216 @@
+"""
+Opt-in instrumentation of the pubsub messages
+
+The profiler is a pubsub notification handler. pubsub tells it when a
+message is sent, before every listener is called and once all
+listeners are done, which is enough to time every listener without
+wrapping them. For every topic it records the number of messages,
+a histogram of the listener times and the listeners that took the
+longest. Topics that differ only by the page id at the end, like
+on_change_<page id>, are counted together.
+
+The time of a listener includes the messages it sends itself. Turn the
+profiler on with settings.PROFILE_PUBSUB. This module does not depend
+on wx
+"""
+
+import json
+import re
+import threading
+import time
+
+from pubsub import pub
+from pubsub.utils.notification import IgnoreNotificationsMixin
+
+PAGE_ID_RE = re.compile(r'_\d+$')
+
+# Upper bounds of the buckets of the listener time histograms, in
+# seconds
+HISTOGRAM_BOUNDS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, float('inf'))
+
+# Number of slowest listeners kept per topic
+SLOWEST_COUNT = 10
+
+
+def topic_key(topic_name):
+    """
+    Returns the name a topic is counted under
+    """
+    return PAGE_ID_RE.sub('_*', topic_name)
+
+
+def bucket_label(position):
+    """
+    Returns a label for a bucket of the histogram
+    """
+    bound = HISTOGRAM_BOUNDS[position]
+    if bound == float('inf'):
+        return '>{:g}ms'.format(HISTOGRAM_BOUNDS[position - 1] * 1000)
+    return '<{:g}ms'.format(bound * 1000)
+
+
+class ListenerStats():
+    """
+    The calls of a listener for a topic
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.total = 0.0
+        self.longest = 0.0
+
+    def add(self, elapsed):
+        self.count += 1
+        self.total += elapsed
+        self.longest = max(self.longest, elapsed)
+
+    def to_dict(self):
+        return {'listener': self.name, 'calls': self.count,
+                'total': self.total, 'max': self.longest}
+
+
+class TopicStats():
+    """
+    The messages of a topic and the calls of its listeners
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.messages = 0
+        self.calls = 0
+        self.total = 0.0
+        self.longest = 0.0
+        self.histogram = [0] * len(HISTOGRAM_BOUNDS)
+        self.listeners = {}
+
+    def add_call(self, listener_name, elapsed):
+        self.calls += 1
+        self.total += elapsed
+        self.longest = max(self.longest, elapsed)
+        for position, bound in enumerate(HISTOGRAM_BOUNDS):
+            if elapsed < bound:
+                self.histogram[position] += 1
+                break
+
+        stats = self.listeners.get(listener_name)
+        if stats is None:
+            stats = self.listeners[listener_name] = ListenerStats(
+                listener_name)
+        stats.add(elapsed)
+
+    def slowest(self, count=SLOWEST_COUNT):
+        """
+        Returns the ListenerStats with the longest calls first
+        """
+        return sorted(self.listeners.values(),
+                      key=lambda stats: stats.longest, reverse=True)[:count]
+
+    def to_dict(self):
+        return {
+            'topic': self.name,
+            'messages': self.messages,
+            'calls': self.calls,
+            'total': self.total,
+            'max': self.longest,
+            'histogram': {bucket_label(position): count for position, count
+                          in enumerate(self.histogram)},
+            'slowest': [stats.to_dict() for stats in self.slowest()],
+        }
+
+
+class PubsubProfiler(IgnoreNotificationsMixin):
+    """
+    Records the messages and listener times of all pubsub topics
+    """
+
+    def __init__(self):
+        self.topics = {}
+        self.started = time.monotonic()
+        self.enabled = False
+        self._lock = threading.Lock()
+        # Every thread has its own stack of messages that are being
+        # sent, messages sent by listeners are nested
+        self._local = threading.local()
+
+    def enable(self):
+        """
+        Start recording. pubsub has no way to remove a single
+        notification handler, so disabling only stops the recording
+        """
+        if not self.enabled:
+            pub.addNotificationHandler(self)
+            pub.setNotificationFlags(sendMessage=True)
+            self.enabled = True
+            self.started = time.monotonic()
+
+    def disable(self):
+        pub.setNotificationFlags(sendMessage=False)
+        self.enabled = False
+
+    def reset(self):
+        """
+        Forget everything that was recorded
+        """
+        with self._lock:
+            self.topics = {}
+            self.started = time.monotonic()
+
+    def notifySend(self, stage, topicObj, pubListener=None):
+        """
+        Called by pubsub before a message is sent ('pre'), before every
+        listener ('in') and after all listeners ('post')
+        """
+        now = time.perf_counter()
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+
+        if stage == 'pre':
+            # [topic name, listener name, start of the listener]
+            stack.append([topicObj.getName(), None, now])
+            return
+
+        name = topicObj.getName()
+        if stage == 'post':
+            # A listener that raised can leave nested entries behind
+            while stack and stack[-1][0] != name:
+                stack.pop()
+            if not stack:
+                return
+
+        entry = stack[-1]
+        with self._lock:
+            key = topic_key(entry[0])
+            stats = self.topics.get(key)
+            if stats is None:
+                stats = self.topics[key] = TopicStats(key)
+            if entry[1] is not None:
+                stats.add_call(entry[1], now - entry[2])
+            if stage == 'post':
+                stats.messages += 1
+
+        if stage == 'post':
+            stack.pop()
+        else:
+            entry[1] = pubListener.typeName()
+            entry[2] = time.perf_counter()
+
+    def snapshot(self):
+        """
+        Returns the recorded statistics as a list of dicts, the topics
+        whose listeners took the most time first
+        """
+        with self._lock:
+            topics = [stats.to_dict() for stats in self.topics.values()]
+        return sorted(topics, key=lambda stats: stats['total'], reverse=True)
+
+    def dump(self, path):
+        """
+        Write the recorded statistics to path as JSON
+        """
+        profile = {'seconds': time.monotonic() - self.started,
+                   'topics': self.snapshot()}
+        with open(path, 'w') as fobj:
+            json.dump(profile, fobj, indent=2)
+        return path
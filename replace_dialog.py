@@ -0,0 +1,244 @@
+import batch
+import multiprocessing
+import os
+import re
+import settings
+import wx
+
+from functools import partial
+from profiler_dialog import add_columns
+from xml_io import LoadCancelled, XmlLoader
+
+# The batch operation of every kind of replacement, with the labels of
+# the find and replace fields
+KINDS = (
+    ('Text', 'replace_text', 'Find (regex)', 'Replace with'),
+    ('Attribute value', 'replace_attribute', 'Find (regex)',
+     'Replace with'),
+    ('Attribute name', 'rename_attribute', 'Attribute', 'New name'),
+)
+
+RESULT_COLUMNS = (('File', 440), ('Matches', 90))
+
+
+class ReplaceDialog(wx.Dialog):
+    """
+    Find and replace in all XML files below a folder
+
+    The files are processed by batch in a pool of worker processes and
+    written atomically. Preview only counts the matches that would
+    change in every file. Pages that have a changed file open pick up
+    the change with their file watcher
+    """
+
+    def __init__(self, parent, folder):
+        """
+        @param parent: The main frame
+        @param folder: The folder to start with
+        """
+        wx.Dialog.__init__(self, parent=parent,
+                           title='Find and Replace in Files', size=(620, 560),
+                           style=wx.DEFAULT_DIALOG_STYLE | wx.RESIZE_BORDER)
+        self.worker = None
+        self.file_count = 0
+        self.changed_count = 0
+        self.match_count = 0
+
+        self.folder_picker = wx.DirPickerCtrl(self, path=folder)
+        self.kind_box = wx.RadioBox(self, label='Replace in',
+                                    choices=[kind[0] for kind in KINDS])
+        self.kind_box.Bind(wx.EVT_RADIOBOX, self.on_kind)
+
+        flex_sizer = wx.FlexGridSizer(2, gap=wx.Size(5, 5))
+        self.xpath_txt = self.add_field(flex_sizer, 'Elements (XPath)', '//*')
+        self.attribute_lbl, self.attribute_txt = self.add_field(
+            flex_sizer, 'Attribute', '', with_label=True)
+        self.find_lbl, self.find_txt = self.add_field(
+            flex_sizer, KINDS[0][2], '', with_label=True)
+        self.replace_lbl, self.replace_txt = self.add_field(
+            flex_sizer, KINDS[0][3], '', with_label=True)
+        flex_sizer.AddGrowableCol(1, 1)
+
+        self.result_list = wx.ListCtrl(self, style=wx.LC_REPORT)
+        add_columns(self.result_list, RESULT_COLUMNS)
+        self.status_lbl = wx.StaticText(self, label='')
+
+        btn_sizer = wx.BoxSizer(wx.HORIZONTAL)
+        self.preview_btn = wx.Button(self, label='Preview')
+        self.preview_btn.Bind(wx.EVT_BUTTON,
+                              partial(self.on_run, dry_run=True))
+        self.replace_btn = wx.Button(self, label='Replace All')
+        self.replace_btn.Bind(wx.EVT_BUTTON,
+                              partial(self.on_run, dry_run=False))
+        self.stop_btn = wx.Button(self, label='Stop')
+        self.stop_btn.Bind(wx.EVT_BUTTON, self.on_stop)
+        self.stop_btn.Disable()
+        for btn in (self.preview_btn, self.replace_btn, self.stop_btn):
+            btn_sizer.Add(btn, 0, wx.ALL, 5)
+
+        main_sizer = wx.BoxSizer(wx.VERTICAL)
+        main_sizer.Add(self.folder_picker, 0, wx.ALL|wx.EXPAND, 5)
+        main_sizer.Add(self.kind_box, 0, wx.ALL|wx.EXPAND, 5)
+        main_sizer.Add(flex_sizer, 0, wx.ALL|wx.EXPAND, 5)
+        main_sizer.Add(btn_sizer, 0, wx.CENTER)
+        main_sizer.Add(self.result_list, 1, wx.ALL|wx.EXPAND, 5)
+        main_sizer.Add(self.status_lbl, 0, wx.ALL|wx.EXPAND, 5)
+        self.SetSizer(main_sizer)
+
+        self.Bind(wx.EVT_CLOSE, self.on_close)
+        self.on_kind(None)
+
+    def add_field(self, sizer, label, value, with_label=False):
+        """
+        Add a labelled text control to the sizer
+        """
+        lbl = wx.StaticText(self, label=label)
+        sizer.Add(lbl, 0, wx.ALL|wx.ALIGN_CENTER_VERTICAL, 5)
+        txt = wx.TextCtrl(self, value=value)
+        sizer.Add(txt, 1, wx.ALL|wx.EXPAND, 5)
+        if with_label:
+            return lbl, txt
+        return txt
+
+    def on_kind(self, event):
+        """
+        Show the fields of the chosen kind of replacement
+        """
+        label, op, find_label, replace_label = KINDS[
+            self.kind_box.GetSelection()]
+        self.find_lbl.SetLabel(find_label)
+        self.replace_lbl.SetLabel(replace_label)
+        self.attribute_lbl.Show(op == 'replace_attribute')
+        self.attribute_txt.Show(op == 'replace_attribute')
+        self.Layout()
+
+    def get_operation(self):
+        """
+        Returns the batch operation of the fields, or None after
+        telling the user what is missing
+        """
+        label, op, find_label, replace_label = KINDS[
+            self.kind_box.GetSelection()]
+        xpath = self.xpath_txt.GetValue().strip() or '//*'
+        find = self.find_txt.GetValue()
+        replace = self.replace_txt.GetValue()
+        if not find:
+            self.status_lbl.SetLabel('{} is empty'.format(find_label))
+            return None
+
+        if op == 'rename_attribute':
+            if not replace.strip():
+                self.status_lbl.SetLabel('New name is empty')
+                return None
+            return op, xpath, (find.strip(), replace.strip())
+
+        try:
+            re.compile(find)
+        except re.error as error:
+            self.status_lbl.SetLabel('Invalid regular expression: {}'.format(
+                error))
+            return None
+        if op == 'replace_attribute':
+            name = self.attribute_txt.GetValue().strip()
+            if not name:
+                self.status_lbl.SetLabel('Attribute is empty')
+                return None
+            return op, xpath, (name, find, replace)
+        return op, xpath, (find, replace)
+
+    def on_run(self, event, dry_run):
+        """
+        Event handler that previews or runs the replacement
+        """
+        if self.worker:
+            return
+        operation = self.get_operation()
+        folder = self.folder_picker.GetPath()
+        if operation is None or not os.path.isdir(folder):
+            return
+
+        self.result_list.DeleteAllItems()
+        self.file_count = self.changed_count = self.match_count = 0
+        self.set_running(True)
+        self.worker = XmlLoader(
+            partial(self.process_folder, folder, operation, dry_run),
+            lambda result, error: wx.CallAfter(self.on_done, dry_run,
+                                               error),
+            lambda done, total: wx.CallAfter(self.on_progress, done, total),
+            name='xml-replacer')
+        self.worker.start()
+
+    def process_folder(self, folder, operation, dry_run, progress=None,
+                       cancel_event=None):
+        """
+        Process the files of the folder. Called on the worker thread
+        """
+        files = list(batch.iter_files([folder], settings.PROJECT_PATTERN))
+        # Forking a process that runs GUI threads is not safe
+        results = batch.process_files(
+            files, [operation], dry_run=dry_run,
+            context=multiprocessing.get_context('spawn'))
+        try:
+            for done, result in enumerate(results, 1):
+                if cancel_event.is_set():
+                    raise LoadCancelled(folder)
+                wx.CallAfter(self.add_result, result)
+                progress(done, len(files))
+        finally:
+            results.close()
+
+    def add_result(self, result):
+        """
+        Show a file that has matches or failed
+        """
+        if not self:
+            return
+        xml_path, count, elapsed, error = result
+        self.file_count += 1
+        if not count and error is None:
+            return
+        if count:
+            self.changed_count += 1
+            self.match_count += count
+        row = self.result_list.GetItemCount()
+        self.result_list.InsertItem(row, xml_path)
+        self.result_list.SetItem(row, 1, error or '{:,}'.format(count))
+        if error is not None:
+            self.result_list.SetItemTextColour(row, wx.Colour(192, 0, 0))
+
+    def on_progress(self, done, total):
+        if self:
+            self.status_lbl.SetLabel('{:,} of {:,} files'.format(done, total))
+
+    def on_done(self, dry_run, error):
+        """
+        Called on the GUI thread once all files are done
+        """
+        if not self:
+            return
+        self.worker = None
+        self.set_running(False)
+        if isinstance(error, LoadCancelled):
+            message = 'Stopped after {:,} files'.format(self.file_count)
+        elif error is not None:
+            print('Unable to replace: {}'.format(error))
+            message = str(error)
+        else:
+            message = '{:,} matches in {:,} of {:,} files {}'.format(
+                self.match_count, self.changed_count, self.file_count,
+                'would change' if dry_run else 'changed')
+        self.status_lbl.SetLabel(message)
+
+    def set_running(self, running):
+        self.preview_btn.Enable(not running)
+        self.replace_btn.Enable(not running)
+        self.stop_btn.Enable(running)
+
+    def on_stop(self, event):
+        if self.worker:
+            self.worker.cancel()
+
+    def on_close(self, event):
+        if self.worker:
+            self.worker.cancel()
+        self.Destroy()
@@ -0,0 +1,320 @@
+"""
+An index for searching an open XML document
+
+The index maps tags, attribute names, attribute name/value pairs and
+the words of the element text to the elements that have them. It is
+built on a background thread after the document is loaded and kept up
+to date from the edit records. This module does not depend on wx
+
+Query syntax:
+    /... or (...)   an XPath expression
+    tag:name        elements with the given tag
+    @name           elements that have the attribute
+    @name=value     elements where the attribute has the value
+    =value          elements that have an attribute with the value
+    anything else   elements whose text contains it at the start of a
+                    word, ignoring case
+"""
+
+import bisect
+import re
+import threading
+
+from collections import defaultdict
+
+WORD_RE = re.compile(r'\w+')
+
+# Number of elements indexed per hold of the document lock
+BUILD_SLICE = 5000
+
+
+def words(text):
+    """
+    Returns the set of lower case words in the text
+    """
+    if not text:
+        return set()
+    return set(WORD_RE.findall(text.lower()))
+
+
+class SearchIndex():
+    """
+    Index over an lxml ElementTree for fast repeated searches
+    """
+
+    def __init__(self, xml_tree, lock):
+        """
+        @param xml_tree: The lxml ElementTree to index
+        @param lock: The lock that guards changes to the tree
+        """
+        self.xml_tree = xml_tree
+        self.lock = lock
+        self.ready = False
+
+        self.by_tag = defaultdict(set)
+        self.by_attribute = defaultdict(set)
+        self.by_value = defaultdict(set)    # keyed by (name, value)
+        self.by_word = defaultdict(set)
+        # The words of by_word in sorted order for prefix lookups. It
+        # is rebuilt when a search needs it after new words were added
+        self._sorted_words = []
+        self._words_changed = False
+
+        self.generation = 0
+        self._cache = {}
+        # The document order keys of the elements, see _order_key. They
+        # are only valid until the next edit
+        self._order_keys = {}
+        self._pending = []
+        self._index_lock = threading.Lock()
+
+    def build(self, cancel_event=None):
+        """
+        Index every element of the tree. Meant to run on a background
+        thread; edits that come in meanwhile are applied afterwards
+        """
+        elements = self.xml_tree.getroot().iter()
+        while True:
+            with self.lock, self._index_lock:
+                count = 0
+                for element in elements:
+                    self._add_element(element)
+                    count += 1
+                    if count == BUILD_SLICE:
+                        break
+            if count < BUILD_SLICE:
+                break
+            if cancel_event is not None and cancel_event.is_set():
+                return
+
+        with self._index_lock:
+            for edit in self._pending:
+                self._apply_edit(edit)
+            self._pending = []
+            self.ready = True
+
+    def start(self):
+        """
+        Build the index on a daemon thread and return the thread
+        """
+        self.cancel_event = threading.Event()
+        thread = threading.Thread(target=self.build, name='search-index',
+                                  args=(self.cancel_event,), daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        """
+        Stop a build that is still running
+        """
+        if hasattr(self, 'cancel_event'):
+            self.cancel_event.set()
+
+    def _add_element(self, element):
+        tag = element.tag
+        if not isinstance(tag, str):
+            # Comments and processing instructions
+            return
+        self.by_tag[tag].add(element)
+        for name, value in element.attrib.items():
+            self.by_attribute[name].add(element)
+            self.by_value[(name, value)].add(element)
+        self._add_words(element, element.text)
+
+    def _add_words(self, element, text):
+        for word in words(text):
+            if word not in self.by_word:
+                self._words_changed = True
+            self.by_word[word].add(element)
+
+    def _remove_element(self, element):
+        if not isinstance(element.tag, str):
+            return
+        self.by_tag[element.tag].discard(element)
+        for name, value in element.attrib.items():
+            self.by_attribute[name].discard(element)
+            self.by_value[(name, value)].discard(element)
+        for word in words(element.text):
+            self.by_word[word].discard(element)
+
+    def update(self, edit):
+        """
+        Update the index for an edit record from the edits module
+        """
+        with self._index_lock:
+            self.generation += 1
+            self._cache = {}
+            self._order_keys = {}
+            if self.ready:
+                self._apply_edit(edit)
+            else:
+                self._pending.append(edit)
+
+    def _apply_edit(self, edit):
+        element = edit.element
+        op = edit.op
+        if op == 'batch':
+            for child in edit.children:
+                self._apply_edit(child)
+        elif op == 'set_text':
+            for word in words(edit.old['text']):
+                self.by_word[word].discard(element)
+            self._add_words(element, element.text)
+        elif op in ('set_attribute', 'delete_attribute'):
+            self._attribute_changed(element, edit.args['name'],
+                                    edit.old['value'])
+        elif op == 'rename_attribute':
+            # Both names changed: the old one is gone and the new one
+            # may have had a value that was overwritten
+            self._attribute_changed(element, edit.args['old_name'],
+                                    edit.old['value'])
+            self._attribute_changed(element, edit.args['new_name'],
+                                    edit.old['new_value'])
+        elif op in ('add_node', 'paste_node', 'insert_node'):
+            for child in element.iter():
+                self._add_element(child)
+        elif op == 'remove_node':
+            for child in element.iter():
+                self._remove_element(child)
+
+    def _attribute_changed(self, element, name, old_value):
+        """
+        Update the entries of an attribute of element whose value was
+        old_value, or that did not exist if it is None
+        """
+        if old_value is not None:
+            self.by_value[(name, old_value)].discard(element)
+        value = element.get(name)
+        if value is None:
+            self.by_attribute[name].discard(element)
+        else:
+            self.by_attribute[name].add(element)
+            self.by_value[(name, value)].add(element)
+
+    def search(self, query):
+        """
+        Returns the list of elements that match the query, in
+        document order
+        """
+        query = query.strip()
+        if not query:
+            return []
+
+        with self._index_lock:
+            key = (query, self.generation)
+            if key in self._cache:
+                return self._cache[key]
+
+        if query.startswith(('/', '(')):
+            with self.lock:
+                result = self.xml_tree.xpath(query)
+            result = [item for item in result if hasattr(item, 'tag')]
+        else:
+            with self._index_lock:
+                if not self.ready:
+                    raise RuntimeError('The search index is not ready yet')
+                result = self._lookup(query)
+            result = self._document_order(result)
+
+        with self._index_lock:
+            if key[1] == self.generation:
+                self._cache[key] = result
+        return result
+
+    def _lookup(self, query):
+        if query.startswith('tag:'):
+            return set(self.by_tag.get(query[4:].strip(), ()))
+        elif query.startswith('@'):
+            name, sep, value = query[1:].partition('=')
+            name = name.strip()
+            if sep:
+                return set(self.by_value.get((name, value.strip()), ()))
+            return set(self.by_attribute.get(name, ()))
+        elif query.startswith('='):
+            value = query[1:].strip()
+            result = set()
+            for name in self.by_attribute:
+                result.update(self.by_value.get((name, value), ()))
+            return result
+        return self._text_lookup(query)
+
+    def _text_lookup(self, query):
+        """
+        Find the elements whose text contains the query. The word index
+        narrows down the candidates, which are then checked directly
+
+        The query has to start at the start of a word, so every word in
+        it but the last one that is followed by more of the query is a
+        whole word and the last one is the start of a word
+        """
+        needle = query.lower()
+        tokens = list(WORD_RE.finditer(needle))
+        candidates = None
+        for match in tokens:
+            token = match.group()
+            if match.end() < len(needle) or match is not tokens[-1]:
+                matches = set(self.by_word.get(token, ()))
+            else:
+                matches = set()
+                for word in self._words_with_prefix(token):
+                    matches.update(self.by_word[word])
+            candidates = matches if candidates is None else (
+                candidates & matches)
+            if not candidates:
+                return set()
+
+        if candidates is None:
+            # The query has no word characters, e.g. punctuation
+            candidates = set()
+            for elements in self.by_tag.values():
+                candidates.update(elements)
+        pattern = re.compile(
+            (r'\b' if WORD_RE.match(needle) else '') + re.escape(needle))
+        return {element for element in candidates
+                if element.text and pattern.search(element.text.lower())}
+
+    def _words_with_prefix(self, prefix):
+        """
+        Returns the indexed words that start with prefix
+        """
+        if self._words_changed:
+            self._sorted_words = sorted(self.by_word)
+            self._words_changed = False
+        start = bisect.bisect_left(self._sorted_words, prefix)
+        found = []
+        for word in self._sorted_words[start:]:
+            if not word.startswith(prefix):
+                break
+            if self.by_word[word]:
+                found.append(word)
+        return found
+
+    def _order_key(self, element):
+        """
+        Returns the positions of the element and its ancestors among
+        their siblings, from the root down, which sort in document
+        order. The keys of all children of a parent are found in one
+        pass and kept, as hits often share their parent
+        """
+        key = self._order_keys.get(element)
+        if key is None:
+            parent = element.getparent()
+            if parent is None:
+                key = ()
+                self._order_keys[element] = key
+            else:
+                parent_key = self._order_key(parent)
+                for position, child in enumerate(parent):
+                    self._order_keys[child] = parent_key + (position,)
+                key = self._order_keys[element]
+        return key
+
+    def _document_order(self, elements):
+        """
+        Sort elements in document order. Only the hits and their
+        ancestors are visited, not the whole document
+        """
+        if len(elements) < 2:
+            return list(elements)
+        with self.lock, self._index_lock:
+            return sorted(elements, key=self._order_key)
@@ -0,0 +1,113 @@
+"""
+Tunable settings for Boomslang
+
+These are plain module level values so that they can be tweaked
+before the application starts, e.g. from a launcher script
+"""
+
+# Autosave
+# Seconds without a new change before the draft is written to disk
+AUTOSAVE_QUIET_PERIOD = 2.0
+# Maximum number of seconds a change may wait for the draft to be
+# written, even if the user never stops typing
+AUTOSAVE_MAX_INTERVAL = 30.0
+
+# Drafts journal
+# Number of journaled edits after which a full snapshot is written
+JOURNAL_SNAPSHOT_EVERY = 1000
+# Seconds after which a snapshot is written if there were any edits
+JOURNAL_SNAPSHOT_INTERVAL = 600.0
+
+# Drafts directory
+# Drafts are deleted, least recently written first, while all of them
+# together take more than this many bytes
+DRAFTS_MAX_SIZE = 2 * 1024 * 1024 * 1024
+# Drafts older than this many seconds are deleted
+DRAFTS_MAX_AGE = 30 * 24 * 60 * 60
+# Write the snapshots of the drafts gzip compressed, and how hard to
+# compress them (1 is fastest, 9 is smallest)
+DRAFTS_COMPRESS_SNAPSHOTS = True
+DRAFTS_COMPRESS_LEVEL = 1
+
+# Loading
+# Number of bytes read and fed to the parser at a time
+LOAD_CHUNK_SIZE = 1024 * 1024
+
+# Huge file mode
+# Files of at least this many bytes are indexed instead of parsed and
+# are opened read-only
+LARGE_FILE_THRESHOLD = 512 * 1024 * 1024
+
+# Tree
+# Number of child items that are added to the tree at a time
+TREE_CHUNK_SIZE = 500
+# Milliseconds to wait for further selection changes before the
+# selected element is shown in the editor panels
+SELECTION_DELAY = 60
+
+# Search
+# Maximum number of search results that are listed
+SEARCH_MAX_RESULTS = 1000
+
+# Preview
+# Number of characters of XML that are added to the preview at a time
+PREVIEW_CHUNK_SIZE = 256 * 1024
+
+# Undo
+# Estimated number of bytes the undo history of a page may use before
+# its oldest edits are dropped
+UNDO_MEMORY_LIMIT = 64 * 1024 * 1024
+# Changes of the same value within this many seconds of each other
+# are undone together
+UNDO_MERGE_INTERVAL = 2.0
+
+# Saving
+# Number of bytes written to disk at a time
+SAVE_CHUNK_SIZE = 4 * 1024 * 1024
+# Compression level for files saved as .gz, .bz2 or .xz, from 1
+# (fastest) to 9 (smallest)
+SAVE_COMPRESSION_LEVEL = 6
+
+# Tab hibernation
+# Seconds a tab has to be inactive before its document is unloaded
+HIBERNATE_AFTER = 15 * 60
+# Estimated bytes the loaded documents may use together before the
+# least recently used inactive tabs are unloaded
+HIBERNATE_MEMORY_BUDGET = 2 * 1024 * 1024 * 1024
+# Estimated bytes of memory a parsed document uses per byte of XML
+TREE_MEMORY_FACTOR = 8
+# Seconds between checks for tabs to hibernate
+HIBERNATE_CHECK_INTERVAL = 30
+
+# Index cache
+# Files of at least this many bytes get their element index cached so
+# they show up right away when they are opened again
+CACHE_MIN_SIZE = 16 * 1024 * 1024
+# Maximum number of bytes used by the cache directory
+CACHE_MAX_SIZE = 1024 * 1024 * 1024
+
+# Batch mode
+# Number of files handed to a worker process at a time
+BATCH_FILES_PER_TASK = 4
+
+# Profiling
+# Record how often every pubsub topic is sent and how long its
+# listeners take. Adds a Messaging Profile window to the Tools menu
+PROFILE_PUBSUB = False
+# File the profile is written to on exit, relative to the application
+PROFILE_DUMP_FILE = 'pubsub_profile.json'
+# Seconds between updates of the Messaging Profile window
+PROFILE_REFRESH_INTERVAL = 1.0
+
+# Watching open files
+# Seconds between checks for changes when inotify is not available
+WATCH_POLL_INTERVAL = 2.0
+# Seconds a changed file has to stay unchanged before it is reloaded,
+# so a file that is still being written is not read half way
+WATCH_SETTLE_DELAY = 0.5
+
+# Project folders
+# File names that are indexed in a project folder
+PROJECT_PATTERN = '*.xml'
+# Maximum number of results of a search in a project
+PROJECT_SEARCH_LIMIT = 500
@@ -0,0 +1,160 @@
+"""
+Undo and redo for the edits of a document
+
+The history holds the Edit records from the edits module rather than
+copies of the document. Every record knows the values from before its
+change, so edits.revert can undo it, and reverting the record that
+produces redoes it. This module does not depend on wx
+"""
+
+import edits
+import settings
+import time
+
+from collections import deque
+
+# Estimated bytes used by an edit record and by a removed element
+EDIT_COST = 500
+ELEMENT_COST = 200
+
+MERGEABLE_OPS = ('set_text', 'set_attribute')
+
+
+def estimate_size(edit):
+    """
+    Returns a rough estimate of the memory held by an edit record
+    """
+    if edit.op == 'batch':
+        return EDIT_COST + sum(estimate_size(child)
+                               for child in edit.children)
+
+    size = EDIT_COST
+    for value in list(edit.args.values()) + list(edit.old.values()):
+        if isinstance(value, str):
+            size += len(value)
+    if edit.op in ('remove_node', 'add_node', 'paste_node', 'insert_node'):
+        # The history keeps the element alive, with all of its children
+        size += ELEMENT_COST * sum(1 for _ in edit.element.iter())
+    return size
+
+
+class UndoHistory():
+    """
+    The undo and redo stacks of a document
+    """
+
+    def __init__(self, memory_limit=None, merge_interval=None):
+        """
+        @param memory_limit: The estimated number of bytes the history
+                             may use before the oldest edits are dropped
+        @param merge_interval: Seconds within which consecutive changes
+                               of the same value are merged into one
+        """
+        if memory_limit is None:
+            memory_limit = settings.UNDO_MEMORY_LIMIT
+        if merge_interval is None:
+            merge_interval = settings.UNDO_MERGE_INTERVAL
+        self.memory_limit = memory_limit
+        self.merge_interval = merge_interval
+
+        # Entries are [edit, estimated size]
+        self.undo_stack = deque()
+        self.redo_stack = []
+        self.size = 0
+        self.last_time = 0
+        self.can_merge = False
+
+    @property
+    def can_undo(self):
+        return bool(self.undo_stack)
+
+    @property
+    def can_redo(self):
+        return bool(self.redo_stack)
+
+    def record(self, edit):
+        """
+        Add an edit the user made. Clears the redo stack
+        """
+        now = time.monotonic()
+        self.redo_stack = []
+
+        if self.can_merge and now - self.last_time < self.merge_interval:
+            last = self.undo_stack[-1]
+            if self._merge(last[0], edit):
+                self.size -= last[1]
+                last[1] = estimate_size(last[0])
+                self.size += last[1]
+                self.last_time = now
+                return
+
+        entry = [edit, estimate_size(edit)]
+        self.undo_stack.append(entry)
+        self.size += entry[1]
+        self.last_time = now
+        self.can_merge = edit.op in MERGEABLE_OPS
+        self._evict()
+
+    def _merge(self, last, edit):
+        """
+        Fold edit into the previous edit if both change the same value.
+        The previous edit keeps its old value, so undoing it restores
+        the value from before the first change
+        """
+        if edit.op != last.op or edit.element is not last.element:
+            return False
+        if edit.op == 'set_attribute' and (
+                edit.args['name'] != last.args['name']):
+            return False
+        last.args = edit.args
+        return True
+
+    def _evict(self):
+        """
+        Drop the oldest edits while the history is over its budget.
+        The newest edit is always kept
+        """
+        while self.size > self.memory_limit and len(self.undo_stack) > 1:
+            edit, size = self.undo_stack.popleft()
+            self.size -= size
+
+    def undo(self):
+        """
+        Undo the newest edit. Returns the Edit record of the change or
+        None if there is nothing to undo. The caller must hold the
+        document lock
+        """
+        if not self.undo_stack:
+            return None
+        edit, size = self.undo_stack.pop()
+        self.size -= size
+        reverted = edits.revert(edit)
+        self.redo_stack.append(reverted)
+        self.can_merge = False
+        return reverted
+
+    def redo(self):
+        """
+        Redo the newest undone edit. Returns the Edit record of the
+        change or None if there is nothing to redo. The caller must
+        hold the document lock
+        """
+        if not self.redo_stack:
+            return None
+        edit = self.redo_stack.pop()
+        reverted = edits.revert(edit)
+        entry = [reverted, estimate_size(reverted)]
+        self.undo_stack.append(entry)
+        self.size += entry[1]
+        self.can_merge = False
+        self._evict()
+        return reverted
+
+    def clear(self):
+        """
+        Forget all edits
+        """
+        self.undo_stack.clear()
+        self.redo_stack = []
+        self.size = 0
+        self.can_merge = False
@@ -1,11 +1,13 @@
-import hashlib
 import os
+import time
 import wx
 
 from io import StringIO
 
 
 wildcard = "XML (*.xml)|*.xml|" \
+    "Compressed XML (*.xml.gz;*.xml.bz2;*.xml.xz)|" \
+    "*.xml.gz;*.xml.bz2;*.xml.xz|" \
     "All files (*.*)|*.*"
 
 def open_file(self, default_dir=os.path.expanduser('~')):
@@ -29,6 +31,22 @@ def open_file(self, default_dir=os.path.expanduser('~')):
     if path:
         return path
 
+def open_folder(self, default_dir=os.path.expanduser('~')):
+    """
+    Asks the user for a project folder. Returns its path or None
+    """
+    path = None
+    dlg = wx.DirDialog(
+        self, message="Choose a project folder",
+        defaultPath=default_dir,
+        style=wx.DD_DEFAULT_STYLE | wx.DD_DIR_MUST_EXIST
+    )
+    if dlg.ShowModal() == wx.ID_OK:
+        path = dlg.GetPath()
+
+    dlg.Destroy()
+    return path
+
 def save_file(self):
     """
     A utility function that allows the user to save their XML file
@@ -48,44 +66,84 @@ def save_file(self):
     if path:
         return path
 
-def get_md5(path):
+def warn_not_saved(title):
     """
-    Returns the MD5 hash of the given file
+    Asks the user if the unsaved changes to a document should be saved.
+    Returns wx.ID_YES, wx.ID_NO or wx.ID_CANCEL
     """
-    hash_md5 = hashlib.md5()
-    with open(path, 'rb') as f:
-        while True:
-            data = f.read(4096)
-            hash_md5.update(data)
-            if not data:
-                break
-    return hash_md5.hexdigest()
+    msg = 'Do you want to save your changes to {}?'.format(title)
+    dlg = wx.MessageDialog(
+        parent=None,
+        message=msg,
+        caption='Warning',
+        style=wx.YES_NO|wx.CANCEL|wx.YES_DEFAULT|wx.ICON_EXCLAMATION
+    )
+    answer = dlg.ShowModal()
+    dlg.Destroy()
+    return answer
 
-def is_save_current(saved_file_path, tmp_file_path):
+
+def warn_open_failed(xml_path, error):
     """
-    Returns a bool that determines if the saved file and the
-    tmp file's MD5 hash are the same
+    Tells the user that the XML file could not be opened
     """
-    saved_md5 = get_md5(saved_file_path)
-    tmp_md5 = get_md5(tmp_file_path)
+    msg = 'Unable to open {}:\n\n{}'.format(xml_path, error)
+    dlg = wx.MessageDialog(
+        parent=None,
+        message=msg,
+        caption='Error',
+        style=wx.OK|wx.ICON_ERROR
+    )
+    dlg.ShowModal()
+    dlg.Destroy()
 
-    return saved_md5 == tmp_md5
 
+def warn_save_failed(xml_path, error):
+    """
+    Tells the user that the XML file could not be saved
+    """
+    msg = 'Unable to save {}:\n\n{}'.format(xml_path, error)
+    dlg = wx.MessageDialog(
+        parent=None,
+        message=msg,
+        caption='Error',
+        style=wx.OK|wx.ICON_ERROR
+    )
+    dlg.ShowModal()
+    dlg.Destroy()
 
-def warn_not_saved():
+
+def warn_read_only():
     """
-    Shows a dialog to warn the user that they need to save their changes
+    Tells the user that a document opened in huge file mode cannot
+    be changed
     """
-    msg = 'Do you want to save your changes?'
+    msg = ('This file was opened in huge file mode, which is read-only. '
+           'Changes cannot be made or saved.')
     dlg = wx.MessageDialog(
         parent=None,
         message=msg,
-        caption='Warning',
-        style=wx.YES_NO|wx.YES_DEFAULT|wx.ICON_EXCLAMATION
+        caption='Read-only',
+        style=wx.OK|wx.ICON_INFORMATION
     )
-    if dlg.ShowModal() == wx.ID_YES:
-        self.save(location=self.full_saved_path)
+    dlg.ShowModal()
+    dlg.Destroy()
+
 
+def warn_huge_file_mode(feature):
+    """
+    Tells the user that a feature needs the whole document in memory,
+    which is not the case in huge file mode
+    """
+    msg = ('{} is not available for files that were opened in huge file '
+           'mode.').format(feature)
+    dlg = wx.MessageDialog(
+        parent=None,
+        message=msg,
+        caption='Huge File Mode',
+        style=wx.OK|wx.ICON_INFORMATION
+    )
+    dlg.ShowModal()
     dlg.Destroy()
 
 
@@ -101,4 +159,134 @@ def warn_nothing_to_save():
         style=wx.OK|wx.ICON_EXCLAMATION
     )
     dlg.ShowModal()
-    dlg.Destroy()
\ No newline at end of file
+    dlg.Destroy()
+
+def ask_to_recover(xml_path):
+    """
+    Asks the user if the unsaved changes to xml_path that were left
+    behind by an earlier session should be recovered
+    """
+    msg = ('Boomslang found unsaved changes to {} from an earlier '
+           'session. Do you want to recover them?').format(xml_path)
+    dlg = wx.MessageDialog(
+        parent=None,
+        message=msg,
+        caption='Recover Changes',
+        style=wx.YES_NO|wx.YES_DEFAULT|wx.ICON_QUESTION
+    )
+    recover = dlg.ShowModal() == wx.ID_YES
+    dlg.Destroy()
+    return recover
+
+def warn_recover_failed(xml_path, journal_path, error):
+    """
+    Tells the user that the unsaved changes to xml_path could not be
+    recovered and where the drafts journal that holds them is kept
+    """
+    msg = ('Unable to recover the unsaved changes to {}:\n\n{}\n\n'
+           'The file is opened without them. The changes are kept in '
+           '{}').format(xml_path, error, journal_path)
+    dlg = wx.MessageDialog(
+        parent=None,
+        message=msg,
+        caption='Recover Changes',
+        style=wx.OK|wx.ICON_WARNING
+    )
+    dlg.ShowModal()
+    dlg.Destroy()
+
+def choose_drafts_to_recover(drafts):
+    """
+    Asks the user which of the drafts left behind by sessions that
+    crashed should be recovered. Returns the chosen drafts, or None if
+    the user cancelled
+    """
+    choices = []
+    for draft in drafts:
+        changes = ('{} edits'.format(draft.edit_count) if not draft.snapshot
+                   else 'edited')
+        choices.append('{} ({}, {})'.format(
+            draft.source, changes,
+            time.strftime('%Y-%m-%d %H:%M', time.localtime(draft.mtime))))
+    msg = ('Boomslang found unsaved changes from earlier sessions. The '
+           'selected files are opened with their changes, the other '
+           'changes are discarded.')
+    dlg = wx.MultiChoiceDialog(None, msg, 'Recover Changes', choices)
+    dlg.SetSelections(list(range(len(choices))))
+    chosen = None
+    if dlg.ShowModal() == wx.ID_OK:
+        chosen = [drafts[index] for index in dlg.GetSelections()]
+    dlg.Destroy()
+    return chosen
+
+
+def ask_external_change(title, can_merge):
+    """
+    Asks the user what to do with the unsaved changes to a document
+    whose file was changed by another program. Returns 'merge' to
+    redo the changes on top of the file, 'reload' to discard them or
+    None to keep the document as it is
+
+    @param can_merge: False if the changes cannot be redone, e.g.
+                      because they were recovered from a draft
+    """
+    msg = ('{} was changed by another program, but you have unsaved '
+           'changes.'.format(title))
+    if can_merge:
+        msg += (' Merge redoes your changes on top of the new file, '
+                'Reload discards them.')
+        style = wx.YES_NO|wx.CANCEL|wx.YES_DEFAULT|wx.ICON_QUESTION
+    else:
+        msg += ' Reload discards your changes.'
+        style = wx.YES_NO|wx.NO_DEFAULT|wx.ICON_QUESTION
+    dlg = wx.MessageDialog(
+        parent=None,
+        message=msg,
+        caption='File Changed',
+        style=style
+    )
+    if can_merge:
+        dlg.SetYesNoCancelLabels('&Merge', '&Reload', '&Keep Mine')
+        answers = {wx.ID_YES: 'merge', wx.ID_NO: 'reload'}
+    else:
+        dlg.SetYesNoLabels('&Reload', '&Keep Mine')
+        answers = {wx.ID_YES: 'reload'}
+    answer = answers.get(dlg.ShowModal())
+    dlg.Destroy()
+    return answer
+
+
+def ask_to_overwrite(title):
+    """
+    Asks the user if a file that was changed by another program since
+    it was opened should be overwritten
+    """
+    msg = ('{} was changed by another program since it was opened. '
+           'Do you want to overwrite it?').format(title)
+    dlg = wx.MessageDialog(
+        parent=None,
+        message=msg,
+        caption='File Changed',
+        style=wx.YES_NO|wx.NO_DEFAULT|wx.ICON_EXCLAMATION
+    )
+    overwrite = dlg.ShowModal() == wx.ID_YES
+    dlg.Destroy()
+    return overwrite
+
+
+def warn_merge_conflicts(title, count):
+    """
+    Tells the user that some of the unsaved changes could not be
+    redone on top of a file that was changed by another program
+    """
+    msg = ('{} of your changes to {} could not be redone because the '
+           'elements they changed are gone. Use Undo to get back to '
+           'your version.').format(count, title)
+    dlg = wx.MessageDialog(
+        parent=None,
+        message=msg,
+        caption='Merge Conflicts',
+        style=wx.OK|wx.ICON_WARNING
+    )
+    dlg.ShowModal()
+    dlg.Destroy()
@@ -0,0 +1,116 @@
+import wx
+import wx.grid as gridlib
+
+from pubsub import pub
+
+
+class GridPanel(wx.Panel):
+    """
+    Base class for the editor panels that show the selected XML element
+    in a virtual grid
+
+    The grid is reused for every element, only the table behind it
+    changes. While the panel is hidden, e.g. on the other notebook tab,
+    selection changes are only remembered and the table is updated
+    once the panel is shown again
+
+    Documents without a tree, i.e. in huge file mode, are shown
+    read-only
+    """
+
+    def __init__(self, parent, page_id, document, **kwargs):
+        wx.Panel.__init__(self, parent, **kwargs)
+        self.page_id = page_id
+        self.document = document
+        self.lock = document.lock
+        self.xml_obj = None
+        self.stale = False
+        self.read_only = document.read_only
+
+        pub.subscribe(self.update_ui, 'ui_updater_{}'.format(self.page_id))
+        self.Bind(wx.EVT_SHOW, self.on_show)
+
+    def update_ui(self, xml_obj):
+        """
+        Show the XML object in the panel
+
+        Called via pubsub
+        """
+        self.xml_obj = xml_obj
+        if self.IsShownOnScreen():
+            self.refresh()
+        else:
+            self.stale = True
+
+    def on_show(self, event):
+        """
+        Event handler that catches up on selection changes that were
+        made while the panel was hidden
+        """
+        if event.IsShown() and self.stale:
+            wx.CallAfter(self.refresh)
+        event.Skip()
+
+    def refresh(self):
+        """
+        Reload the grid's table from the current XML object. Must be
+        implemented by the subclasses, which should call this method
+        """
+        self.stale = False
+
+
+def notify_table_resized(grid, table, old_rows, old_cols):
+    """
+    Tell a grid that rows or columns were added to or removed from the
+    end of its virtual table
+    """
+    messages = []
+    new_rows = table.GetNumberRows()
+    new_cols = table.GetNumberCols()
+
+    if new_rows < old_rows:
+        messages.append(gridlib.GridTableMessage(
+            table, gridlib.GRIDTABLE_NOTIFY_ROWS_DELETED,
+            new_rows, old_rows - new_rows))
+    elif new_rows > old_rows:
+        messages.append(gridlib.GridTableMessage(
+            table, gridlib.GRIDTABLE_NOTIFY_ROWS_APPENDED,
+            new_rows - old_rows))
+
+    if new_cols < old_cols:
+        messages.append(gridlib.GridTableMessage(
+            table, gridlib.GRIDTABLE_NOTIFY_COLS_DELETED,
+            new_cols, old_cols - new_cols))
+    elif new_cols > old_cols:
+        messages.append(gridlib.GridTableMessage(
+            table, gridlib.GRIDTABLE_NOTIFY_COLS_APPENDED,
+            new_cols - old_cols))
+
+    for msg in messages:
+        grid.ProcessTableMessage(msg)
+    grid.ForceRefresh()
+
+
+def get_selected_cells(grid):
+    """
+    Returns a set of (row, col) tuples of all the selected cells of a
+    grid, or of the cursor cell if nothing is selected
+    """
+    cells = set(grid.GetSelectedCells())
+    top_left = grid.GetSelectionBlockTopLeft()
+    bottom_right = grid.GetSelectionBlockBottomRight()
+    for (top, left), (bottom, right) in zip(top_left, bottom_right):
+        for row in range(top, bottom + 1):
+            for col in range(left, right + 1):
+                cells.add((row, col))
+
+    for row in grid.GetSelectedRows():
+        for col in range(grid.GetNumberCols()):
+            cells.add((row, col))
+    for col in grid.GetSelectedCols():
+        for row in range(grid.GetNumberRows()):
+            cells.add((row, col))
+
+    if not cells and grid.GetNumberRows():
+        cells.add((grid.GetGridCursorRow(), grid.GetGridCursorCol()))
+    return cells
@@ -0,0 +1,370 @@
+"""
+A structural diff between two XML documents
+
+The children of two matched elements that differ are paired up by a
+hash of their whole subtree first, so identical subtrees are matched
+and skipped in one step no matter how big they are. The rest are
+paired by id attribute and, for elements without one, by tag and
+position among the remaining siblings with the same tag. Pairs that
+still differ are compared the same way, one level down. Only the
+subtrees that differ are visited again, there is no text diffing.
+Matched children that are in a different order than before make
+their parent MOVED.
+
+patch turns a diff back into edits of the old document, so an open
+document can be brought up to date with its file while the elements
+that did not change, and the tree items showing them, are kept. This
+module does not depend on wx
+"""
+
+import copy
+import edits
+import lxml.etree as ET
+
+from collections import defaultdict, deque
+from itertools import chain
+from xml_io import LoadCancelled
+
+ADDED = 'added'
+REMOVED = 'removed'
+CHANGED = 'changed'
+# The children of the element are in a different order
+MOVED = 'moved'
+
+# Attributes that identify an element among its siblings
+ID_ATTRIBUTES = ('id', '{http://www.w3.org/XML/1998/namespace}id')
+
+
+def normalize(text):
+    """
+    Text that is only whitespace, like indentation, does not count
+    """
+    if text is None or not text.strip():
+        return None
+    return text
+
+
+def signature(element):
+    """
+    Returns what makes up the element itself, without its children
+    """
+    return (element.tag, tuple(sorted(element.attrib.items())),
+            normalize(element.text), normalize(element.tail))
+
+
+def subtree_hash(element):
+    """
+    Returns a hash of the element with all of its children and its
+    tail. Serializing is done by libxml2, which is much faster than
+    walking the subtree in Python
+    """
+    return hash(ET.tostring(element, encoding='unicode'))
+
+
+def element_id(element):
+    """
+    Returns the value of the element's id attribute or None
+    """
+    for name in ID_ATTRIBUTES:
+        value = element.get(name)
+        if value is not None:
+            return value
+    return None
+
+
+class DiffResult():
+    """
+    The differences between an old and a new document
+
+    changes holds (kind, old element, new element) tuples in the
+    order they were found. Added elements only have a new element,
+    with the old parent in their place, and removed elements only
+    have an old element, with the new parent in their place. Moved
+    entries hold the parent whose children were reordered
+    """
+
+    def __init__(self):
+        self.changes = []
+        # The kind of change of the elements of the new document and
+        # the parents in it that lost children
+        self.status = {}
+
+    def __len__(self):
+        return len(self.changes)
+
+    def add(self, kind, old, new):
+        self.changes.append((kind, old, new))
+        if kind in (REMOVED, MOVED):
+            self.status.setdefault(new, CHANGED)
+        else:
+            self.status[new] = kind
+
+    @property
+    def root_changed(self):
+        """
+        True if the root elements differ, so the documents have nothing
+        in common
+        """
+        if not self.changes:
+            return False
+        kind, old, new = self.changes[0]
+        return kind == REMOVED and old.getparent() is None
+
+    def count(self, kind):
+        return sum(1 for change in self.changes if change[0] == kind)
+
+    def changed_ancestors(self):
+        """
+        Returns the set of elements of the new document that contain
+        changes further down
+        """
+        ancestors = set()
+        for element in self.status:
+            for ancestor in element.iterancestors():
+                if ancestor in ancestors:
+                    break
+                ancestors.add(ancestor)
+        return ancestors
+
+
+def match_children(old, new):
+    """
+    Pairs up the children of two matched elements. Returns the list of
+    (old child, new child) pairs whose subtrees differ, the children
+    that were left over on either side and whether the matched
+    children are in a different order
+    """
+    old_children = list(old)
+    new_children = list(new)
+    old_hashes = [subtree_hash(child) for child in old_children]
+    new_hashes = [subtree_hash(child) for child in new_children]
+
+    # Most children are usually unchanged and in the same order, so
+    # the common start and end are skipped right away
+    start = 0
+    end = min(len(old_hashes), len(new_hashes))
+    while start < end and old_hashes[start] == new_hashes[start]:
+        start += 1
+    old_end = len(old_hashes)
+    new_end = len(new_hashes)
+    while (old_end > start and new_end > start and
+           old_hashes[old_end - 1] == new_hashes[new_end - 1]):
+        old_end -= 1
+        new_end -= 1
+
+    # Identical subtrees. The new position of every old child that
+    # is matched is kept, in the order of the old children, to tell
+    # whether they were moved
+    by_hash = defaultdict(deque)
+    for position in range(start, new_end):
+        by_hash[new_hashes[position]].append(position)
+    old_left = []
+    new_positions = {}
+    for position in range(start, old_end):
+        candidates = by_hash.get(old_hashes[position])
+        if candidates:
+            new_positions[position] = candidates.popleft()
+        else:
+            old_left.append(old_children[position])
+    new_left = [new_children[position] for position in
+                sorted(chain.from_iterable(by_hash.values()))]
+    pairs = []
+
+    # Same id
+    by_id = {}
+    for child in new_left:
+        key = element_id(child)
+        if key is not None:
+            by_id.setdefault((child.tag, key), child)
+    matched = set()
+    removed = []
+    no_id = []
+    for child in old_left:
+        key = element_id(child)
+        if key is None:
+            no_id.append(child)
+            continue
+        match = by_id.pop((child.tag, key), None)
+        if match is None:
+            removed.append(child)
+        else:
+            pairs.append((child, match))
+            matched.add(match)
+
+    # Same tag at the same position among the remaining siblings
+    by_tag = defaultdict(deque)
+    for child in new_left:
+        if child not in matched and element_id(child) is None:
+            by_tag[child.tag].append(child)
+    for child in no_id:
+        candidates = by_tag.get(child.tag)
+        if candidates:
+            match = candidates.popleft()
+            pairs.append((child, match))
+            matched.add(match)
+        else:
+            removed.append(child)
+    added = [child for child in new_left if child not in matched]
+
+    if pairs:
+        old_index = {child: position for position, child
+                     in enumerate(old_children)}
+        new_index = {child: position for position, child
+                     in enumerate(new_children)}
+        for old_child, new_child in pairs:
+            new_positions[old_index[old_child]] = new_index[new_child]
+    order = [new_positions[position] for position in sorted(new_positions)]
+    moved = any(earlier > later for earlier, later in zip(order, order[1:]))
+
+    return pairs, removed, added, moved
+
+
+def diff_trees(old_root, new_root, cancel_event=None):
+    """
+    Compares two lxml element trees and returns a DiffResult
+
+    @param old_root: The root element of the old document
+    @param new_root: The root element of the new document
+    @param cancel_event: A threading.Event that stops the diff with
+                         LoadCancelled when it is set
+    """
+    result = DiffResult()
+    if old_root.tag != new_root.tag:
+        result.add(REMOVED, old_root, new_root)
+        result.add(ADDED, old_root, new_root)
+        return result
+
+    pending = deque([(old_root, new_root)])
+    while pending:
+        if cancel_event is not None and cancel_event.is_set():
+            raise LoadCancelled('diff')
+        old, new = pending.popleft()
+
+        if signature(old) != signature(new):
+            result.add(CHANGED, old, new)
+        pairs, removed, added, moved = match_children(old, new)
+        if moved:
+            result.add(MOVED, old, new)
+        pending.extend(pairs)
+        for child in removed:
+            result.add(REMOVED, child, new)
+        for child in added:
+            result.add(ADDED, old, child)
+    return result
+
+
+def is_attached(element, root):
+    """
+    True if element is still part of the document with the given root.
+    lxml keeps removed elements in their document, so the ancestors
+    are checked
+    """
+    for ancestor in element.iterancestors():
+        element = ancestor
+    return element is root
+
+
+def same_order(old, new):
+    """
+    True if the children of old are in the order of the children of
+    new, as far as their tags and ids tell
+    """
+    if len(old) != len(new):
+        return False
+    return all(old_child.tag == new_child.tag and
+               element_id(old_child) == element_id(new_child)
+               for old_child, new_child in zip(old, new))
+
+
+def replace_element(old, new):
+    """
+    Puts a copy of new in the place of old and returns the edits
+    """
+    parent = old.getparent()
+    index = parent.index(old)
+    return [edits.remove_node(old),
+            edits.insert_node(parent, index, copy.deepcopy(new))]
+
+
+def replace_children(old, new):
+    """
+    Replaces the children of old with copies of the children of new
+    and returns the edits
+    """
+    done = [edits.remove_node(child) for child in list(old)]
+    for index, child in enumerate(new):
+        done.append(edits.insert_node(old, index, copy.deepcopy(child)))
+    return done
+
+
+def patch(old_root, result):
+    """
+    Changes the old document of a DiffResult into the new one and
+    returns a batch Edit of everything that was done, or None if the
+    root elements differ and the whole document has to be replaced
+
+    Elements that were only moved among their siblings are not moved
+    one by one, the children of their parent are replaced instead.
+    That is done for every parent that is MOVED, and for the parents
+    whose children were added or removed if that left them out of
+    order. Whitespace-only text is left as it is
+
+    @param old_root: The root element of the old document, which must
+                     not have changed since the diff
+    @param result: The DiffResult of diff_trees(old_root, new root)
+    """
+    done = []
+    # Old parent -> new parent of the elements whose place can have
+    # changed
+    touched = {}
+    # The old parents whose children were reordered
+    moved = set()
+    # New parent -> {new child: position}
+    positions = {}
+    for kind, old, new in result.changes:
+        if kind == CHANGED:
+            if not is_attached(old, old_root):
+                continue
+            if old is not old_root:
+                touched[old.getparent()] = new.getparent()
+            if normalize(old.tail) != normalize(new.tail):
+                done.extend(replace_element(old, new))
+                continue
+            if normalize(old.text) != normalize(new.text):
+                done.append(edits.set_text(old, new.text))
+            for name in list(old.attrib):
+                if name not in new.attrib:
+                    done.append(edits.delete_attribute(old, name))
+            for name, value in new.attrib.items():
+                if old.get(name) != value:
+                    done.append(edits.set_attribute(old, name, value))
+        elif kind == MOVED:
+            if is_attached(old, old_root):
+                touched[old] = new
+                moved.add(old)
+        elif kind == REMOVED:
+            if old is old_root:
+                return None
+            if not is_attached(old, old_root):
+                continue
+            touched[old.getparent()] = new
+            done.append(edits.remove_node(old))
+        elif kind == ADDED:
+            if not is_attached(old, old_root):
+                continue
+            parent = new.getparent()
+            touched[old] = parent
+            if parent not in positions:
+                positions[parent] = {child: index for index, child
+                                     in enumerate(parent)}
+            # The additions of a parent come after its removals, in
+            # document order, so everything before this child in the
+            # new document is in place already
+            index = min(positions[parent][new], len(old))
+            done.append(edits.insert_node(old, index, copy.deepcopy(new)))
+
+    for old, new in touched.items():
+        if is_attached(old, old_root) and (old in moved or
+                                           not same_order(old, new)):
+            done.extend(replace_children(old, new))
+    return edits.batch(done)
@@ -0,0 +1,169 @@
+"""
+Generates synthetic XML documents for benchmarking
+
+The documents are a regular tree of a given depth and fan-out, with a
+given number of attributes per element and a given amount of text per
+leaf. Next to it the root has one wide element with a configurable
+number of leaf children, which is what a long list of records looks
+like in the editor. The same seed always gives the same document. The
+file is written incrementally, so documents of any size can be made
+without holding them in memory. This module does not depend on wx
+
+Example:
+    python xml_generator.py --depth 5 --fanout 12 big.xml
+"""
+
+import argparse
+import lxml.etree as ET
+import random
+import sys
+
+WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do '
+         'eiusmod tempor incididunt ut labore et dolore magna aliqua').split()
+
+
+def make_text(rng, size):
+    """
+    Returns about size characters of words
+    """
+    words = []
+    length = 0
+    while length < size:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return ' '.join(words)[:size]
+
+
+def make_attributes(rng, count, serial):
+    """
+    Returns the attributes of an element. The first one is a unique id
+    """
+    if not count:
+        return {}
+    attributes = {'id': 'e{}'.format(serial)}
+    for position in range(1, count):
+        attributes['attr{}'.format(position)] = rng.choice(WORDS)
+    return attributes
+
+
+class XmlGenerator():
+    """
+    Writes a synthetic document with the given shape
+    """
+
+    def __init__(self, depth=4, fanout=10, attributes=2, text_size=20,
+                 wide=10000, seed=0):
+        """
+        @param depth: Number of levels below the root element
+        @param fanout: Number of children of every element that is not
+                       a leaf
+        @param attributes: Number of attributes per element
+        @param text_size: Number of characters of text per leaf
+        @param wide: Number of leaf children of the wide element
+        @param seed: Seed of the random text and attribute values
+        """
+        self.depth = depth
+        self.fanout = fanout
+        self.attributes = attributes
+        self.text_size = text_size
+        self.wide = wide
+        self.seed = seed
+        self.count = 0
+
+    def params(self):
+        """
+        Returns the settings of the generator as a dict
+        """
+        return {'depth': self.depth, 'fanout': self.fanout,
+                'attributes': self.attributes, 'text_size': self.text_size,
+                'wide': self.wide, 'seed': self.seed}
+
+    def write(self, xml_path):
+        """
+        Write the document to xml_path and return the number of
+        elements in it
+        """
+        rng = random.Random(self.seed)
+        self.count = 1
+        with ET.xmlfile(xml_path, encoding='UTF-8') as xf:
+            xf.write_declaration()
+            with xf.element('root'):
+                xf.write('\n  ')
+                with xf.element('wide', make_attributes(
+                        rng, self.attributes, self.count)):
+                    self.count += 1
+                    for position in range(self.wide):
+                        self.write_leaf(xf, rng, 'item', '\n    ')
+                    xf.write('\n  ')
+                for position in range(self.fanout if self.depth else 0):
+                    xf.write('\n  ')
+                    self.write_node(xf, rng, 1)
+                xf.write('\n')
+        return self.count
+
+    def write_node(self, xf, rng, level):
+        if level == self.depth:
+            self.write_leaf(xf, rng, 'leaf', '')
+            return
+
+        attributes = make_attributes(rng, self.attributes, self.count)
+        self.count += 1
+        indent = '\n' + '  ' * (level + 1)
+        with xf.element('node{}'.format(level), attributes):
+            for position in range(self.fanout):
+                xf.write(indent)
+                self.write_node(xf, rng, level + 1)
+            xf.write('\n' + '  ' * level)
+
+    def write_leaf(self, xf, rng, tag, indent):
+        if indent:
+            xf.write(indent)
+        attributes = make_attributes(rng, self.attributes, self.count)
+        self.count += 1
+        with xf.element(tag, attributes):
+            if self.text_size:
+                xf.write(make_text(rng, self.text_size))
+
+
+def add_arguments(parser):
+    """
+    Add the options of the generator to an argparse parser
+    """
+    parser.add_argument('--depth', type=int, default=4,
+                        help='Levels below the root (default: %(default)s)')
+    parser.add_argument('--fanout', type=int, default=10,
+                        help='Children per element (default: %(default)s)')
+    parser.add_argument('--attributes', type=int, default=2,
+                        help='Attributes per element (default: %(default)s)')
+    parser.add_argument('--text-size', type=int, default=20,
+                        help='Characters of text per leaf '
+                             '(default: %(default)s)')
+    parser.add_argument('--wide', type=int, default=10000,
+                        help='Children of the wide element '
+                             '(default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def from_arguments(args):
+    """
+    Returns an XmlGenerator for the options added by add_arguments
+    """
+    return XmlGenerator(args.depth, args.fanout, args.attributes,
+                        args.text_size, args.wide, args.seed)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Write a synthetic XML document')
+    parser.add_argument('path', help='The file to write')
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    count = from_arguments(args).write(args.path)
+    print('Wrote {:,} elements to {}'.format(count, args.path))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,298 @@
+"""
+Reading and writing XML files without blocking the GUI
+
+The parsing is done with lxml's feed parser so that the file can be
+read in chunks. That allows reporting progress by bytes consumed and
+stopping early when the user cancels. Files are written to a temporary
+file next to the target that replaces it once it is complete, so a
+crash never leaves a truncated file behind. Files ending in .gz, .bz2
+or .xz are decompressed while they are parsed and compressed while
+they are written, without a temporary uncompressed copy. This module
+does not depend on wx
+"""
+
+import bz2
+import gzip
+import lzma
+import lxml.etree as ET
+import os
+import re
+import settings
+import tempfile
+import threading
+
+from xml.sax.saxutils import escape
+
+TAG_NAME_RE = re.compile(r'<([^\s/>]+)')
+
+COMPRESSED_EXTENSIONS = ('.gz', '.bz2', '.xz')
+
+
+class LoadCancelled(Exception):
+    """
+    Raised when loading a file is cancelled before it completes
+    """
+    pass
+
+
+def is_compressed(path):
+    """
+    Returns True if the file at path is compressed, judging by its
+    extension
+    """
+    return path.lower().endswith(COMPRESSED_EXTENSIONS)
+
+
+def open_stream(raw, path, mode='rb'):
+    """
+    Returns a file object that reads or writes the file object raw,
+    decompressing or compressing it according to the extension of path.
+    Closing the returned object does not close raw
+
+    @param raw: The binary file object of path
+    @param path: The path of the file
+    @param mode: 'rb' or 'wb'
+    """
+    level = settings.SAVE_COMPRESSION_LEVEL
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.gz':
+        return gzip.GzipFile(filename='', mode=mode, fileobj=raw,
+                             compresslevel=level)
+    elif extension == '.bz2':
+        return bz2.BZ2File(raw, mode, compresslevel=max(level, 1))
+    elif extension == '.xz':
+        if mode == 'rb':
+            return lzma.LZMAFile(raw, mode)
+        return lzma.LZMAFile(raw, mode, preset=level)
+    return raw
+
+
+def parse_xml(xml_path, progress=None, cancel_event=None, chunk_size=None):
+    """
+    Parses the XML file and returns an lxml ElementTree. Compressed
+    files are decompressed while they are read
+
+    @param xml_path: The path of the file to parse
+    @param progress: Optional callable that is called with
+                     (bytes_read, total_bytes) after every chunk
+    @param cancel_event: Optional threading.Event. Raises LoadCancelled
+                         once it is set
+    @param chunk_size: Number of bytes fed to the parser at a time
+    """
+    if chunk_size is None:
+        chunk_size = settings.LOAD_CHUNK_SIZE
+    total = os.path.getsize(xml_path)
+    parser = ET.XMLParser(huge_tree=True)
+
+    # Progress is measured in bytes of the file, which are compressed
+    # bytes for a compressed file
+    with open(xml_path, 'rb') as raw, open_stream(raw, xml_path) as fobj:
+        while True:
+            if cancel_event is not None and cancel_event.is_set():
+                raise LoadCancelled(xml_path)
+            chunk = fobj.read(chunk_size)
+            if not chunk:
+                break
+            parser.feed(chunk)
+            if progress:
+                progress(raw.tell(), total)
+
+    return parser.close().getroottree()
+
+
+def serialize_xml(xml_tree):
+    """
+    Returns the bytes of the XML document, in its own encoding
+    """
+    encoding = xml_tree.docinfo.encoding or 'UTF-8'
+    return ET.tostring(xml_tree, encoding=encoding, xml_declaration=True)
+
+
+def namespace_declarations(element):
+    """
+    Returns the namespace declarations that lxml writes on a serialized
+    child of element, in the form they appear in the start tag
+    """
+    declarations = []
+    for prefix, uri in element.nsmap.items():
+        uri = escape(uri, {'"': '&quot;'})
+        if prefix is None:
+            declarations.append(' xmlns="{}"'.format(uri))
+        else:
+            declarations.append(' xmlns:{}="{}"'.format(prefix, uri))
+    return declarations
+
+
+def document_parts(xml_tree):
+    """
+    Returns the text that comes before the first child of the root
+    element and the text that comes after its last child
+    """
+    root = xml_tree.getroot()
+    docinfo = xml_tree.docinfo
+    head = ['<?xml version="{}" encoding="{}"?>\n'.format(
+        docinfo.xml_version or '1.0', docinfo.encoding or 'UTF-8')]
+    if docinfo.doctype:
+        head.append(docinfo.doctype + '\n')
+    for sibling in reversed(list(root.itersiblings(preceding=True))):
+        head.append(ET.tostring(sibling, encoding='unicode',
+                                with_tail=False))
+
+    shallow = ET.Element(root.tag, dict(root.attrib), nsmap=root.nsmap)
+    start_tag = ET.tostring(shallow, encoding='unicode')
+    head.append(start_tag[:-2] + '>')
+    head.append(escape(root.text or ''))
+
+    tail = ['</{}>'.format(TAG_NAME_RE.match(start_tag).group(1))]
+    for sibling in root.itersiblings():
+        tail.append(ET.tostring(sibling, encoding='unicode',
+                                with_tail=False))
+    return ''.join(head), ''.join(tail)
+
+
+def serialize_block(element, declarations):
+    """
+    Returns the text of a child of the root element, including its
+    tail. The namespace declarations it inherits from the root are
+    left out again
+    """
+    text = ET.tostring(element, encoding='unicode')
+    if not declarations or not isinstance(element.tag, str):
+        return text
+    end = text.index('>')
+    start_tag = text[:end]
+    for declaration in declarations:
+        start_tag = start_tag.replace(declaration, '', 1)
+    return start_tag + text[end:]
+
+
+def byte_length(text):
+    """
+    Returns the length of the text in the styled text control, which
+    counts UTF-8 bytes
+    """
+    return len(text.encode('utf-8'))
+
+
+def fsync_directory(path):
+    """
+    Make a rename in the directory durable. Not every platform can
+    open a directory, those are skipped
+    """
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def new_file_mode():
+    """
+    Returns the permissions that open() gives a new file under the
+    current umask
+    """
+    # The umask can only be read by setting it
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+def write_file(data, path, progress=None, cancel_event=None,
+               chunk_size=None):
+    """
+    Writes data to path atomically
+
+    The data is written to a temporary file in the same directory,
+    which is flushed to disk and then renamed over the target. Until
+    the rename the old file is left untouched. The data is compressed
+    on the way if path ends in .gz, .bz2 or .xz
+
+    @param data: The bytes to write
+    @param path: The path of the file to write
+    @param progress: Optional callable that is called with
+                     (bytes_written, total_bytes) after every chunk
+    @param cancel_event: Optional threading.Event. Raises LoadCancelled
+                         and keeps the old file once it is set
+    @param chunk_size: Number of bytes written at a time
+    """
+    if chunk_size is None:
+        chunk_size = settings.SAVE_CHUNK_SIZE
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(
+        dir=directory, prefix='.' + os.path.basename(path) + '.',
+        suffix='.tmp')
+
+    try:
+        with os.fdopen(fd, 'wb') as raw:
+            fobj = open_stream(raw, path, 'wb')
+            try:
+                view = memoryview(data)
+                total = len(data)
+                for start in range(0, total, chunk_size):
+                    if cancel_event is not None and cancel_event.is_set():
+                        raise LoadCancelled(path)
+                    fobj.write(view[start:start + chunk_size])
+                    if progress:
+                        progress(min(start + chunk_size, total), total)
+            finally:
+                if fobj is not raw:
+                    # Writes the end of the compressed stream
+                    fobj.close()
+            raw.flush()
+            os.fsync(raw.fileno())
+
+        if os.path.exists(path):
+            mode = os.stat(path).st_mode & 0o7777
+        else:
+            # mkstemp creates the file readable by its owner only
+            mode = new_file_mode()
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    fsync_directory(directory)
+    return path
+
+
+class XmlLoader(threading.Thread):
+    """
+    Runs a load function on a background thread
+
+    The load function is called with the keyword arguments progress
+    and cancel_event, which it should pass on to parse_xml. When it is
+    done on_done is called with (result, error) from the worker
+    thread. error is None on success and a LoadCancelled instance if
+    the load was cancelled
+    """
+
+    def __init__(self, load_func, on_done, on_progress=None,
+                 name='xml-loader'):
+        threading.Thread.__init__(self, name=name, daemon=True)
+        self.load_func = load_func
+        self.on_done = on_done
+        self.on_progress = on_progress
+        self.cancel_event = threading.Event()
+        # The exception the load function raised, once it is done
+        self.error = None
+
+    def cancel(self):
+        """
+        Ask the loader to stop. on_done is still called
+        """
+        self.cancel_event.set()
+
+    def run(self):
+        result = None
+        error = None
+        try:
+            result = self.load_func(progress=self.on_progress,
+                                    cancel_event=self.cancel_event)
+        except Exception as e:
+            error = e
+        self.error = error
+        self.on_done(result, error)
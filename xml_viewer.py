@@ -1,9 +1,17 @@
+import codecs
+import settings
+import threading
 import wx
 import wx.stc as stc
 
+from pubsub import pub
+from xml_io import (byte_length, document_parts, namespace_declarations,
+                    serialize_block)
+
+
 class XmlSTC(stc.StyledTextCtrl):
 
-    def __init__(self, parent, xml_file):
+    def __init__(self, parent):
         stc.StyledTextCtrl.__init__(self, parent)
 
         self.SetLexer(stc.STC_LEX_XML)
@@ -27,20 +35,283 @@ class XmlSTC(stc.StyledTextCtrl):
         # Attribute
         self.StyleSetSpec(stc.STC_H_ATTRIBUTE, "fore:#FF5733,size:%(size)d" % faces)
 
-        with open(xml_file) as fobj:
-            text = fobj.read()
+        self.SetReadOnly(True)
+
+    def append(self, text):
+        """
+        Add text to the end of the read-only control
+        """
+        self.SetReadOnly(False)
+        self.AppendText(text)
+        self.SetReadOnly(True)
+
+    def replace(self, start, length, text):
+        """
+        Replace length bytes at position start with text
+        """
+        self.SetReadOnly(False)
+        self.SetTargetStart(start)
+        self.SetTargetEnd(start + length)
+        self.ReplaceTarget(text)
+        self.SetReadOnly(True)
 
-        self.SetText(text)
+    def clear(self):
+        """
+        Remove all text from the control
+        """
+        self.SetReadOnly(False)
+        self.ClearAll()
+        self.SetReadOnly(True)
 
 
 class XmlViewer(wx.Dialog):
+    """
+    A modeless preview of the XML of an editor page as it currently is
+    in memory
 
-    def __init__(self, xml_file):
-        wx.Dialog.__init__(self, parent=None, title='XML Viewer',
+    The text is serialized a child of the root element at a time on a
+    background thread and added to the control in chunks, so the first
+    screen shows up right away. After an edit only the text of the
+    child of the root that contains the change is serialized again
+    """
+
+    def __init__(self, parent, page):
+        """
+        @param parent: The main frame
+        @param page: The editor page to preview
+        """
+        wx.Dialog.__init__(self, parent=parent,
+                           title='XML Viewer - {}'.format(page.title),
+                           size=(800, 600),
                            style=wx.DEFAULT_DIALOG_STYLE | wx.RESIZE_BORDER)
-        self.xml_view = XmlSTC(self, xml_file)
+        self.page = page
+        self.xml_view = XmlSTC(self)
+
+        # The children of the root element that have been added to the
+        # control, with the length of their text
+        self.blocks = []
+        self.block_index = {}
+        self.lengths = []
+        self.head_length = 0
+        # Blocks that changed after they were serialized but before
+        # they were added to the control
+        self.stale_blocks = set()
+        self.declarations = []
+
+        self.generation = 0
+        self.cancel_event = None
+        self.scroll_to_line = None
 
         sizer = wx.BoxSizer(wx.VERTICAL)
         sizer.Add(self.xml_view, 1, wx.EXPAND)
         self.SetSizer(sizer)
 
+        self.change_topic = 'on_change_{}'.format(page.page_id)
+        self.closed_topic = 'document_closed_{}'.format(page.page_id)
+        pub.subscribe(self.on_change, self.change_topic)
+        pub.subscribe(self.on_document_closed, self.closed_topic)
+        self.Bind(wx.EVT_CLOSE, self.on_close)
+
+        self.render()
+
+    def render(self):
+        """
+        Throw away the current text and serialize the whole document
+        again on a background thread
+        """
+        if self.cancel_event:
+            self.cancel_event.set()
+        self.generation += 1
+        self.cancel_event = threading.Event()
+
+        if self.xml_view.GetLength():
+            self.scroll_to_line = self.xml_view.GetFirstVisibleLine()
+        self.xml_view.clear()
+        self.blocks = []
+        self.block_index = {}
+        self.lengths = []
+        self.head_length = 0
+        self.stale_blocks = set()
+
+        if self.page.large_document:
+            target = self.read_file
+        else:
+            target = self.serialize_tree
+        thread = threading.Thread(
+            target=target, name='xml-preview',
+            args=(self.generation, self.cancel_event), daemon=True)
+        thread.start()
+
+    def serialize_tree(self, generation, cancel_event):
+        """
+        Serialize the children of the root element in chunks and hand
+        them to the GUI thread. Runs on a background thread
+        """
+        with self.page.lock:
+            head, tail = document_parts(self.page.xml_tree)
+            root = self.page.xml_tree.getroot()
+            declarations = namespace_declarations(root)
+            children = root.iterchildren()
+        wx.CallAfter(self.add_head, generation, head, declarations)
+
+        while not cancel_event.is_set():
+            elements = []
+            texts = []
+            size = 0
+            with self.page.lock:
+                for element in children:
+                    text = serialize_block(element, declarations)
+                    elements.append(element)
+                    texts.append(text)
+                    size += len(text)
+                    if size >= settings.PREVIEW_CHUNK_SIZE:
+                        break
+            if elements:
+                wx.CallAfter(self.add_blocks, generation, elements, texts)
+            if size < settings.PREVIEW_CHUNK_SIZE:
+                break
+
+        wx.CallAfter(self.add_text, generation, tail)
+
+    def read_file(self, generation, cancel_event):
+        """
+        Read the text of a file in huge file mode in chunks and hand
+        them to the GUI thread. Runs on a background thread
+        """
+        data = self.page.large_document.data
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        for start in range(0, len(data), settings.PREVIEW_CHUNK_SIZE):
+            if cancel_event.is_set():
+                return
+            chunk = data[start:start + settings.PREVIEW_CHUNK_SIZE]
+            wx.CallAfter(self.add_text, generation, decoder.decode(chunk))
+        wx.CallAfter(self.add_text, generation, decoder.decode(b'', True))
+
+    def is_current(self, generation):
+        """
+        Returns False if the text was produced for an earlier render
+        or the viewer is gone
+        """
+        return generation == self.generation and bool(self)
+
+    def add_head(self, generation, head, declarations):
+        """
+        Add the text that comes before the children of the root element
+        """
+        if not self.is_current(generation):
+            return
+        self.declarations = declarations
+        self.head_length = byte_length(head)
+        self.add_text(generation, head)
+
+    def add_blocks(self, generation, elements, texts):
+        """
+        Add the serialized children of the root element to the control
+        """
+        if not self.is_current(generation):
+            return
+        if self.stale_blocks:
+            with self.page.lock:
+                for position, element in enumerate(elements):
+                    if element in self.stale_blocks:
+                        self.stale_blocks.discard(element)
+                        texts[position] = serialize_block(
+                            element, self.declarations)
+
+        for element, text in zip(elements, texts):
+            self.block_index[element] = len(self.blocks)
+            self.blocks.append(element)
+            self.lengths.append(byte_length(text))
+        self.add_text(generation, ''.join(texts))
+
+    def add_text(self, generation, text):
+        """
+        Add text to the end of the control
+        """
+        if not self.is_current(generation):
+            return
+        self.xml_view.append(text)
+        if (self.scroll_to_line is not None and
+                self.xml_view.GetLineCount() > self.scroll_to_line):
+            self.xml_view.ScrollToLine(self.scroll_to_line)
+            self.scroll_to_line = None
+
+    def changed_blocks(self, edit):
+        """
+        Returns the children of the root element that an edit changed,
+        or None if the whole document has to be rendered again
+        """
+        if edit is None:
+            return None
+        if edit.op == 'batch':
+            blocks = set()
+            for child in edit.children:
+                child_blocks = self.changed_blocks(child)
+                if child_blocks is None:
+                    return None
+                blocks.update(child_blocks)
+            return blocks
+
+        root = self.page.xml_root
+        if edit.op == 'remove_node':
+            element = edit.old['parent']
+            if element is root:
+                return None
+        else:
+            element = edit.element
+            if element is root:
+                return None
+            if (edit.op in ('add_node', 'paste_node', 'insert_node') and
+                    element.getparent() is root):
+                return None
+
+        parent = element.getparent()
+        while parent is not root:
+            if parent is None:
+                # No longer part of the document
+                return set()
+            element = parent
+            parent = element.getparent()
+        return {element}
+
+    def on_change(self, event, edit=None):
+        """
+        Called via pubsub whenever the XML changes. Updates the text
+        of the changed parts of the document
+        """
+        if self.page.large_document:
+            return
+
+        with self.page.lock:
+            blocks = self.changed_blocks(edit)
+            if blocks is None:
+                self.render()
+                return
+
+            for element in blocks:
+                position = self.block_index.get(element)
+                if position is None:
+                    # Not added to the control yet
+                    self.stale_blocks.add(element)
+                    continue
+                text = serialize_block(element, self.declarations)
+                start = self.head_length + sum(self.lengths[:position])
+                self.xml_view.replace(start, self.lengths[position], text)
+                self.lengths[position] = byte_length(text)
+
+    def on_document_closed(self):
+        """
+        Called via pubsub when the previewed page is closed or unloads
+        its document
+        """
+        self.Close()
+
+    def on_close(self, event):
+        """
+        Event handler that stops the rendering and the updates
+        """
+        if self.cancel_event:
+            self.cancel_event.set()
+        pub.unsubscribe(self.on_change, self.change_topic)
+        pub.unsubscribe(self.on_document_closed, self.closed_topic)
+        self.Destroy()